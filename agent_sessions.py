@@ -0,0 +1,341 @@
+import time
+import threading
+import multiprocessing
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from dataset_cache import file_digest
+
+OLLAMA_MODEL = "mistral:7b-instruct-v0.3-q8_0"
+AGENT_TYPE = "openai-tools"
+
+# Caps of one question: ReAct iterations, time of the whole agent run and of a single tool call
+MAX_ITERATIONS = 8
+MAX_EXECUTION_SECONDS = 120
+TOOL_TIMEOUT_SECONDS = 30
+
+# Worker processes kept alive at most, and how long an unused one is kept
+MAX_SESSIONS = 4
+DEFAULT_IDLE_TIMEOUT = 30 * 60
+
+POLL_SECONDS = 0.25
+
+
+def ollama_llm(model: str = OLLAMA_MODEL, temperature: float = 0):
+    from langchain_community.chat_models import ChatOllama
+    return ChatOllama(model=model, temperature=temperature)
+
+
+def read_frame(file_path: str):
+    import pandas as pd
+    if file_path.endswith(('.xlsx', '.xls')):
+        return pd.read_excel(file_path)
+    return pd.read_csv(file_path)
+
+
+def _step_timer(conn):
+    # Defined here so langchain is only imported in the worker process
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class StepTimer(BaseCallbackHandler):
+        """Reports every LLM call and tool call of the agent, with its duration, to the parent."""
+
+        def __init__(self):
+            self._started: Dict[Any, Tuple[str, float]] = {}
+
+        def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+            self._started[run_id] = ("llm", time.perf_counter())
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            self._finish(run_id)
+
+        def on_llm_error(self, error, *, run_id, **kwargs):
+            self._finish(run_id)
+
+        def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+            name = (serialized or {}).get("name", "tool")
+            self._started[run_id] = (name, time.perf_counter())
+            conn.send(("tool_start", name))
+
+        def on_tool_end(self, output, *, run_id, **kwargs):
+            self._finish(run_id, tool=True)
+
+        def on_tool_error(self, error, *, run_id, **kwargs):
+            self._finish(run_id, tool=True)
+
+        def _finish(self, run_id, tool=False):
+            name, started = self._started.pop(run_id, ("?", time.perf_counter()))
+            conn.send(("tool_end" if tool else "step", name, time.perf_counter() - started))
+
+    return StepTimer()
+
+
+def _agent_worker(conn, file_path: str, llm_factory: Callable, agent_type, max_iterations: int,
+                  max_execution_time: float):
+    """
+    Body of a session's worker process: loads the file and builds the agent once,
+    then answers questions sent over conn until it receives None.
+    """
+    import warnings
+    warnings.filterwarnings("ignore")
+
+    try:
+        started = time.perf_counter()
+        df = read_frame(file_path)
+        load_seconds = time.perf_counter() - started
+
+        from langchain_experimental.agents import create_pandas_dataframe_agent
+        started = time.perf_counter()
+        agent_executor = create_pandas_dataframe_agent(
+            llm_factory(),
+            df,
+            agent_type=agent_type,
+            verbose=True,
+            max_iterations=max_iterations,
+            max_execution_time=max_execution_time,
+            allow_dangerous_code=True,
+        )
+        build_seconds = time.perf_counter() - started
+    except Exception as e:
+        conn.send(("failed", f"{type(e).__name__}: {e}"))
+        return
+    conn.send(("ready", load_seconds, build_seconds, len(df)))
+
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        try:
+            result = agent_executor.invoke({"input": message}, {"callbacks": [_step_timer(conn)]})
+            conn.send(("answer", result["output"]))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+class AgentAnswer:
+    """The agent's answer to one question, with the time of every step it took."""
+
+    def __init__(self, question: str):
+        self.question = question
+        self.output: Optional[str] = None
+        self.error: Optional[str] = None
+        # (kind, name, seconds) in the order they finished; kind is "llm" or "tool"
+        self.steps: List[Tuple[str, str, float]] = []
+        self.timings: Dict[str, float] = {}
+        # The worker was started (file read, agent built) for this question
+        self.cold_start = False
+
+    @property
+    def iterations(self) -> int:
+        return sum(1 for kind, _, _ in self.steps if kind == "tool")
+
+    def step_summary(self) -> str:
+        llm = sum(s for kind, _, s in self.steps if kind == "llm")
+        tools = sum(s for kind, _, s in self.steps if kind == "tool")
+        summary = f"{self.timings.get('total', 0):.1f}s: {self.iterations} tool calls ({tools:.1f}s), llm {llm:.1f}s"
+        if "load" in self.timings:
+            summary += f", file read {self.timings['load']:.1f}s, agent built {self.timings['build']:.1f}s"
+        return summary
+
+    def __str__(self) -> str:
+        if self.error is not None:
+            return f"Error during agent execution: {self.error}"
+        return self.output or ""
+
+
+class AgentSession:
+    """One uploaded file's DataFrame and agent executor, living in their own worker process."""
+
+    def __init__(self, digest: str, file_path: str, process, conn):
+        self.digest = digest
+        self.file_path = file_path
+        self.process = process
+        self.conn = conn
+        self.lock = threading.Lock()
+        self.last_used = time.time()
+        self.load_seconds = 0.0
+        self.build_seconds = 0.0
+        self.rows = 0
+        self.questions = 0
+        # Set once the worker reported the file read and the agent built
+        self.ready = False
+
+    @property
+    def alive(self) -> bool:
+        return self.process.is_alive()
+
+    def close(self, kill: bool = False) -> None:
+        if not kill and self.alive:
+            try:
+                self.conn.send(None)
+                self.process.join(5)
+            except (OSError, EOFError):
+                pass
+        if self.alive:
+            self.process.terminate()
+            self.process.join(5)
+        self.conn.close()
+
+
+class AgentSessionManager:
+    """
+    Agent sessions keyed by file content: the first question on a file starts a worker
+    that reads it and builds the agent, later questions on the same content reuse both.
+    Runaway questions are stopped by killing the worker; idle workers are shut down.
+    """
+
+    def __init__(self, llm_factory: Callable = ollama_llm, agent_type=AGENT_TYPE,
+                 max_iterations: int = MAX_ITERATIONS, max_execution_time: float = MAX_EXECUTION_SECONDS,
+                 tool_timeout: float = TOOL_TIMEOUT_SECONDS, max_sessions: int = MAX_SESSIONS,
+                 idle_timeout: float = DEFAULT_IDLE_TIMEOUT):
+        self.llm_factory = llm_factory
+        self.agent_type = agent_type
+        self.max_iterations = max_iterations
+        self.max_execution_time = max_execution_time
+        self.tool_timeout = tool_timeout
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._sessions: "OrderedDict[str, AgentSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def session(self, file_path: str) -> AgentSession:
+        digest = file_digest(file_path)
+        with self._lock:
+            self._evict_idle()
+            session = self._sessions.get(digest)
+            if session is not None and session.alive:
+                self._sessions.move_to_end(digest)
+                session.last_used = time.time()
+                return session
+            if session is not None:
+                session.close(kill=True)
+            session = self._sessions[digest] = self._start(digest, file_path)
+            self._evict_over_capacity()
+            return session
+
+    def _start(self, digest: str, file_path: str) -> AgentSession:
+        context = multiprocessing.get_context()
+        conn, child_conn = context.Pipe()
+        process = context.Process(
+            target=_agent_worker, name=f"agent-{digest[:8]}", daemon=True,
+            args=(child_conn, file_path, self.llm_factory, self.agent_type, self.max_iterations,
+                  self.max_execution_time))
+        process.start()
+        child_conn.close()
+        return AgentSession(digest, file_path, process, conn)
+
+    def _wait_ready(self, session: AgentSession) -> None:
+        while not session.conn.poll(POLL_SECONDS):
+            if not session.alive:
+                raise RuntimeError("agent worker exited while loading the file")
+        message = session.conn.recv()
+        if message[0] == "failed":
+            raise RuntimeError(message[1])
+        _, session.load_seconds, session.build_seconds, session.rows = message
+        session.ready = True
+        print(f"Agent session {session.digest[:8]}: read {session.rows:,} rows in {session.load_seconds:.1f}s, "
+              f"agent built in {session.build_seconds:.1f}s")
+
+    def ask(self, file_path: str, question: str) -> AgentAnswer:
+        answer = AgentAnswer(question)
+        started = time.perf_counter()
+        try:
+            session = self.session(file_path)
+        except Exception as e:
+            answer.error = str(e)
+            return answer
+
+        # One question at a time per worker; other files are answered in parallel
+        with session.lock:
+            try:
+                if not session.ready:
+                    answer.cold_start = True
+                    self._wait_ready(session)
+                    answer.timings["load"] = session.load_seconds
+                    answer.timings["build"] = session.build_seconds
+                session.questions += 1
+                session.conn.send(question)
+                self._collect(session, answer, time.perf_counter())
+            except (RuntimeError, OSError, EOFError) as e:
+                answer.error = str(e) or "agent worker exited"
+                self._drop(session, kill=True)
+            finally:
+                session.last_used = time.time()
+
+        answer.timings["total"] = time.perf_counter() - started
+        print(f"Agent answer: {answer.step_summary()}")
+        return answer
+
+    def _collect(self, session: AgentSession, answer: AgentAnswer, started: float) -> None:
+        # The executor stops itself after max_iterations or max_execution_time, but only between
+        # steps; a hung tool or LLM call is stopped here by killing the worker
+        deadline = started + self.max_execution_time + self.tool_timeout
+        tool_started = None
+        while True:
+            now = time.perf_counter()
+            if tool_started is not None and now - tool_started[1] > self.tool_timeout:
+                raise RuntimeError(f"tool call {tool_started[0]} took longer than {self.tool_timeout:.0f}s")
+            if now > deadline:
+                raise RuntimeError(f"agent took longer than {self.max_execution_time:.0f}s")
+            if not session.conn.poll(POLL_SECONDS):
+                if not session.alive:
+                    raise RuntimeError("agent worker exited")
+                continue
+
+            message = session.conn.recv()
+            kind = message[0]
+            if kind == "tool_start":
+                tool_started = (message[1], time.perf_counter())
+            elif kind == "tool_end":
+                tool_started = None
+                answer.steps.append(("tool", message[1], message[2]))
+            elif kind == "step":
+                answer.steps.append(("llm", message[1], message[2]))
+            elif kind == "answer":
+                answer.output = message[1]
+                return
+            elif kind == "error":
+                answer.error = message[1]
+                return
+
+    def _drop(self, session: AgentSession, kill: bool = False) -> None:
+        with self._lock:
+            if self._sessions.get(session.digest) is session:
+                del self._sessions[session.digest]
+        session.close(kill=kill)
+
+    def _evict_idle(self) -> None:
+        cutoff = time.time() - self.idle_timeout
+        for digest, session in list(self._sessions.items()):
+            if session.last_used < cutoff and not session.lock.locked():
+                del self._sessions[digest]
+                session.close()
+
+    def _evict_over_capacity(self) -> None:
+        for digest, session in list(self._sessions.items()):
+            if len(self._sessions) <= self.max_sessions:
+                break
+            if not session.lock.locked():
+                del self._sessions[digest]
+                session.close()
+
+    def close_all(self) -> None:
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sessions": {
+                    s.digest: {"file": s.file_path, "rows": s.rows, "questions": s.questions,
+                               "idle_seconds": round(time.time() - s.last_used, 1), "alive": s.alive}
+                    for s in self._sessions.values()
+                },
+                "max_sessions": self.max_sessions,
+            }
+
+
+agent_sessions = AgentSessionManager()
@@ -2,6 +2,20 @@ import streamlit as st
 import pandas as pd
 import os
 
+from dataset_cache import DatasetCache
+from ingest import save_upload, chat_database, export_csv
+from batch_ingest import BatchProgress, load_datasets
+from data_pager import streamlit_pager
+from tracing import tracer
+
+# Uploads at or above this size are streamed into the database instead of loaded whole
+STREAMING_THRESHOLD_MB = 100
+# Upper bound on the memory one ingest chunk may use
+MAX_INGEST_MEMORY_MB = 256
+
+# Parsed uploads are cached by content so re-uploading the same file skips parsing
+dataset_cache = DatasetCache()
+
 # Custom CSS to modify the layout and add the vertical separator
 custom_css = """
     <style>
@@ -69,41 +83,40 @@ custom_css = """
 st.markdown(custom_css, unsafe_allow_html=True)
 
 
-# Function to load CSV and generate insights
-def load_file(file):
+# Function to load the uploaded files and generate insights
+def load_file(files):
     print("LOADING FILE ######################################")
     try:
-        # Save the uploaded file to the 'uploads' directory
-        file_path = os.path.join("uploads", file.name)
-        os.makedirs("uploads", exist_ok=True)  # Create the uploads directory if it doesn't exist
-
-        with open(file_path, "wb") as f:
-            f.write(file.getbuffer())  # Save file to local storage
-
-        # Check the file type and handle accordingly
-        if file.name.endswith('.csv'):
-            df = pd.read_csv(file_path)
-        elif file.name.endswith(('.xls', '.xlsx')):  # Support Excel files
-            df = pd.read_excel(file_path)  # Read Excel file
-        else:
-            st.error("Unsupported file format. Please upload a CSV or Excel file.")
-            return None, None, None, None
-
-        # Calculate insights
-        file_size = os.path.getsize(file_path)
-        column_info = df.dtypes.to_frame().reset_index()
-        column_info.columns = ['Column Name', 'Data Type']
-        column_info['Non-Null Count'] = df.notnull().sum().values
-        column_info['Unique Count'] = df.nunique().values
-
-        # Create a summary of the file
-        insights = {
-            "File Size (in bytes)": file_size,
-            "Total Rows": len(df),
-            "Total Columns": len(df.columns)
-        }
-
-        return insights, column_info, df, file_path
+        with tracer.span("load_file", files=len(files)) as span:
+            # Save the uploaded files to the 'uploads' directory
+            os.makedirs("uploads", exist_ok=True)  # Create the uploads directory if it doesn't exist
+            file_paths = []
+            for file in files:
+                if not file.name.endswith(('.csv', '.xls', '.xlsx')):
+                    st.error("Unsupported file format. Please upload CSV or Excel files.")
+                    return None, None, None, None
+                file_path = os.path.join("uploads", file.name)
+                save_upload(file, file_path)  # Save file to local storage in blocks
+                file_paths.append(file_path)
+
+            # Parse (or fetch from the cache) and calculate insights; large files are
+            # streamed chunk by chunk into a database and df is only a preview. Several
+            # files or sheets are parsed in parallel into one table, with progress per file
+            status = st.empty()
+
+            def show_progress(p):
+                lines = p.lines() if isinstance(p, BatchProgress) else []
+                status.text("\n".join([f"Ingested {p.rows:,} rows ({p.rows_per_sec:,.0f} rows/sec)"] + lines))
+
+            dataset = load_datasets(
+                file_paths, dataset_cache, max_memory_mb=MAX_INGEST_MEMORY_MB, on_progress=show_progress,
+                streaming_threshold_mb=STREAMING_THRESHOLD_MB)
+            st.session_state.streamed = dataset.streamed
+            st.session_state.db_path = dataset.db_path
+            st.session_state.file_digest = dataset.digest
+            span.set(rows=(dataset.insights or {}).get("Total Rows"))
+
+        return dataset.insights, dataset.column_info, dataset.df, file_paths[0]
 
     except Exception as e:
         st.error(f"Error: {str(e)}")
@@ -115,8 +128,10 @@ def save_csv(df, file_name):
     print("SAVING")
     # Save updated CSV to the uploads folder
     file_path = os.path.join("uploads", file_name)
-    df.to_csv(file_path, index=False)
-    return file_path
+    # Written chunk by chunk from the cached Parquet copy (or, when streamed, the database)
+    # under the new names, instead of formatting the whole frame at once
+    return export_csv(dataset_cache, st.session_state.get("file_digest"), df, file_path, "data",
+                      st.session_state.db_path if st.session_state.get("streamed") else None)
 
 
 # Streamlit App Structure
@@ -135,13 +150,14 @@ def main():
         st.header("Upload File and CSV Insights")
 
         # File upload widget, support CSV and Excel files
-        uploaded_file = st.file_uploader("Upload your CSV or Excel file", type=["csv", "xls", "xlsx"])
+        uploaded_files = st.file_uploader("Upload your CSV or Excel files", type=["csv", "xls", "xlsx"],
+                                          accept_multiple_files=True)
 
         # Ensure file is loaded only once
-        if uploaded_file is not None:
+        if uploaded_files:
             # Only load the file if it's not already loaded
             if 'df' not in st.session_state:
-                insights, column_info, df, file_path = load_file(uploaded_file)
+                insights, column_info, df, file_path = load_file(uploaded_files)
 
                 if df is not None:
                     # Store file data in session state for further use
@@ -151,7 +167,7 @@ def main():
                     st.session_state.file_path = file_path
 
                     # Notify user about successful file upload
-                    st.success(f"File '{uploaded_file.name}' uploaded successfully.")
+                    st.success(f"File '{', '.join(f.name for f in uploaded_files)}' uploaded successfully.")
 
             else:
                 # Use cached data if file is already loaded
@@ -217,16 +233,14 @@ def main():
                         mime="text/csv"
                     )
 
-                # Show the updated dataframe
-                st.dataframe(df)
-
         # Display Column Information in a table
         st.subheader("Original Column Insights")
         st.dataframe(column_info)
 
-        # Display the original dataframe (truncated to first 10 rows)
+        # Display the data page by page, fetched from the database under the current column names
         st.subheader("Data")
-        st.dataframe(df.head())
+        streamed_db_path = st.session_state.db_path if st.session_state.get("streamed") else None
+        streamlit_pager(chat_database(dataset_cache, st.session_state.get("file_digest"), df, "data", streamed_db_path), "data")
 
 
 # Run the app
@@ -0,0 +1,417 @@
+import os
+import re
+import time
+import queue
+import sqlite3
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import pandas as pd
+
+from dataset_cache import DatasetCache, file_digest
+from frame_memory import shared_frames
+from indexer import likely_key_columns
+from ingest import (DEFAULT_CHUNK_ROWS, DEFAULT_MAX_MEMORY_MB, PREVIEW_ROWS, LoadedDataset,
+                    iter_file_chunks, load_dataset)
+from profiler import ColumnProfiler, DEFAULT_ERROR
+from sqlite_loader import BulkLoader
+from tracing import tracer
+
+SUPPORTED_FILES = ('.csv', '.xls', '.xlsx')
+# Column telling which file (and sheet) a row of a combined table came from
+SOURCE_COLUMN = "source"
+SAMPLE_ROWS = 100
+MAX_WORKERS = 8
+# Parsed chunks waiting for the loader, per worker; workers block once the queue is full
+QUEUED_CHUNKS_PER_WORKER = 2
+COMBINE_MODES = ("auto", "union", "separate")
+
+
+class Source:
+    """One CSV file, or one sheet of a workbook."""
+
+    def __init__(self, path: str, sheet: Optional[str] = None):
+        self.path = path
+        self.sheet = sheet
+
+    @property
+    def name(self) -> str:
+        base = os.path.basename(self.path)
+        return f"{base} [{self.sheet}]" if self.sheet is not None else base
+
+    def __repr__(self):
+        return f"Source({self.name!r})"
+
+
+def list_sources(paths: List[str]) -> List[Source]:
+    """Every supported file under paths (files or folders), one Source per workbook sheet."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(SUPPORTED_FILES))
+        elif path.endswith(SUPPORTED_FILES):
+            files.append(path)
+        else:
+            raise ValueError(f"Unsupported file format: {os.path.basename(path)}. Please upload CSV or Excel files.")
+
+    sources = []
+    for path in files:
+        if path.endswith('.csv'):
+            sources.append(Source(path))
+            continue
+        from openpyxl import load_workbook
+        workbook = load_workbook(path, read_only=True)
+        try:
+            sources += [Source(path, sheet) for sheet in workbook.sheetnames]
+        finally:
+            workbook.close()
+    return sources
+
+
+class SourceProgress:
+    def __init__(self, source: Source):
+        self.name = source.name
+        self.rows = 0
+        self.chunks = 0
+        self.status = "queued"
+        self.error: Optional[str] = None
+
+    def __str__(self):
+        detail = f": {self.error}" if self.error else ""
+        return f"{self.name}: {self.rows:,} rows ({self.status}{detail})"
+
+
+class BatchProgress:
+    def __init__(self, sources: List[Source]):
+        self.sources = [SourceProgress(s) for s in sources]
+        self.started = time.perf_counter()
+
+    @property
+    def rows(self) -> int:
+        return sum(s.rows for s in self.sources)
+
+    @property
+    def finished(self) -> int:
+        return sum(s.status in ("done", "failed") for s in self.sources)
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.elapsed if self.elapsed > 0 else 0.0
+
+    def lines(self) -> List[str]:
+        return [str(s) for s in self.sources]
+
+
+class IngestedTable:
+    def __init__(self, name: str, columns: List[str]):
+        self.name = name
+        self.columns = columns
+        self.sources: List[str] = []
+        # Last column of a table combining several sources
+        self.source_column: Optional[str] = None
+        self.rows = 0
+        self.profiler: Optional[ColumnProfiler] = None
+        self.preview: Optional[pd.DataFrame] = None
+
+    @property
+    def column_info(self) -> pd.DataFrame:
+        return self.profiler.to_frame()
+
+
+# Set in every worker process by _init_worker
+_results = None
+_stop = None
+
+
+def _init_worker(results, stop) -> None:
+    global _results, _stop
+    _results, _stop = results, stop
+
+
+def read_sample(source: Source, rows: int = SAMPLE_ROWS) -> Optional[pd.DataFrame]:
+    """The first rows of a source, for its column names and dtypes; None when it has no rows."""
+    return next(iter(iter_file_chunks(source.path, rows, None, sheet=source.sheet)), None)
+
+
+def _sample_source(source: Source):
+    try:
+        return read_sample(source), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def _parse_source(index: int, source: Source, chunk_rows: int, max_memory_mb: Optional[float],
+                  distinct_error: float) -> None:
+    # Runs in a worker: parse and profile one source, handing its chunks to the loader
+    profiler = ColumnProfiler(error=distinct_error)
+    try:
+        for chunk in iter_file_chunks(source.path, chunk_rows, max_memory_mb, sheet=source.sheet):
+            if _stop.is_set():
+                return
+            profiler.update(chunk)
+            # Blocks while the queue is full, so parsing never runs far ahead of the loader
+            _results.put(("chunk", index, chunk))
+        _results.put(("done", index, profiler))
+    except Exception as e:
+        _results.put(("failed", index, f"{type(e).__name__}: {e}"))
+
+
+def _table_name(table: str, source: Source, taken: set) -> str:
+    base = f"{table}_{re.sub(r'[^0-9A-Za-z]+', '_', os.path.splitext(source.name)[0]).strip('_').lower()}"
+    name, i = base, 2
+    while name in taken:
+        name, i = f"{base}_{i}", i + 1
+    taken.add(name)
+    return name
+
+
+def plan_tables(sources: List[Source], samples: List[Optional[pd.DataFrame]], table: str = "data",
+                combine: str = "auto") -> Dict[str, tuple]:
+    """
+    table name -> (template frame with the table's columns and dtypes, indexes of its sources).
+    "union" puts every source in one table over the union of their columns, plus a
+    SOURCE_COLUMN when there is more than one source; "separate" gives each source its
+    own table; "auto" unions when all sources have the same columns.
+    """
+    if combine not in COMBINE_MODES:
+        raise ValueError(f"Unknown combine mode {combine!r}, expected one of {COMBINE_MODES}")
+    loaded = [i for i, sample in enumerate(samples) if sample is not None]
+    if combine == "auto":
+        column_sets = {frozenset(str(c) for c in samples[i].columns) for i in loaded}
+        combine = "union" if len(column_sets) <= 1 else "separate"
+
+    if combine == "separate":
+        taken = set()
+        return {_table_name(table, sources[i], taken): (samples[i].head(0), [i]) for i in loaded}
+
+    # First source with a column decides its dtype
+    dtypes = {}
+    for i in loaded:
+        for column in samples[i].columns:
+            dtypes.setdefault(column, samples[i][column].dtype)
+    if len(loaded) > 1:
+        dtypes[SOURCE_COLUMN if SOURCE_COLUMN not in dtypes else f"{SOURCE_COLUMN}_file"] = object
+    template = pd.DataFrame({c: pd.Series(dtype=d) for c, d in dtypes.items()})
+    return {table: (template, loaded)}
+
+
+def parallel_ingest(sources: List[Source], db_path: str, table: str = "data", combine: str = "auto",
+                    workers: Optional[int] = None, chunk_rows: int = DEFAULT_CHUNK_ROWS,
+                    max_memory_mb: Optional[float] = DEFAULT_MAX_MEMORY_MB,
+                    on_progress: Optional[Callable[[BatchProgress], Any]] = None,
+                    distinct_error: float = DEFAULT_ERROR) -> Dict[str, IngestedTable]:
+    """
+    Parse and profile sources in a pool of worker processes and bulk load them into
+    SQLite tables of db_path (see plan_tables for the table layout). Chunks flow to the
+    loader through a bounded queue, so at most a few chunks per worker are in memory
+    and the memory budget is split between the workers. Sources that fail to parse are
+    reported in the progress and skipped.
+    """
+    workers = max(1, min(workers or os.cpu_count() or 1, len(sources), MAX_WORKERS))
+    progress = BatchProgress(sources)
+    # spawn rather than the fork default: forking the threaded app server can deadlock the workers
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue(maxsize=workers * QUEUED_CHUNKS_PER_WORKER)
+    stop = context.Event()
+    worker_memory_mb = max_memory_mb / workers if max_memory_mb else max_memory_mb
+
+    # One connection for every table's loader: a second writer on the file would lock it
+    connection = sqlite3.connect(db_path)
+    tables: Dict[str, IngestedTable] = {}
+    loaders: Dict[str, BulkLoader] = {}
+    index_columns: Dict[str, List[str]] = {}
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker,
+                             initargs=(results, stop)) as pool:
+        samples = []
+        for source_progress, (sample, error) in zip(progress.sources, pool.map(_sample_source, sources)):
+            samples.append(sample)
+            if sample is None:
+                # Nothing to load: an empty file or sheet, or one that cannot be parsed
+                source_progress.status = "failed" if error else "done"
+                source_progress.error = error
+        if all(sample is None for sample in samples):
+            raise ValueError("None of the uploaded files has rows: " + "; ".join(progress.lines()))
+
+        source_table = {}
+        for name, (template, indexes) in plan_tables(sources, samples, table, combine).items():
+            tables[name] = IngestedTable(name, [str(c) for c in template.columns])
+            tables[name].sources = [sources[i].name for i in indexes]
+            if len(indexes) > 1:
+                tables[name].source_column = tables[name].columns[-1]
+            loaders[name] = BulkLoader(connection, name)
+            # Creates the table with the template's column types
+            loaders[name].append(template)
+            index_columns[name] = likely_key_columns(pd.concat([samples[i] for i in indexes], ignore_index=True))
+            source_table.update({i: name for i in indexes})
+
+        profilers: Dict[int, ColumnProfiler] = {}
+        # Profiles of the source columns, filled in here as no worker sees them
+        source_profilers = {name: ColumnProfiler(error=distinct_error) for name in tables}
+        pending = set(source_table)
+        futures = {pool.submit(_parse_source, i, sources[i], chunk_rows, worker_memory_mb, distinct_error): i
+                   for i in pending}
+        try:
+            while pending:
+                try:
+                    kind, i, payload = results.get(timeout=1)
+                except queue.Empty:
+                    # A worker that died (e.g. out of memory) never reports back
+                    for future, i in futures.items():
+                        if i in pending and future.done() and future.exception() is not None:
+                            pending.discard(i)
+                            progress.sources[i].status = "failed"
+                            progress.sources[i].error = str(future.exception())
+                    continue
+
+                source_progress = progress.sources[i]
+                ingested = tables[source_table[i]]
+                if kind == "chunk":
+                    chunk = payload
+                    if ingested.source_column is not None:
+                        chunk = chunk.reindex(columns=ingested.columns)
+                        chunk[ingested.source_column] = sources[i].name
+                        source_profilers[ingested.name].update(chunk[[ingested.source_column]])
+                    loaders[ingested.name].append(chunk)
+                    ingested.rows += len(chunk)
+                    if ingested.preview is None or len(ingested.preview) < PREVIEW_ROWS:
+                        head = chunk.head(PREVIEW_ROWS - (0 if ingested.preview is None else len(ingested.preview)))
+                        ingested.preview = head.copy() if ingested.preview is None else \
+                            pd.concat([ingested.preview, head], ignore_index=True)
+                    source_progress.rows += len(chunk)
+                    source_progress.chunks += 1
+                    source_progress.status = "loading"
+                else:
+                    pending.discard(i)
+                    if kind == "done":
+                        profilers[i] = payload
+                        source_progress.status = "done"
+                    else:
+                        source_progress.status = "failed"
+                        source_progress.error = payload
+                if on_progress is not None:
+                    on_progress(progress)
+        finally:
+            # Let blocked workers exit instead of waiting for the loader forever
+            stop.set()
+            while not all(future.done() for future in futures):
+                try:
+                    results.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            for name, loader in loaders.items():
+                loader.finish(index_columns[name] if tables[name].rows else [])
+            connection.close()
+
+    for failed in progress.sources:
+        if failed.status == "failed":
+            print(f"Could not load {failed.name}: {failed.error}")
+    for ingested in tables.values():
+        profiler = ColumnProfiler(error=distinct_error)
+        for i in sorted(profilers):
+            if source_table[i] == ingested.name:
+                profiler.merge(profilers[i])
+        if ingested.source_column is not None:
+            profiler.merge(source_profilers[ingested.name])
+            profiler.rows = ingested.rows
+        ingested.profiler = profiler
+        if ingested.preview is None:
+            ingested.preview = pd.DataFrame(columns=ingested.columns)
+    return tables
+
+
+def load_datasets(paths: List[str], cache: Optional[DatasetCache] = None, workers: Optional[int] = None,
+                  max_memory_mb: Optional[float] = DEFAULT_MAX_MEMORY_MB,
+                  on_progress: Optional[Callable[[BatchProgress], Any]] = None, **single_file) -> LoadedDataset:
+    """
+    load_dataset for a set of uploads: every file and sheet is ingested in parallel (see
+    parallel_ingest), cached under the digests of all the files. Sources with the same
+    columns are combined into one "data" table; otherwise each gets its own table and the
+    largest one becomes "data", the table the app works on. A single CSV or one-sheet workbook goes through load_dataset as before, with
+    single_file passed on to it; on_progress then gets an IngestProgress rather than a
+    BatchProgress.
+    """
+    sources = list_sources(paths)
+    if len(sources) == 1:
+        return load_dataset(sources[0].path, cache, max_memory_mb=max_memory_mb, on_progress=on_progress,
+                            **single_file)
+    if not sources:
+        raise ValueError("No CSV or Excel files to load.")
+
+    files = list(dict.fromkeys(source.path for source in sources))
+    digest = hashlib.blake2b("\0".join(sorted(file_digest(path) for path in files)).encode("utf-8"),
+                             digest_size=16).hexdigest()
+    key = DatasetCache.key(digest)
+    if cache is not None:
+        cached = cache.load_frame(key)
+        # Its database may have been moved on by an upsert (see upsert.upsert_dataset)
+        if cached is not None and os.path.exists(cache.database_path(key)):
+            df, meta = cached
+            return LoadedDataset(meta["insights"], meta["column_info"], shared_frames.share(key, df), digest,
+                                 streamed=True, db_path=cache.database_path(key),
+                                 descriptions=cache.load_descriptions(key))
+
+    result = {}
+
+    def build(path):
+        # Parsing and profiling happen in the worker processes, so this is traced as one span
+        with tracer.span("db_load", source="files", sources=len(sources)) as span:
+            tables = parallel_ingest(sources, path, "data", combine="auto", workers=workers,
+                                     max_memory_mb=max_memory_mb, on_progress=on_progress)
+            if "data" not in tables:
+                largest = max(tables.values(), key=lambda t: t.rows)
+                conn = sqlite3.connect(path)
+                try:
+                    conn.execute(f'ALTER TABLE "{largest.name}" RENAME TO "data"')
+                    conn.commit()
+                finally:
+                    conn.close()
+                tables = {("data" if name == largest.name else name): t for name, t in tables.items()}
+                largest.name = "data"
+            result["tables"] = tables
+            span.set(rows=sum(t.rows for t in tables.values()))
+
+    started = time.perf_counter()
+    if cache is not None:
+        db_path = cache.database(key, build, rebuild=True)
+    else:
+        db_path = os.path.join(os.path.dirname(files[0]), "combined.db")
+        # Start over rather than loading into the tables of an earlier upload
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        build(db_path)
+    ingested = result["tables"]["data"]
+    insights = {
+        "File Size (in bytes)": sum(os.path.getsize(path) for path in files),
+        "Files": len(files),
+        "Sources": len(sources),
+        "Total Rows": ingested.rows,
+        "Total Columns": len(ingested.columns),
+        "Rows/sec": round(ingested.rows / max(time.perf_counter() - started, 1e-9)),
+    }
+    if len(result["tables"]) > 1:
+        # Sources whose columns differ are kept apart rather than unioned into one sparse table
+        insights["Tables"] = ", ".join(f"{t.name} ({', '.join(t.sources)})" for t in result["tables"].values())
+    column_info = ingested.column_info
+    df = ingested.preview
+    if cache is not None:
+        cache.store_frame(key, df, {"insights": insights, "column_info": column_info, "streamed": True})
+    return LoadedDataset(insights, column_info, shared_frames.share(key, df), digest, streamed=True, db_path=db_path)
+
+
+if __name__ == "__main__":
+    # python batch_ingest.py OUT.db FILE_OR_FOLDER... : load them all in parallel, one table per sheet if they differ
+    import sys
+
+    def show(p):
+        print(f"\r{p.finished}/{len(p.sources)} sources, {p.rows:,} rows ({p.rows_per_sec:,.0f} rows/sec)", end="")
+
+    loaded = parallel_ingest(list_sources(sys.argv[2:]), sys.argv[1], on_progress=show)
+    print()
+    for t in loaded.values():
+        print(f"{t.name}: {t.rows:,} rows, {len(t.columns)} columns from {', '.join(t.sources)}")
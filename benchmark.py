@@ -0,0 +1,331 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from dataset_cache import DatasetCache
+from ingest import DEFAULT_STREAMING_THRESHOLD_MB, chat_database, iter_file_chunks, load_dataset
+from indexer import likely_key_columns
+from profiler import ColumnProfiler
+from sqlite_loader import BulkLoader
+
+SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+DEFAULT_SIZES = "10k,100k,1M"
+FORMATS = ("csv", "xlsx")
+# Excel sheets stop at 1,048,576 rows
+MAX_XLSX_ROWS = 1_048_575
+GENERATE_CHUNK_ROWS = 1_000_000
+DATA_DIR = ".benchmark"
+RESULTS_FILE = "benchmark_results.json"
+BASELINE_FILE = "benchmark_baseline.json"
+# A stage regresses when it is this much slower than the baseline, and by more than MIN_DELTA_SECONDS
+TOLERANCE = 0.25
+MIN_DELTA_SECONDS = 0.05
+
+DEPARTMENTS = ["Operations", "Maintenance", "Engineering", "Safety", "Chemistry", "Training",
+               "Security", "Radiation Protection", "Planning", "Administration"]
+CITIES = ["Berlin", "Hamburg", "Munich", "Cologne", "Frankfurt", "Stuttgart", "Dresden", "Leipzig",
+          "Hanover", "Bremen", "Essen", "Dortmund", "Bonn", "Kiel", "Mainz"]
+
+# Questions the benchmark asks, with the SQL the stub LLM "writes" for them
+CANNED_SQL = {
+    "How many rows are there?": "SELECT COUNT(*) FROM data",
+    "How many unique room numbers are there?": "SELECT COUNT(DISTINCT room_number) FROM data",
+    "What is the average salary per department?":
+        "SELECT department, AVG(salary) FROM data GROUP BY department",
+    "Which 10 employees earn the most?": "SELECT employee, salary FROM data ORDER BY salary DESC LIMIT 10",
+    "How many active employees work in each city?":
+        "SELECT city, COUNT(*) FROM data WHERE active = 1 GROUP BY city ORDER BY COUNT(*) DESC",
+    "Show everyone working in Berlin": "SELECT * FROM data WHERE city = 'Berlin'",
+}
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().lower().replace("_", "")
+    for suffix, factor in (("k", 1_000), ("m", 1_000_000)):
+        if text.endswith(suffix):
+            return int(float(text[:-1]) * factor)
+    return int(text)
+
+
+def size_label(rows: int) -> str:
+    if rows >= 1_000_000 and rows % 1_000_000 == 0:
+        return f"{rows // 1_000_000}M"
+    if rows >= 1_000 and rows % 1_000 == 0:
+        return f"{rows // 1_000}k"
+    return str(rows)
+
+
+def synthetic_chunks(rows: int, seed: int = 0) -> Iterator[pd.DataFrame]:
+    """Deterministic employee-style rows: ids, repeated names, categories, dates, numbers and flags."""
+    for start in range(0, rows, GENERATE_CHUNK_ROWS):
+        n = min(GENERATE_CHUNK_ROWS, rows - start)
+        rng = np.random.default_rng([seed, start])
+        yield pd.DataFrame({
+            "id": np.arange(start + 1, start + n + 1),
+            "employee": np.char.add("Employee ", rng.integers(0, max(rows // 20, 10), n).astype(str)),
+            "department": np.array(DEPARTMENTS)[rng.integers(0, len(DEPARTMENTS), n)],
+            "city": np.array(CITIES)[rng.integers(0, len(CITIES), n)],
+            "hire_date": (np.datetime64("2000-01-01") + rng.integers(0, 9000, n)).astype(str),
+            "salary": np.round(rng.normal(55_000, 12_000, n), 2),
+            "room_number": rng.integers(1, 1000, n),
+            "active": rng.random(n) < 0.8,
+        })
+
+
+def make_dataset(path: str, rows: int, seed: int = 0) -> str:
+    """Write rows synthetic rows to a .csv or .xlsx file, chunk by chunk."""
+    tmp = path + ".part"
+    if path.endswith(".csv"):
+        header = True
+        for chunk in synthetic_chunks(rows, seed):
+            chunk.to_csv(tmp, index=False, header=header, mode="w" if header else "a")
+            header = False
+    else:
+        if rows > MAX_XLSX_ROWS:
+            raise ValueError(f"Excel sheets hold at most {MAX_XLSX_ROWS:,} rows")
+        from openpyxl import Workbook
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet("data")
+        first = True
+        for chunk in synthetic_chunks(rows, seed):
+            if first:
+                sheet.append(list(chunk.columns))
+                first = False
+            for row in chunk.itertuples(index=False):
+                sheet.append([v.item() if hasattr(v, "item") else v for v in row])
+        workbook.save(tmp)
+    os.replace(tmp, path)
+    return path
+
+
+def dataset_path(data_dir: str, rows: int, fmt: str, seed: int = 0) -> str:
+    # Generated once per size, format and seed and then reused by later runs
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"synthetic_{size_label(rows)}_{seed}.{fmt}")
+    if not os.path.exists(path):
+        started = time.perf_counter()
+        make_dataset(path, rows, seed)
+        print(f"Generated {path} in {time.perf_counter() - started:.1f}s")
+    return path
+
+
+class StubLLM:
+    """
+    Deterministic stand-in for the llama.cpp model: writes the canned SQL for a known
+    question and a fixed-length answer for the synthesis step. No weights, no network.
+    """
+
+    def __init__(self, canned_sql: Optional[Dict[str, str]] = None, answer_tokens: int = 32,
+                 default_sql: str = "SELECT COUNT(*) FROM data"):
+        self.canned_sql = dict(CANNED_SQL if canned_sql is None else canned_sql)
+        self.answer_tokens = answer_tokens
+        self.default_sql = default_sql
+        self.calls = 0
+
+    def _answer(self, kwargs) -> List[str]:
+        context = str(kwargs.get("context_str", ""))
+        words = f"The result has {len(context)} characters of data.".split()
+        words += ["ok"] * max(self.answer_tokens - len(words), 0)
+        return [w + " " for w in words]
+
+    def _completion(self, kwargs) -> List[str]:
+        # The synthesis prompt is the one with the query result in it
+        if "context_str" in kwargs:
+            return self._answer(kwargs)
+        sql = self.canned_sql.get(kwargs.get("query_str"), self.default_sql)
+        return ["SQLQuery: "] + [w + " " for w in sql.split()] + ["\nSQLResult: "]
+
+    def predict(self, prompt, **kwargs) -> str:
+        self.calls += 1
+        return "".join(self._completion(kwargs)).strip()
+
+    def stream(self, prompt, **kwargs):
+        self.calls += 1
+        yield from self._completion(kwargs)
+
+
+class Timer:
+    def __init__(self):
+        self.seconds: Dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    def run(self, stage: str, fn, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+
+def bench_ingest_stages(file_path: str, db_path: str, timer: Timer) -> int:
+    """The three parts of a streamed upload, timed separately: parse, profile, load into SQLite."""
+    profiler = ColumnProfiler()
+    loader = BulkLoader(db_path, "data")
+    rows = 0
+    index_columns = []
+    chunks = iter_file_chunks(file_path)
+    try:
+        while True:
+            started = time.perf_counter()
+            chunk = next(chunks, None)
+            timer.add("parse", time.perf_counter() - started)
+            if chunk is None:
+                break
+            if rows == 0:
+                index_columns = likely_key_columns(chunk)
+            timer.run("profile", profiler.update, chunk)
+            timer.run("load_sql", loader.append, chunk)
+            rows += len(chunk)
+    finally:
+        timer.run("load_sql", loader.finish, index_columns)
+    timer.run("profile", profiler.to_frame)
+    return rows
+
+
+def bench_queries(db_path: str, timer: Timer) -> None:
+    """
+    Each canned query through the SQL guard, then, with llama_index installed, the whole
+    pipeline, answering in prose and with the result table.
+    """
+    from sqlalchemy import create_engine
+    from sql_guard import SQLGuard
+
+    engine = create_engine(f"sqlite:///{db_path}")
+    guard = SQLGuard(engine)
+    for i, sql in enumerate(CANNED_SQL.values()):
+        timer.run(f"sql_{i + 1}", guard.run, sql)
+
+    try:
+        from llama_index.core import SQLDatabase
+        from sql_pipeline import TABLE, SQLChatPipeline
+    except ImportError:
+        print("  llama_index is not installed, skipping the pipeline stage")
+        engine.dispose()
+        return
+    # Fast path off, so every question goes through text-to-SQL, execution and synthesis
+    pipeline = SQLChatPipeline(SQLDatabase(engine, include_tables=["data"]), ["data"], StubLLM(),
+                               fast_path=False, auto_index=False)
+    try:
+        for i, question in enumerate(CANNED_SQL):
+            # Answered in prose, then with the result table, without the synthesis call
+            for stage, mode in ((f"pipeline_{i + 1}", None), (f"pipeline_table_{i + 1}", TABLE)):
+                answer = timer.run(stage, pipeline.query, question, mode)
+                if answer.error is not None:
+                    # A failed answer is timed on its error path, which would hide a regression
+                    raise RuntimeError(f"{stage} failed for {question!r}: {answer.error}")
+    finally:
+        engine.dispose()
+
+
+def bench_dataset(file_path: str, work_dir: str, streaming_threshold_mb: float) -> Tuple[int, Dict[str, float]]:
+    timer = Timer()
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+
+    rows = bench_ingest_stages(file_path, os.path.join(work_dir, "stages.db"), timer)
+
+    # The app's own path, as load_file and df_to_sql / store_df_in_db run it, from an empty cache
+    cache = DatasetCache(os.path.join(work_dir, "cache"))
+    dataset = timer.run("load_file", load_dataset, file_path, cache, streaming_threshold_mb)
+    timer.run("load_file_cached", load_dataset, file_path, cache, streaming_threshold_mb)
+    db_path = timer.run("df_to_sql", chat_database, cache, dataset.digest, dataset.df, "data",
+                        dataset.db_path if dataset.streamed else None)
+
+    bench_queries(db_path, timer)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return rows, timer.seconds
+
+
+def run(sizes: List[int], formats: List[str], data_dir: str = DATA_DIR,
+        streaming_threshold_mb: float = DEFAULT_STREAMING_THRESHOLD_MB) -> Dict:
+    results = {}
+    for fmt in formats:
+        for rows in sizes:
+            if fmt == "xlsx" and rows > MAX_XLSX_ROWS:
+                print(f"Skipping xlsx at {size_label(rows)} rows, over the Excel row limit")
+                continue
+            name = f"{fmt}-{size_label(rows)}"
+            file_path = dataset_path(data_dir, rows, fmt)
+            print(f"{name}: {os.path.getsize(file_path) / 1024 ** 2:,.1f} MB")
+            loaded_rows, seconds = bench_dataset(file_path, os.path.join(data_dir, "work"), streaming_threshold_mb)
+            for stage, s in seconds.items():
+                print(f"  {stage:<18} {s:9.3f}s")
+            results[name] = {"rows": loaded_rows, "file_bytes": os.path.getsize(file_path),
+                             "seconds": {stage: round(s, 4) for stage, s in seconds.items()}}
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "pandas": pd.__version__,
+        # sql_<n> and pipeline_<n> time the n-th of these
+        "questions": list(CANNED_SQL),
+        "results": results,
+    }
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float = TOLERANCE,
+            min_delta: float = MIN_DELTA_SECONDS) -> List[Tuple[str, str, float, float]]:
+    """(dataset, stage, baseline seconds, current seconds) of every stage that got slower."""
+    regressions = []
+    for name, result in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            continue
+        for stage, now in result["seconds"].items():
+            before = base["seconds"].get(stage)
+            if before is not None and now > before * (1 + tolerance) and now - before > min_delta:
+                regressions.append((name, stage, before, now))
+    return regressions
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Time parsing, profiling, SQLite loading and queries "
+                                                 "on synthetic data, with a stub LLM")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                        help=f"comma separated row counts like 10k,1M, or 'all' for {','.join(map(size_label, SIZES))}")
+    parser.add_argument("--formats", default="csv,xlsx")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--output", default=RESULTS_FILE)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    sizes = SIZES if args.sizes == "all" else [parse_size(s) for s in args.sizes.split(",")]
+    formats = [f for f in args.formats.split(",") if f in FORMATS]
+    try:
+        report = run(sizes, formats, args.data_dir)
+    except RuntimeError as e:
+        print(f"FAIL {e}")
+        sys.exit(1)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.save_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        print(f"Baseline saved to {args.baseline}")
+        sys.exit(0)
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save-baseline to create one")
+        sys.exit(0)
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(report, baseline, args.tolerance)
+    for name, stage, before, now in regressions:
+        print(f"REGRESSION {name} {stage}: {before:.3f}s -> {now:.3f}s ({now / before - 1:+.0%})")
+    print(f"{len(regressions)} regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,226 @@
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from indexer import get_indexer
+from sqlite_loader import quote_identifier
+
+DEFAULT_PAGE_ROWS = 100
+CACHED_PAGES = 8
+FILTER_OPS = ("=", "!=", "<", "<=", ">", ">=", "contains")
+
+
+class DataPager:
+    """
+    Pages of a SQLite table in a chosen order, with optional filters, fetched with keyset
+    pagination: each page continues from the (sort value, rowid) where the previous one
+    ended, so page 10,000 costs the same as page 1. Visited pages and the page after the
+    current one (fetched in the background) are cached.
+    """
+
+    def __init__(self, db_path: str, table: str, page_rows: int = DEFAULT_PAGE_ROWS,
+                 sort: Optional[str] = None, descending: bool = False,
+                 filters: Optional[List[Tuple[str, str, Any]]] = None):
+        for _, op, _ in filters or []:
+            if op not in FILTER_OPS:
+                raise ValueError(f"Unknown filter {op!r}, expected one of {FILTER_OPS}")
+        self.db_path = db_path
+        self.table = table
+        self.page_rows = page_rows
+        self.sort = sort
+        self.descending = descending
+        self.filters = list(filters or [])
+        # Page number -> (sort value, rowid) of its last row
+        self._ends: Dict[int, Tuple[Any, int]] = {}
+        self._pages: "OrderedDict[int, pd.DataFrame]" = OrderedDict()
+        self._total: Optional[int] = None
+        self._lock = threading.Lock()
+        self._prefetching: Optional[threading.Thread] = None
+        if sort is not None or self.filters:
+            # Views sorted or filtered on the same columns again and again get an index
+            get_indexer(db_path, table).observe(self._select_sql([c for c, _, _ in self.filters]))
+
+    def _select_sql(self, filter_columns: List[str]) -> str:
+        where = " AND ".join(f"{quote_identifier(c)} = ?" for c in filter_columns)
+        return (f"SELECT * FROM {quote_identifier(self.table)}{' WHERE ' + where if where else ''} "
+                f"ORDER BY {self._order_sql()}")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+
+    def _filter_sql(self) -> Tuple[List[str], List[Any]]:
+        clauses, params = [], []
+        for column, op, value in self.filters:
+            c = quote_identifier(column)
+            if op == "contains":
+                clauses.append(f"CAST({c} AS TEXT) LIKE ? ESCAPE '\\'")
+                escaped = str(value).replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                params.append(f"%{escaped}%")
+            else:
+                clauses.append(f"{c} {op} ?")
+                params.append(value)
+        return clauses, params
+
+    def _after_sql(self, end: Tuple[Any, int]) -> Tuple[str, List[Any]]:
+        # Rows after end in the order "sort value (NULLs last), rowid"
+        value, rowid = end
+        if self.sort is None:
+            return "rowid > ?", [rowid]
+        c = quote_identifier(self.sort)
+        if value is None:
+            return f"({c} IS NULL AND rowid > ?)", [rowid]
+        beyond = "<" if self.descending else ">"
+        return f"({c} {beyond} ? OR ({c} = ? AND rowid > ?) OR {c} IS NULL)", [value, value, rowid]
+
+    def _order_sql(self) -> str:
+        if self.sort is None:
+            return "rowid"
+        c = quote_identifier(self.sort)
+        return f"{c} IS NULL, {c} {'DESC' if self.descending else 'ASC'}, rowid"
+
+    def _fetch(self, page: int) -> pd.DataFrame:
+        clauses, params = self._filter_sql()
+        offset = 0
+        with self._lock:
+            end = self._ends.get(page - 1)
+        if end is not None:
+            after, after_params = self._after_sql(end)
+            clauses.append(after)
+            params += after_params
+        elif page > 0:
+            # Jumped past pages never visited: fall back to OFFSET once, later pages continue by key
+            offset = page * self.page_rows
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        sort_value = quote_identifier(self.sort) if self.sort else "NULL"
+        sql = (f"SELECT rowid AS __rowid, {sort_value} AS __sort, * FROM {quote_identifier(self.table)}{where} "
+               f"ORDER BY {self._order_sql()} LIMIT {self.page_rows} OFFSET {offset}")
+        conn = self._connect()
+        try:
+            df = pd.read_sql_query(sql, conn, params=params)
+        finally:
+            conn.close()
+        if len(df):
+            last = df["__sort"].iloc[-1]
+            if pd.isna(last):
+                last = None
+            elif hasattr(last, "item"):
+                # numpy scalar -> Python value sqlite3 can bind
+                last = last.item()
+            with self._lock:
+                self._ends[page] = (last, int(df["__rowid"].iloc[-1]))
+        return df.drop(columns=["__rowid", "__sort"])
+
+    def _remember(self, page: int, df: pd.DataFrame) -> None:
+        with self._lock:
+            self._pages[page] = df
+            self._pages.move_to_end(page)
+            while len(self._pages) > CACHED_PAGES:
+                self._pages.popitem(last=False)
+
+    def _cached(self, page: int) -> Optional[pd.DataFrame]:
+        with self._lock:
+            df = self._pages.get(page)
+            if df is not None:
+                self._pages.move_to_end(page)
+            return df
+
+    def _prefetch(self, page: int) -> None:
+        if self._cached(page) is not None or page >= self.page_count:
+            return
+        if self._prefetching is not None and self._prefetching.is_alive():
+            return
+        self._prefetching = threading.Thread(target=lambda: self._remember(page, self._fetch(page)), daemon=True)
+        self._prefetching.start()
+
+    def page(self, page: int) -> pd.DataFrame:
+        """Rows of page number page (from 0)."""
+        page = max(0, min(page, self.page_count - 1))
+        df = self._cached(page)
+        if df is None:
+            if self._prefetching is not None:
+                # The page may be the one being fetched in the background right now
+                self._prefetching.join()
+                df = self._cached(page)
+            if df is None:
+                df = self._fetch(page)
+                self._remember(page, df)
+        self._prefetch(page + 1)
+        return df
+
+    @property
+    def total_rows(self) -> int:
+        if self._total is None:
+            clauses, params = self._filter_sql()
+            where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+            conn = self._connect()
+            try:
+                self._total = conn.execute(f"SELECT COUNT(*) FROM {quote_identifier(self.table)}{where}",
+                                           params).fetchone()[0]
+            finally:
+                conn.close()
+        return self._total
+
+    @property
+    def page_count(self) -> int:
+        return max(1, -(-self.total_rows // self.page_rows))
+
+    def columns(self) -> List[str]:
+        conn = self._connect()
+        try:
+            return [row[1] for row in conn.execute(f"PRAGMA table_info({quote_identifier(self.table)})")]
+        finally:
+            conn.close()
+
+
+def parse_filter(text: str) -> Optional[Tuple[str, Any]]:
+    """("op", value) from what a user typed into a filter box: "> 10", "= Berlin", "Berlin" (contains)."""
+    text = (text or "").strip()
+    if not text:
+        return None
+    for op in sorted(FILTER_OPS[:-1], key=len, reverse=True):
+        if text.startswith(op):
+            value = text[len(op):].strip()
+            try:
+                return op, float(value) if "." in value else int(value)
+            except ValueError:
+                return op, value
+    return "contains", text
+
+
+def streamlit_pager(db_path: str, table: str, key: str = "pager", page_rows: int = DEFAULT_PAGE_ROWS) -> None:
+    """Browse table page by page in Streamlit, with sort and filter controls."""
+    import streamlit as st
+
+    columns = DataPager(db_path, table).columns()
+    sort_col, order_col, filter_col, value_col = st.columns([2, 1, 2, 2])
+    sort = sort_col.selectbox("Sort by", ["(file order)"] + columns, key=f"{key}_sort")
+    descending = order_col.checkbox("Descending", key=f"{key}_desc")
+    filter_column = filter_col.selectbox("Filter column", ["(none)"] + columns, key=f"{key}_filter_col")
+    filter_text = value_col.text_input("Filter (e.g. Berlin, > 10)", key=f"{key}_filter")
+
+    filters = []
+    parsed = parse_filter(filter_text)
+    if filter_column != "(none)" and parsed is not None:
+        filters.append((filter_column, parsed[0], parsed[1]))
+    sort = None if sort == "(file order)" else sort
+
+    # One pager per view, kept across reruns so its page boundaries and cached pages survive
+    view = (db_path, table, sort, descending, tuple(filters))
+    state = st.session_state.get(f"{key}_state")
+    if state is None or state["view"] != view:
+        state = st.session_state[f"{key}_state"] = {
+            "view": view, "page": 0,
+            "pager": DataPager(db_path, table, page_rows, sort, descending, filters),
+        }
+    pager = state["pager"]
+
+    prev_col, info_col, next_col = st.columns([1, 3, 1])
+    if prev_col.button("Previous", key=f"{key}_prev", disabled=state["page"] == 0):
+        state["page"] -= 1
+    if next_col.button("Next", key=f"{key}_next", disabled=state["page"] >= pager.page_count - 1):
+        state["page"] += 1
+    info_col.caption(f"Page {state['page'] + 1:,} of {pager.page_count:,} ({pager.total_rows:,} rows)")
+    st.dataframe(pager.page(state["page"]))
@@ -0,0 +1,209 @@
+import os
+import shutil
+import hashlib
+import json
+import pickle
+import threading
+import time
+import uuid
+from typing import Any, Callable, Iterable, Optional
+
+import pandas as pd
+
+CACHE_DIR = ".dataset_cache"
+DEFAULT_MAX_BYTES = 5 * 1024 ** 3
+HASH_BLOCK_SIZE = 1024 * 1024
+
+FRAME_FILE = "frame.parquet"
+META_FILE = "meta.pkl"
+DESCRIPTIONS_FILE = "descriptions.json"
+DATABASE_FILE = "data.db"
+PARQUET_COMPRESSION = "zstd"
+
+
+def file_digest(file_path: str) -> str:
+    """Content hash of a file, read in blocks."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def frame_to_arrow(df: pd.DataFrame):
+    """Arrow table for df; object columns mixing types Arrow cannot hold in one column become text."""
+    import pyarrow as pa
+
+    df = df.set_axis([str(c) for c in df.columns], axis=1)
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        pass
+    df = df.copy()
+    for column in df.columns:
+        try:
+            pa.array(df[column], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            df[column] = df[column].map(lambda v: v if pd.isna(v) else str(v))
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def write_parquet(df: pd.DataFrame, path: str) -> None:
+    """Compressed Parquet with dictionary-encoded columns; the pandas dtypes are kept in its schema metadata."""
+    import pyarrow.parquet as pq
+    pq.write_table(frame_to_arrow(df), path, compression=PARQUET_COMPRESSION, use_dictionary=True)
+
+
+class DatasetCache:
+    """
+    On-disk cache of parsed uploads and the SQLite databases built from them.
+
+    Entries are directories named by cache key: the parsed frame (as Parquet, read back
+    memory-mapped), its insights and the user's column descriptions live under
+    key(digest), the chat database for a given set of column names under
+    key(digest, columns). Least recently used entries are evicted once the cache grows
+    past max_bytes.
+    """
+
+    def __init__(self, root: str = CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key(digest: str, columns: Optional[Iterable] = None) -> str:
+        if columns is None:
+            return digest
+        names = "\x1f".join(str(c) for c in columns)
+        return digest + "-" + hashlib.blake2b(names.encode("utf-8"), digest_size=8).hexdigest()
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def _touch(self, key: str) -> None:
+        now = time.time()
+        os.utime(self._entry(key), (now, now))
+
+    def frame_path(self, key: str) -> str:
+        return os.path.join(self._entry(key), FRAME_FILE)
+
+    def has_frame(self, key: str) -> bool:
+        return os.path.exists(self.frame_path(key))
+
+    def load_frame(self, key: str, columns: Optional[Iterable[str]] = None):
+        """(df, meta) for a cached parse, or None. Only the given columns are read."""
+        import pyarrow.parquet as pq
+
+        entry = self._entry(key)
+        try:
+            table = pq.read_table(self.frame_path(key), columns=list(columns) if columns else None, memory_map=True)
+            with open(os.path.join(entry, META_FILE), "rb") as f:
+                meta = pickle.load(f)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            return None
+        self._touch(key)
+        return table.to_pandas(), meta
+
+    def load_meta(self, key: str):
+        try:
+            with open(os.path.join(self._entry(key), META_FILE), "rb") as f:
+                meta = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        self._touch(key)
+        return meta
+
+    def load_preview(self, key: str, rows: int, columns: Optional[Iterable[str]] = None) -> Optional[pd.DataFrame]:
+        """The first rows of a cached parse, without reading the rest of the file."""
+        import pyarrow.parquet as pq
+
+        try:
+            parquet = pq.ParquetFile(self.frame_path(key), memory_map=True)
+        except (OSError, ValueError):
+            return None
+        for batch in parquet.iter_batches(batch_size=rows, columns=list(columns) if columns else None):
+            return batch.to_pandas()
+        return parquet.schema_arrow.empty_table().to_pandas()
+
+    def store_frame(self, key: str, df: pd.DataFrame, meta: Any) -> None:
+        entry = self._entry(key)
+        os.makedirs(entry, exist_ok=True)
+        tmp = os.path.join(entry, f".{uuid.uuid4().hex}")
+        write_parquet(df, tmp + FRAME_FILE)
+        with open(tmp + META_FILE, "wb") as f:
+            pickle.dump(meta, f)
+        os.replace(tmp + FRAME_FILE, os.path.join(entry, FRAME_FILE))
+        os.replace(tmp + META_FILE, os.path.join(entry, META_FILE))
+        self._touch(key)
+        self.evict(keep=key)
+
+    def load_descriptions(self, key: str) -> dict:
+        try:
+            with open(os.path.join(self._entry(key), DESCRIPTIONS_FILE), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def store_descriptions(self, key: str, descriptions: dict) -> None:
+        """Column descriptions entered for a dataset, kept next to its parsed frame."""
+        entry = self._entry(key)
+        os.makedirs(entry, exist_ok=True)
+        tmp = os.path.join(entry, f".{uuid.uuid4().hex}.json")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(descriptions, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, os.path.join(entry, DESCRIPTIONS_FILE))
+
+    def database_path(self, key: str) -> str:
+        return os.path.join(self._entry(key), DATABASE_FILE)
+
+    def database(self, key: str, build: Callable[[str], Any], rebuild: bool = False) -> str:
+        """
+        Path of the cached database for key, calling build(path) to create it on a miss
+        (or always, with rebuild=True). The build writes to a temporary file that is only
+        moved into place once complete.
+        """
+        path = self.database_path(key)
+        if os.path.exists(path) and not rebuild:
+            self._touch(key)
+            return path
+
+        os.makedirs(self._entry(key), exist_ok=True)
+        tmp = os.path.join(self._entry(key), f".{uuid.uuid4().hex}.db")
+        try:
+            build(tmp)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self._touch(key)
+        self.evict(keep=key)
+        return path
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.root):
+                entry = self._entry(name)
+                if os.path.isdir(entry):
+                    entries.append((os.path.getmtime(entry), name, _dir_size(entry)))
+
+            total = sum(size for _, _, size in entries)
+            for _, name, size in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if name == keep:
+                    continue
+                shutil.rmtree(self._entry(name), ignore_errors=True)
+                total -= size
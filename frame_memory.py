@@ -0,0 +1,103 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# String columns with at most this share of distinct values are stored as categoricals
+CATEGORY_MAX_RATIO = 0.5
+DEFAULT_SHARED_BYTES = 4 * 1024 ** 3
+# df.attrs entry with the column names a renamed frame was loaded with
+ORIGINAL_COLUMNS = "original_columns"
+
+
+def _is_text(series: pd.Series) -> bool:
+    return pd.api.types.is_object_dtype(series.dtype) or pd.api.types.is_string_dtype(series.dtype)
+
+
+def compact_frame(df: pd.DataFrame, category_max_ratio: float = CATEGORY_MAX_RATIO) -> pd.DataFrame:
+    """
+    df with the smallest dtypes that hold its values exactly: integers downcast, floats to
+    float32 where no value changes, and repetitive string columns as categoricals.
+    """
+    columns = {}
+    for i, column in enumerate(df.columns):
+        series = df.iloc[:, i]
+        dtype = series.dtype
+        if isinstance(dtype, np.dtype) and dtype.kind in "iu":
+            series = pd.to_numeric(series, downcast="unsigned" if dtype.kind == "u" or series.min() >= 0 else "integer")
+        elif isinstance(dtype, np.dtype) and dtype.kind == "f" and dtype.itemsize > 4:
+            smaller = series.astype(np.float32)
+            if ((smaller.astype(dtype) == series) | series.isna()).all():
+                series = smaller
+        elif _is_text(series) and len(series) > 1:
+            values = series.dropna()
+            if pd.api.types.infer_dtype(values, skipna=True) == "string" and \
+                    values.nunique() <= category_max_ratio * len(series):
+                series = series.astype("category")
+        columns[i] = series
+    compact = pd.concat(columns, axis=1) if columns else df.copy()
+    compact.columns = df.columns
+    return compact
+
+
+def rename_columns(df: pd.DataFrame, columns: Iterable) -> pd.DataFrame:
+    """df under new column names, sharing its data instead of copying it; see original_columns()."""
+    renamed = df.set_axis(list(columns), axis=1)
+    renamed.attrs = {**df.attrs, ORIGINAL_COLUMNS: original_columns(df)}
+    return renamed
+
+
+def original_columns(df: pd.DataFrame) -> List[str]:
+    """The column names df was loaded with, before any rename_columns()."""
+    return list(df.attrs.get(ORIGINAL_COLUMNS) or [str(c) for c in df.columns])
+
+
+def frame_bytes(df: Optional[pd.DataFrame]) -> int:
+    if df is None:
+        return 0
+    return int(df.memory_usage(deep=True, index=True).sum())
+
+
+class SharedFrames:
+    """
+    One immutable copy of each parsed dataset per process, keyed by cache key. Sessions
+    get shallow copies: their own column names, the same column data. Least recently
+    used datasets stop being shared once more than max_bytes are held.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_SHARED_BYTES):
+        self.max_bytes = max_bytes
+        self._frames: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        with self._lock:
+            entry = self._frames.get(key)
+            if entry is None:
+                return None
+            self._frames.move_to_end(key)
+            self.hits += 1
+            return entry[0].copy(deep=False)
+
+    def share(self, key: str, df: pd.DataFrame) -> pd.DataFrame:
+        """Keep df as the shared copy for key and return a session's view of it."""
+        size = frame_bytes(df)
+        with self._lock:
+            if key not in self._frames:
+                self._frames[key] = (df, size)
+                self._bytes += size
+                while len(self._frames) > 1 and self._bytes > self.max_bytes:
+                    _, (_, dropped) = self._frames.popitem(last=False)
+                    self._bytes -= dropped
+            shared = self._frames.get(key, (df, size))[0]
+        return shared.copy(deep=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {"datasets": len(self._frames), "bytes": self._bytes, "hits": self.hits}
+
+
+shared_frames = SharedFrames()
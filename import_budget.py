@@ -0,0 +1,105 @@
+import ast
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+# Startup budget for what the app scripts import before their first page renders
+BUDGET_MS = 800
+RUNS = 3
+
+DEFAULT_SCRIPTS = ["stream_app", "gradio_test", "app_ui.py", "llm_handler.py"]
+
+# The UI framework itself is a fixed cost of the app, not something we can defer
+FRAMEWORK_MODULES = {"streamlit", "gradio", "fastapi", "injector"}
+
+# Must only ever be imported by the background warm-up or on the first question
+HEAVY_MODULES = {"transformers", "torch", "llama_index", "llama_cpp", "sentence_transformers",
+                 "sqlalchemy", "duckdb"}
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_startup_lines = None
+
+
+def top_level_imports(script_path: str) -> List[str]:
+    """The import statements a script runs at module level, minus the UI framework."""
+    with open(script_path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=script_path)
+    statements = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names = [a for a in node.names if a.name.split(".")[0] not in FRAMEWORK_MODULES]
+            if names:
+                statements.append(ast.unparse(ast.Import(names=names)))
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            if node.module.split(".")[0] not in FRAMEWORK_MODULES:
+                statements.append(ast.unparse(node))
+    return statements
+
+
+def _interpreter_startup() -> List[str]:
+    # What a bare interpreter imports before running any code (site, encodings, ...)
+    global _startup_lines
+    if _startup_lines is None:
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", "pass"],
+                                capture_output=True, text=True)
+        _startup_lines = result.stderr.splitlines()
+    return _startup_lines
+
+
+def measure(statements: List[str]) -> Tuple[float, Dict[str, float], List[str]]:
+    """
+    Run the statements in a fresh interpreter under -X importtime.
+    Returns the total milliseconds, the cumulative milliseconds per top-level import
+    and every module that got imported.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "\n".join(statements)],
+                            cwd=REPO_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    top: Dict[str, float] = {}
+    modules = []
+    for line in result.stderr.splitlines()[len(_interpreter_startup()):]:
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        module = name.strip()
+        modules.append(module)
+        # Nested imports are indented under the module that triggered them
+        if not name[1:].startswith(" "):
+            top[module] = int(cumulative) / 1000
+    return sum(top.values()), top, modules
+
+
+def check(script: str, budget_ms: float = BUDGET_MS, runs: int = RUNS) -> bool:
+    statements = top_level_imports(os.path.join(REPO_DIR, script))
+    try:
+        # Best of a few runs, so a busy machine does not fail the check
+        total, top, modules = min((measure(statements) for _ in range(runs)), key=lambda m: m[0])
+    except RuntimeError as e:
+        print(f"FAIL {script}: imports failed: {e}")
+        return False
+    heavy = sorted({m.split(".")[0] for m in modules} & HEAVY_MODULES)
+
+    ok = total <= budget_ms and not heavy
+    print(f"{'OK  ' if ok else 'FAIL'} {script}: {total:,.0f} ms of imports (budget {budget_ms:,.0f} ms)")
+    for module, ms in sorted(top.items(), key=lambda t: -t[1])[:5]:
+        print(f"       {ms:8,.1f} ms  {module}")
+    if heavy:
+        print(f"       imported at startup, should be deferred: {', '.join(heavy)}")
+    return ok
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fail when the app scripts import too much at startup")
+    parser.add_argument("scripts", nargs="*", default=DEFAULT_SCRIPTS)
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=RUNS)
+    args = parser.parse_args()
+
+    results = [check(script, args.budget_ms, args.runs) for script in args.scripts]
+    sys.exit(0 if all(results) else 1)
@@ -0,0 +1,157 @@
+import re
+import sqlite3
+import hashlib
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from sqlite_loader import quote_identifier
+
+KEY_SAMPLE_ROWS = 10000
+KEY_UNIQUE_RATIO = 0.9
+MAX_UP_FRONT_INDEXES = 4
+DEFAULT_USAGE_THRESHOLD = 3
+MAX_AUTO_INDEXES = 8
+MAX_INDEX_COLUMNS = 4
+
+_DATE_TEXT = re.compile(r"^\s*(\d{4}-\d{1,2}-\d{1,2}|\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4})")
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_IDENTIFIER = re.compile(r'"((?:[^"]|"")+)"|`([^`]+)`|\[([^\]]+)\]|\b([A-Za-z_][A-Za-z0-9_]*)\b')
+_CLAUSE = re.compile(r"\b(WHERE|GROUP\s+BY|ORDER\s+BY|HAVING|LIMIT|ON|UNION|FROM)\b", re.IGNORECASE)
+
+
+def likely_key_columns(df: pd.DataFrame, sample_rows: int = KEY_SAMPLE_ROWS) -> List[str]:
+    """
+    Columns worth indexing before any question is asked: dates, and string columns that
+    are (nearly) unique in the first sample_rows rows, i.e. IDs, names and codes.
+    """
+    sample = df.head(sample_rows)
+    dates, keys = [], []
+    for column in sample.columns:
+        values = sample[column].dropna()
+        if values.empty:
+            continue
+        if pd.api.types.is_datetime64_any_dtype(values.dtype):
+            dates.append(str(column))
+        elif pd.api.types.infer_dtype(values, skipna=True) == "string":
+            text = values.astype(str)
+            if text.str.match(_DATE_TEXT).mean() >= KEY_UNIQUE_RATIO:
+                dates.append(str(column))
+            elif len(values) > 1 and values.nunique() / len(values) >= KEY_UNIQUE_RATIO:
+                keys.append(str(column))
+    return (dates + keys)[:MAX_UP_FRONT_INDEXES]
+
+
+def _clauses(sql: str) -> Dict[str, List[str]]:
+    """Text of the WHERE/ON, GROUP BY and ORDER BY clauses of sql, string literals removed."""
+    sql = _STRING_LITERAL.sub("''", sql)
+    parts = _CLAUSE.split(sql)
+    clauses: Dict[str, List[str]] = {"filter": [], "group": []}
+    for keyword, body in zip(parts[1::2], parts[2::2]):
+        keyword = " ".join(keyword.upper().split())
+        if keyword in ("WHERE", "ON", "HAVING"):
+            clauses["filter"].append(body)
+        elif keyword in ("GROUP BY", "ORDER BY"):
+            clauses["group"].append(body)
+    return clauses
+
+
+def sql_columns(sql: str, columns: List[str]) -> Tuple[List[str], List[str]]:
+    """(filtered columns, grouped/ordered columns) of sql, restricted to the given table columns."""
+    by_lower = {c.lower(): c for c in columns}
+    found = {}
+    for kind, bodies in _clauses(sql).items():
+        names = []
+        for body in bodies:
+            for match in _IDENTIFIER.finditer(body):
+                name = next(g for g in match.groups() if g is not None).replace('""', '"')
+                column = by_lower.get(name.lower())
+                if column is not None and column not in names:
+                    names.append(column)
+        found[kind] = names
+    return found["filter"], found["group"]
+
+
+class AdaptiveIndexer:
+    """
+    Watches the SQL run against one SQLite table and, once the same filter/group columns
+    have been used threshold times, adds a composite index on them (filter columns
+    first, then grouping columns, so the grouping can be answered from the index) and
+    refreshes the planner statistics with ANALYZE. Index builds run in one background thread.
+    """
+
+    _builder = ThreadPoolExecutor(1, thread_name_prefix="indexer")
+
+    def __init__(self, db_path: str, table: str, threshold: int = DEFAULT_USAGE_THRESHOLD,
+                 max_indexes: int = MAX_AUTO_INDEXES):
+        self.db_path = db_path
+        self.table = table
+        self.threshold = threshold
+        self.max_indexes = max_indexes
+        self.usage: Counter = Counter()
+        self.built: Dict[Tuple[str, ...], str] = {}
+        self._columns: Optional[List[str]] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Readers may hold the file briefly, wait for them rather than failing
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    @property
+    def columns(self) -> List[str]:
+        if self._columns is None:
+            conn = self._connect()
+            try:
+                self._columns = [row[1] for row in conn.execute(f"PRAGMA table_info({quote_identifier(self.table)})")]
+            finally:
+                conn.close()
+        return self._columns
+
+    def observe(self, sql: str) -> None:
+        filtered, grouped = sql_columns(sql, self.columns)
+        index_columns = tuple(dict.fromkeys(filtered + grouped))[:MAX_INDEX_COLUMNS]
+        if not index_columns:
+            return
+        with self._lock:
+            self.usage[index_columns] += 1
+            if (self.usage[index_columns] < self.threshold or index_columns in self.built
+                    or len(self.built) >= self.max_indexes):
+                return
+            name = "ix_auto_" + hashlib.blake2b("\0".join(index_columns).encode("utf-8"), digest_size=6).hexdigest()
+            self.built[index_columns] = name
+        self._builder.submit(self._build, name, index_columns)
+
+    def _build(self, name: str, index_columns: Tuple[str, ...]) -> None:
+        conn = self._connect()
+        try:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {quote_identifier(name)} ON {quote_identifier(self.table)} "
+                         f"({', '.join(quote_identifier(c) for c in index_columns)})")
+            conn.execute("ANALYZE")
+            conn.commit()
+            print(f"Added index {name} on {', '.join(index_columns)} of {self.db_path}")
+        except Exception as e:
+            print(f"Could not add index on {', '.join(index_columns)}: {e}")
+            with self._lock:
+                self.built.pop(index_columns, None)
+        finally:
+            conn.close()
+
+    def stats(self):
+        return {"indexes": {name: list(cols) for cols, name in self.built.items()},
+                "usage": {", ".join(cols): n for cols, n in self.usage.most_common(10)}}
+
+
+_indexers: Dict[Tuple[str, str], AdaptiveIndexer] = {}
+_indexers_lock = threading.Lock()
+
+
+def get_indexer(db_path: str, table: str) -> AdaptiveIndexer:
+    """The indexer of a database file, shared by every session querying it."""
+    with _indexers_lock:
+        indexer = _indexers.get((db_path, table))
+        if indexer is None:
+            indexer = _indexers[(db_path, table)] = AdaptiveIndexer(db_path, table)
+        return indexer
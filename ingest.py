@@ -0,0 +1,442 @@
+import os
+import shutil
+import time
+import sqlite3
+from typing import Any, Callable, Iterator, Optional
+
+import pandas as pd
+
+from dataset_cache import DatasetCache, file_digest
+from frame_memory import compact_frame, shared_frames
+from indexer import likely_key_columns
+from profiler import ColumnProfiler, DEFAULT_ERROR, profile_frame
+from sqlite_loader import BulkLoader, bulk_load
+from tracing import tracer
+
+DEFAULT_CHUNK_ROWS = 50_000
+DEFAULT_MAX_MEMORY_MB = 256
+COPY_BUFFER_SIZE = 1024 * 1024
+PREVIEW_ROWS = 100
+DEFAULT_STREAMING_THRESHOLD_MB = 100
+
+
+def save_upload(file, file_path: str) -> int:
+    """Copy an uploaded file object to disk in fixed-size blocks instead of one getbuffer() write."""
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    if hasattr(file, "seek"):
+        file.seek(0)
+
+    written = 0
+    with tracer.span("upload", file=os.path.basename(file_path)) as span, open(file_path, "wb") as f:
+        while True:
+            block = file.read(COPY_BUFFER_SIZE)
+            if not block:
+                break
+            f.write(block)
+            written += len(block)
+        span.set(bytes=written)
+    return written
+
+
+def rows_for_budget(sample: pd.DataFrame, max_memory_mb: float, default: int = DEFAULT_CHUNK_ROWS) -> int:
+    """Number of rows per chunk that keeps one chunk well under the memory ceiling."""
+    if sample is None or len(sample) == 0:
+        return default
+    bytes_per_row = max(sample.memory_usage(deep=True, index=False).sum() / len(sample), 1)
+    # Leave headroom for the insert buffers and the profiler state
+    rows = int(max_memory_mb * 1024 * 1024 / 4 / bytes_per_row)
+    return max(1_000, min(rows, 1_000_000))
+
+
+def _iter_csv(file_path: str, chunk_rows: int, max_memory_mb: Optional[float]) -> Iterator[pd.DataFrame]:
+    if max_memory_mb:
+        sample = pd.read_csv(file_path, nrows=1_000)
+        chunk_rows = rows_for_budget(sample, max_memory_mb, chunk_rows)
+        del sample
+
+    with pd.read_csv(file_path, chunksize=chunk_rows) as reader:
+        for chunk in reader:
+            yield chunk
+
+
+def _iter_excel(file_path: str, chunk_rows: int, max_memory_mb: Optional[float],
+                sheet: Optional[str] = None) -> Iterator[pd.DataFrame]:
+    from openpyxl import load_workbook
+
+    # read_only mode streams the sheet XML row by row instead of building the whole workbook
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet] if sheet is not None else workbook.worksheets[0]
+        rows = worksheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(c) if c is not None else f"Unnamed: {i}" for i, c in enumerate(header)]
+
+        buffer = []
+        sized = not max_memory_mb
+        for row in rows:
+            buffer.append(row[:len(columns)])
+            if len(buffer) >= chunk_rows:
+                chunk = pd.DataFrame.from_records(buffer, columns=columns).infer_objects()
+                buffer = []
+                if not sized:
+                    chunk_rows = rows_for_budget(chunk, max_memory_mb, chunk_rows)
+                    sized = True
+                yield chunk
+        if buffer:
+            yield pd.DataFrame.from_records(buffer, columns=columns).infer_objects()
+    finally:
+        workbook.close()
+
+
+def iter_file_chunks(file_path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS,
+                     max_memory_mb: Optional[float] = DEFAULT_MAX_MEMORY_MB,
+                     sheet: Optional[str] = None) -> Iterator[pd.DataFrame]:
+    """
+    Yield the rows of a CSV or Excel file as DataFrames of at most chunk_rows rows.
+    For workbooks, sheet picks the sheet (the first one by default).
+    """
+    if file_path.endswith('.csv'):
+        return _iter_csv(file_path, chunk_rows, max_memory_mb)
+    elif file_path.endswith(('.xls', '.xlsx')):
+        return _iter_excel(file_path, chunk_rows, max_memory_mb, sheet)
+    raise ValueError("Unsupported file format. Please upload a CSV or Excel file.")
+
+
+class IngestProgress:
+    def __init__(self, file_size: int):
+        self.file_size = file_size
+        self.rows = 0
+        self.chunks = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.elapsed if self.elapsed > 0 else 0.0
+
+
+def stream_ingest(file_path: str, db_path: str, table: str = "data",
+                  chunk_rows: int = DEFAULT_CHUNK_ROWS,
+                  max_memory_mb: Optional[float] = DEFAULT_MAX_MEMORY_MB,
+                  on_progress: Optional[Callable[[IngestProgress], Any]] = None,
+                  distinct_error: float = DEFAULT_ERROR):
+    """
+    Read file_path chunk by chunk, writing every chunk into the SQLite table and
+    updating the column insights as it goes. Only one chunk is held in memory at a time.
+
+    Returns (insights, column_info, preview_df) where preview_df holds the first PREVIEW_ROWS rows.
+    """
+    file_size = os.path.getsize(file_path)
+    progress = IngestProgress(file_size)
+
+    columns = None
+    profiler = ColumnProfiler(error=distinct_error)
+    preview = None
+    index_columns = []
+
+    loader = BulkLoader(db_path, table)
+    # Parsing, profiling and loading alternate chunk by chunk; each is traced as one span in the end
+    seconds = {"parse": 0.0, "profile": 0.0, "db_load": 0.0}
+    chunks = iter_file_chunks(file_path, chunk_rows, max_memory_mb)
+    try:
+        while True:
+            started = time.perf_counter()
+            chunk = next(chunks, None)
+            seconds["parse"] += time.perf_counter() - started
+            if chunk is None:
+                break
+            if columns is None:
+                columns = list(chunk.columns)
+                preview = chunk.head(PREVIEW_ROWS).copy()
+                # Key and date columns are picked from the first chunk and indexed once the load is done
+                index_columns = likely_key_columns(chunk)
+            elif preview is not None and len(preview) < PREVIEW_ROWS:
+                preview = pd.concat([preview, chunk.head(PREVIEW_ROWS - len(preview))], ignore_index=True)
+
+            started = time.perf_counter()
+            profiler.update(chunk)
+            seconds["profile"] += time.perf_counter() - started
+            started = time.perf_counter()
+            loader.append(chunk)
+            seconds["db_load"] += time.perf_counter() - started
+
+            progress.rows += len(chunk)
+            progress.chunks += 1
+            if on_progress is not None:
+                on_progress(progress)
+    finally:
+        started = time.perf_counter()
+        loader.finish(index_columns)
+        seconds["db_load"] += time.perf_counter() - started
+
+    if columns is None:
+        raise ValueError("The uploaded file has no rows.")
+
+    started = time.perf_counter()
+    column_info = profiler.to_frame()
+    seconds["profile"] += time.perf_counter() - started
+    for stage, stage_seconds in seconds.items():
+        tracer.record(stage, stage_seconds, rows=progress.rows, chunks=progress.chunks)
+
+    insights = {
+        "File Size (in bytes)": file_size,
+        "Total Rows": progress.rows,
+        "Total Columns": len(columns),
+        "Rows/sec": round(progress.rows_per_sec),
+    }
+
+    return insights, column_info, preview
+
+
+def export_table_csv(db_path: str, table: str, file_path: str, columns=None,
+                     chunk_rows: int = DEFAULT_CHUNK_ROWS) -> str:
+    """Write a SQLite table out as CSV chunk by chunk, optionally under new column names."""
+    conn = sqlite3.connect(db_path)
+    try:
+        header = True
+        for chunk in pd.read_sql_query(f'SELECT * FROM "{table}"', conn, chunksize=chunk_rows):
+            if columns is not None:
+                chunk.columns = list(columns)
+            chunk.to_csv(file_path, index=False, header=header, mode='w' if header else 'a')
+            header = False
+    finally:
+        conn.close()
+    return file_path
+
+
+def iter_parquet_chunks(parquet_path: str, columns=None, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """DataFrames of chunk_rows rows from a memory-mapped Parquet file, reading only the given columns."""
+    import pyarrow.parquet as pq
+
+    parquet = pq.ParquetFile(parquet_path, memory_map=True)
+    for batch in parquet.iter_batches(batch_size=chunk_rows, columns=columns):
+        yield batch.to_pandas()
+
+
+def parquet_columns(parquet_path: str):
+    import pyarrow.parquet as pq
+    return pq.ParquetFile(parquet_path, memory_map=True).schema_arrow.names
+
+
+def export_parquet_csv(parquet_path: str, file_path: str, columns=None,
+                       chunk_rows: int = DEFAULT_CHUNK_ROWS) -> str:
+    """Write a Parquet file out as CSV chunk by chunk, optionally under new column names."""
+    header = True
+    for chunk in iter_parquet_chunks(parquet_path, chunk_rows=chunk_rows):
+        if columns is not None:
+            chunk.columns = list(columns)
+        chunk.to_csv(file_path, index=False, header=header, mode='w' if header else 'a')
+        header = False
+    if header:
+        pd.DataFrame(columns=list(columns or parquet_columns(parquet_path))).to_csv(file_path, index=False)
+    return file_path
+
+
+def load_parquet_table(parquet_path: str, db_path: str, table: str, columns=None,
+                       chunk_rows: int = DEFAULT_CHUNK_ROWS) -> int:
+    """Bulk load a Parquet file into a SQLite table chunk by chunk, optionally under new column names."""
+    loader = BulkLoader(db_path, table)
+    index_columns = []
+    try:
+        for chunk in iter_parquet_chunks(parquet_path, chunk_rows=chunk_rows):
+            if columns is not None:
+                chunk.columns = list(columns)
+            if loader.rows == 0:
+                index_columns = likely_key_columns(chunk)
+            loader.append(chunk)
+    finally:
+        rows = loader.finish(index_columns)
+    return rows
+
+
+def rename_table_columns(db_path: str, table: str, new_columns) -> None:
+    """Rename the columns of a SQLite table, by position, to new_columns."""
+    conn = sqlite3.connect(db_path)
+    try:
+        current = [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+        changed = [(old, new) for old, new in zip(current, new_columns) if old != new]
+        # Go through temporary names so swapped names never collide
+        for i, (old, _) in enumerate(changed):
+            conn.execute(f'ALTER TABLE "{table}" RENAME COLUMN "{old}" TO "__rename_{i}"')
+        for i, (_, new) in enumerate(changed):
+            conn.execute(f'ALTER TABLE "{table}" RENAME COLUMN "__rename_{i}" TO "{new}"')
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def copy_database(src_path: str, dst_path: str, table: str, new_columns=None) -> str:
+    """Copy a database file, renaming the table's columns in the copy."""
+    shutil.copyfile(src_path, dst_path)
+    if new_columns is not None:
+        rename_table_columns(dst_path, table, new_columns)
+    return dst_path
+
+
+class LoadedDataset:
+    def __init__(self, insights, column_info, df, digest, streamed=False, db_path=None, descriptions=None):
+        self.insights = insights
+        self.column_info = column_info
+        # The whole frame, or only the first PREVIEW_ROWS rows when streamed
+        self.df = df
+        self.digest = digest
+        self.streamed = streamed
+        # Database holding the full table (as parsed, original column names) when streamed
+        self.db_path = db_path
+        # Column descriptions saved for this file earlier
+        self.descriptions = descriptions or {}
+
+
+def load_dataset(file_path: str, cache: Optional[DatasetCache] = None,
+                 streaming_threshold_mb: float = DEFAULT_STREAMING_THRESHOLD_MB,
+                 max_memory_mb: Optional[float] = DEFAULT_MAX_MEMORY_MB,
+                 on_progress: Optional[Callable[[IngestProgress], Any]] = None) -> LoadedDataset:
+    """
+    Parse an uploaded file and profile it, serving repeat uploads of the same content
+    from the dataset cache. Files at or above streaming_threshold_mb are streamed into
+    a cached SQLite database instead of being loaded whole. Parsed files are kept as
+    Parquet in the cache, so the text is only ever parsed once.
+
+    Frames are compacted (see frame_memory.compact_frame) and shared: sessions uploading
+    the same content get views of one copy in memory.
+    """
+    if not file_path.endswith(('.csv', '.xls', '.xlsx')):
+        raise ValueError("Unsupported file format. Please upload a CSV or Excel file.")
+
+    digest = file_digest(file_path)
+    key = DatasetCache.key(digest)
+    if cache is not None:
+        df = shared_frames.get(key)
+        meta = cache.load_meta(key) if df is not None else None
+        cached = (df, meta) if meta is not None else cache.load_frame(key)
+        if cached is not None and cached[1]["streamed"] and not os.path.exists(cache.database_path(key)):
+            # Its database was moved on by an upsert (see upsert.upsert_dataset): ingest the file again
+            cached = None
+        if cached is not None:
+            df, meta = cached
+            df = shared_frames.share(key, df)
+            return LoadedDataset(meta["insights"], meta["column_info"], df, digest,
+                                 streamed=meta["streamed"],
+                                 db_path=cache.database_path(key) if meta["streamed"] else None,
+                                 descriptions=cache.load_descriptions(key))
+
+    file_size = os.path.getsize(file_path)
+    if file_size >= streaming_threshold_mb * 1024 * 1024:
+        result = {}
+
+        def build(path):
+            result["ingest"] = stream_ingest(file_path, path, max_memory_mb=max_memory_mb, on_progress=on_progress)
+
+        if cache is not None:
+            db_path = cache.database(key, build, rebuild=True)
+        else:
+            db_path = os.path.splitext(file_path)[0] + ".db"
+            build(db_path)
+        insights, column_info, df = result["ingest"]
+        streamed = True
+    else:
+        with tracer.span("parse", file=os.path.basename(file_path)) as span:
+            if file_path.endswith('.csv'):
+                df = pd.read_csv(file_path)
+            else:
+                df = pd.read_excel(file_path)
+            span.set(rows=len(df))
+        with tracer.span("profile", rows=len(df)):
+            column_info = profile_frame(df)
+        df = compact_frame(df)
+        insights = {
+            "File Size (in bytes)": file_size,
+            "Total Rows": len(df),
+            "Total Columns": len(df.columns)
+        }
+        db_path = None
+        streamed = False
+
+    if cache is not None:
+        cache.store_frame(key, df, {"insights": insights, "column_info": column_info, "streamed": streamed})
+    df = shared_frames.share(key, df)
+    return LoadedDataset(insights, column_info, df, digest, streamed=streamed, db_path=db_path)
+
+
+def table_columns(db_path: str, table: str):
+    conn = sqlite3.connect(db_path)
+    try:
+        return [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+    finally:
+        conn.close()
+
+
+def _cached_frame(cache: Optional[DatasetCache], digest: str, columns) -> Optional[str]:
+    # The cached Parquet copy of an upload, when it holds the full table under as many columns
+    if cache is None or digest is None:
+        return None
+    path = cache.frame_path(cache.key(digest))
+    if not os.path.exists(path) or len(parquet_columns(path)) != len(columns):
+        return None
+    return path
+
+
+def _traced_load(source: str, build: Callable[[str], Any]) -> Callable[[str], Any]:
+    # A database build, traced as a db_load span; cache hits build nothing and are not traced
+    def load(path):
+        with tracer.span("db_load", source=source) as span:
+            rows = build(path)
+            if isinstance(rows, int):
+                span.set(rows=rows)
+            return rows
+    return load
+
+
+def chat_database(cache: DatasetCache, digest: str, df: pd.DataFrame, table: str = "data",
+                  streamed_db_path: Optional[str] = None) -> str:
+    """
+    Cached database holding the dataset under df's (possibly renamed) column names,
+    built on a miss. For streamed uploads df is only a preview, so the full table is
+    taken from streamed_db_path instead; otherwise it is loaded from the cached Parquet
+    copy of the upload, chunk by chunk.
+    """
+    columns = [str(c) for c in df.columns]
+    if streamed_db_path is not None:
+        if table_columns(streamed_db_path, table) == columns:
+            return streamed_db_path
+        return cache.database(cache.key(digest, columns), _traced_load(
+            "database", lambda path: copy_database(streamed_db_path, path, table, columns)))
+
+    frame_path = _cached_frame(cache, digest, columns)
+    if frame_path is not None:
+        return cache.database(cache.key(digest, columns), _traced_load(
+            "parquet", lambda path: load_parquet_table(frame_path, path, table, columns)))
+    return cache.database(cache.key(digest, columns), _traced_load(
+        "frame", lambda path: bulk_load(df, path, table, index_columns=likely_key_columns(df))))
+
+
+def export_csv(cache: Optional[DatasetCache], digest: str, df: pd.DataFrame, file_path: str,
+               table: str = "data", streamed_db_path: Optional[str] = None) -> str:
+    """
+    Write the dataset out as CSV under df's column names, streaming it from the streamed
+    database or the cached Parquet copy rather than formatting the whole frame at once.
+    """
+    columns = [str(c) for c in df.columns]
+    if streamed_db_path is not None:
+        return export_table_csv(streamed_db_path, table, file_path, columns=columns)
+    frame_path = _cached_frame(cache, digest, columns)
+    if frame_path is not None:
+        return export_parquet_csv(frame_path, file_path, columns=columns)
+    df.to_csv(file_path, index=False)
+    return file_path
+
+
+def dataset_preview(cache: Optional[DatasetCache], digest: str, df: pd.DataFrame, rows: int = 5) -> pd.DataFrame:
+    """The first rows under df's column names, read from the cached Parquet copy when there is one."""
+    columns = [str(c) for c in df.columns]
+    frame_path = _cached_frame(cache, digest, columns)
+    preview = cache.load_preview(cache.key(digest), rows) if frame_path is not None else None
+    if preview is None:
+        return df.head(rows)
+    preview.columns = list(df.columns)
+    return preview
@@ -0,0 +1,163 @@
+import os
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+DEFAULT_MAX_STATES = 4
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+# Saved states on disk, each tens to hundreds of MB; the least recently used go first
+DEFAULT_MAX_DISK_BYTES = 8 * 1024 ** 3
+
+
+def _tokenize(model, text: str) -> List[int]:
+    # Same tokenization llama-cpp-python applies to completion prompts
+    try:
+        return model.tokenize(text.encode("utf-8"), special=True)
+    except TypeError:
+        return model.tokenize(text.encode("utf-8"))
+
+
+def _state_bytes(state) -> int:
+    scores = getattr(state, "scores", None)
+    return int(getattr(state, "llama_state_size", 0)) + (scores.nbytes if scores is not None else 0)
+
+
+class PrefixStateCache:
+    """
+    Saved llama.cpp states (KV cache included) after evaluating the static start of a
+    prompt, i.e. the text-to-SQL instruction plus the dataset's schema. Before a question
+    is sent, prepare() puts the model back into that state, and llama.cpp only runs
+    prefill for the tokens after the prefix.
+
+    States are kept in an LRU bounded by max_states and max_bytes; with disk_dir they are
+    also pickled to disk, so they survive a restart of the app. The files on disk are
+    bounded by max_disk_bytes, dropping the least recently used when a new state is written.
+    """
+
+    def __init__(self, max_states: int = DEFAULT_MAX_STATES, max_bytes: int = DEFAULT_MAX_BYTES,
+                 disk_dir: Optional[str] = None, max_disk_bytes: int = DEFAULT_MAX_DISK_BYTES):
+        self.max_states = max_states
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._states: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = {"resident": 0, "memory": 0, "disk": 0}
+        self.misses = 0
+        self.tokens_reused = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def key(model: str, dataset: str, schema_version: str) -> str:
+        return hashlib.blake2b(f"{model}\0{dataset}\0{schema_version}".encode("utf-8"), digest_size=16).hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key + ".state")
+
+    def _remember(self, key: str, tokens: List[int], state) -> None:
+        with self._lock:
+            if key in self._states:
+                self._bytes -= _state_bytes(self._states.pop(key)[1])
+            self._states[key] = (tokens, state)
+            self._bytes += _state_bytes(state)
+            while len(self._states) > 1 and (len(self._states) > self.max_states or self._bytes > self.max_bytes):
+                _, (_, dropped) = self._states.popitem(last=False)
+                self._bytes -= _state_bytes(dropped)
+
+    def _lookup(self, key: str):
+        with self._lock:
+            entry = self._states.get(key)
+            if entry is not None:
+                self._states.move_to_end(key)
+                return entry, "memory"
+        if self.disk_dir and os.path.exists(self._disk_path(key)):
+            try:
+                with open(self._disk_path(key), "rb") as f:
+                    entry = pickle.load(f)
+            except Exception as e:
+                print(f"Could not read saved prompt state {key}: {e}")
+                return None, None
+            try:
+                # Modification time is the last use, for the disk eviction order
+                os.utime(self._disk_path(key))
+            except OSError:
+                pass
+            self._remember(key, *entry)
+            return entry, "disk"
+        return None, None
+
+    def prepare(self, llm, key: str, prefix: str) -> bool:
+        """
+        Leave llm's llama.cpp model with prefix evaluated, restoring a saved state when there
+        is one. Returns whether prefill of the prefix was saved. Must run in the thread that
+        uses the model, right before the completion that starts with prefix.
+        """
+        model = getattr(llm, "_model", None)
+        if model is None or not prefix:
+            return False
+        tokens = _tokenize(model, prefix)
+        # The tokens at the prefix/question boundary may merge differently, leave them to the question
+        tokens = tokens[:-1]
+        if not tokens:
+            return False
+
+        n = len(tokens)
+        if model.n_tokens >= n and list(model.input_ids[:n]) == tokens:
+            self.hits["resident"] += 1
+            self.tokens_reused += n
+            return True
+
+        entry, where = self._lookup(key)
+        if entry is not None and entry[0] == tokens:
+            model.load_state(entry[1])
+            self.hits[where] += 1
+            self.tokens_reused += n
+            return True
+
+        self.misses += 1
+        model.reset()
+        model.eval(tokens)
+        state = model.save_state()
+        self._remember(key, tokens, state)
+        if self.disk_dir:
+            temp_path = self._disk_path(key) + ".tmp"
+            with open(temp_path, "wb") as f:
+                pickle.dump((tokens, state), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self._disk_path(key))
+            self._trim_disk(keep=self._disk_path(key))
+        return False
+
+    def _disk_files(self) -> List[tuple]:
+        files = []
+        for name in os.listdir(self.disk_dir):
+            if name.endswith(".state"):
+                path = os.path.join(self.disk_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return sorted(files)
+
+    def _trim_disk(self, keep: str) -> None:
+        files = self._disk_files()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_disk_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError as e:
+                print(f"Could not remove saved prompt state {path}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        disk_bytes = sum(size for _, size, _ in self._disk_files()) if self.disk_dir else 0
+        return {"states": len(self._states), "bytes": self._bytes, "disk_bytes": disk_bytes, "hits": dict(self.hits),
+                "misses": self.misses, "tokens_reused": self.tokens_reused}
@@ -1,82 +1,52 @@
 import sqlite3
-from sqlalchemy import create_engine, text
-from transformers import AutoTokenizer
-from llama_index.core import SQLDatabase
-from llama_index.core import Settings
-from llama_index.core.query_engine import NLSQLTableQueryEngine
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from llama_index.llms.llama_cpp import LlamaCPP
-
-
-engine = create_engine('sqlite:///')
-filedb = sqlite3.connect('file:' + 'DATABASE.db' + '?mode=ro', uri=True)
-print("loading database to memory ...")
-filedb.backup(engine.raw_connection().driver_connection)
-print("loading database to memory ... done")
-filedb.close()
-with engine.connect() as con:
-    rows = con.execute(text("SELECT COUNT(*) from data"))
-    print(rows.all())
-
-tokenizer = AutoTokenizer.from_pretrained("mistralai/Mistral-7B-Instruct-v0.3")
 
-SHOW_LLM_CALL_TOKENS = True
-def messages_to_prompt(messages):
-    inst_buffer = []
-
-    prompt = ""
-
-    for message in messages:
-        if message.role == 'system' or message.role == 'user':
-            inst_buffer.append(str(message.content).strip())
-
-        elif message.role == 'assistant':
-            prompt += "[INST] " + "\n".join(inst_buffer) + " [/INST]"
-            prompt += " " + str(message.content).strip() + "</s>"
-            inst_buffer.clear()
-        else:
-            raise ValueError(f"Unknown message role {message.role}")
+from model_registry import model_registry
+from sql_backend import DUCKDB, SQLITE, backend_engine
 
-    if len(inst_buffer) > 0:
-        prompt += "[INST] " + "\n".join(inst_buffer) + " [/INST]"
+# "sqlite" (copied into memory), or "duckdb" over a Parquet copy of DATABASE.db
+SQL_BACKEND = SQLITE
 
+SHOW_LLM_CALL_TOKENS = True
 
-
-def completion_to_prompt(completion):
-
-    return "[INST] " + str(completion).strip() + " [/INST]"
+_pipeline = None
 
 
-llm = LlamaCPP(
-    model_path="C:\llm_weights\mistral-7b-instruct-v0.2.Q4_K_S.gguf",
-    temperature=0.1,
-    max_new_tokens=1024,
-    context_window=16348,  # max 32k
-    generate_kwargs={},
-    model_kwargs={"n_gpu_layers": -1},
-    messages_to_prompt=messages_to_prompt,
-    completion_to_prompt=completion_to_prompt,
-    verbose=False,
-)
+def get_pipeline():
+    # Database, llama_index and the models are only loaded on the first question,
+    # so importing this module stays cheap
+    global _pipeline
+    if _pipeline is not None:
+        return _pipeline
 
-embed = HuggingFaceEmbedding(model_name="BAAI/bge-m3")
+    from sqlalchemy import create_engine, text
+    from llama_index.core import SQLDatabase
 
-Settings.llm = llm
-Settings.embed_model = embed
-Settings.tokenizer = tokenizer
+    if SQL_BACKEND == SQLITE:
+        engine = create_engine('sqlite:///')
+        filedb = sqlite3.connect('file:' + 'DATABASE.db' + '?mode=ro', uri=True)
+        print("loading database to memory ...")
+        filedb.backup(engine.raw_connection().driver_connection)
+        print("loading database to memory ... done")
+        filedb.close()
+    else:
+        engine = backend_engine('DATABASE.db', "data", DUCKDB)
+    with engine.connect() as con:
+        rows = con.execute(text("SELECT COUNT(*) from data"))
+        print(rows.all())
 
-sql_database = SQLDatabase(engine, include_tables=["data"])
+    sql_database = SQLDatabase(engine, include_tables=["data"])
 
-query_engine = NLSQLTableQueryEngine(
-    sql_database=sql_database,
-    tables=["data"],
-    llm=llm,
-    embed_model=embed)
+    # Models are loaded once per process by the registry; the pipeline reuses the saved
+    # llama.cpp state of the prompt's instruction and schema between questions
+    _pipeline = model_registry.pipeline(sql_database, ["data"], data_version="DATABASE.db")
+    return _pipeline
 
 
 def ask_sk1(query):
     try:
-        response = query_engine.query(query)
+        response = get_pipeline().query(query)
+        if response.error is not None:
+            raise RuntimeError(response.error)
 
         print(f"Question: \n{query}")
         print(f"\nSQL Query used:\n{response.metadata['sql_query']}\n")
@@ -85,4 +55,6 @@ def ask_sk1(query):
     except Exception as e:
         print(f"Error during query execution: {e}")
 
-ask_sk1("How many unique room numbers are there in the database?")
+
+if __name__ == "__main__":
+    ask_sk1("How many unique room numbers are there in the database?")
@@ -0,0 +1,196 @@
+import time
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from kv_cache import PrefixStateCache
+
+DEFAULT_MODEL_PATH = r"C:\llm_weights\mistral-7b-instruct-v0.2.Q4_K_S.gguf"
+TOKENIZER_NAME = "mistralai/Mistral-7B-Instruct-v0.3"
+EMBED_MODEL_NAME = "BAAI/bge-m3"
+CONTEXT_WINDOW = 16348  # max 32k
+MAX_NEW_TOKENS = 1024
+
+NOT_LOADED = "not_loaded"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+
+def messages_to_prompt(messages):
+    inst_buffer = []
+
+    prompt = ""
+
+    for message in messages:
+        if message.role == 'system' or message.role == 'user':
+            inst_buffer.append(str(message.content).strip())
+
+        elif message.role == 'assistant':
+            prompt += "[INST] " + "\n".join(inst_buffer) + " [/INST]"
+            prompt += " " + str(message.content).strip() + "</s>"
+            inst_buffer.clear()
+        else:
+            raise ValueError(f"Unknown message role {message.role}")
+
+    if len(inst_buffer) > 0:
+        prompt += "[INST] " + "\n".join(inst_buffer) + " [/INST]"
+
+    return prompt
+
+
+def completion_to_prompt(completion):
+
+    return "[INST] " + str(completion).strip() + " [/INST]"
+
+
+class _ModelSlot:
+    """One lazily loaded model: loaded on first use, at most once, by whichever thread gets there first."""
+
+    def __init__(self, name: str, loader: Callable[[], Any]):
+        self.name = name
+        self._loader = loader
+        self._lock = threading.Lock()
+        self.model = None
+        self.state = NOT_LOADED
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+
+    def get(self):
+        if self.model is not None:
+            return self.model
+        with self._lock:
+            if self.model is None:
+                self.state = LOADING
+                started = time.perf_counter()
+                try:
+                    self.model = self._loader()
+                except Exception as e:
+                    self.state = FAILED
+                    self.error = str(e)
+                    raise
+                self.load_seconds = time.perf_counter() - started
+                self.state = READY
+                self.error = None
+                print(f"Loaded {self.name} in {self.load_seconds:.1f}s")
+        return self.model
+
+    def health(self) -> Dict[str, Any]:
+        return {"state": self.state, "load_seconds": self.load_seconds, "error": self.error}
+
+
+class ModelRegistry:
+    """
+    Process-wide home of the tokenizer, the llama.cpp model and the embedding model.
+    Each is loaded once on first use and then shared by every session and dataset;
+    query engines for new databases are built around the already loaded models.
+    """
+
+    def __init__(self, model_path: str = DEFAULT_MODEL_PATH, mistral_prompts: bool = True,
+                 tokenizer_name: str = TOKENIZER_NAME, embed_model_name: str = EMBED_MODEL_NAME,
+                 kv_cache_dir: Optional[str] = None):
+        self.model_path = model_path
+        self.mistral_prompts = mistral_prompts
+        self.tokenizer_name = tokenizer_name
+        self.embed_model_name = embed_model_name
+
+        self._tokenizer = _ModelSlot("tokenizer", self._load_tokenizer)
+        self._llm = _ModelSlot("llm", self._load_llm)
+        self._embed = _ModelSlot("embed_model", self._load_embed_model)
+        # Saved prompt prefix states of the llama.cpp model, shared by all pipelines
+        self.prefix_cache = PrefixStateCache(disk_dir=kv_cache_dir)
+        self._settings_applied = False
+        self._warm_up_thread: Optional[threading.Thread] = None
+
+    def _load_tokenizer(self):
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(self.tokenizer_name)
+
+    def _load_llm(self):
+        from llama_index.llms.llama_cpp import LlamaCPP
+        prompt_kwargs = {}
+        if self.mistral_prompts:
+            prompt_kwargs = {"messages_to_prompt": messages_to_prompt, "completion_to_prompt": completion_to_prompt}
+        return LlamaCPP(
+            model_path=self.model_path,
+            temperature=0.1,
+            max_new_tokens=MAX_NEW_TOKENS,
+            context_window=CONTEXT_WINDOW,
+            generate_kwargs={},
+            model_kwargs={"n_gpu_layers": -1},
+            verbose=False,
+            **prompt_kwargs,
+        )
+
+    def _load_embed_model(self):
+        from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+        return HuggingFaceEmbedding(model_name=self.embed_model_name)
+
+    @property
+    def tokenizer(self):
+        return self._tokenizer.get()
+
+    @property
+    def llm(self):
+        return self._llm.get()
+
+    @property
+    def embed_model(self):
+        return self._embed.get()
+
+    def apply_settings(self) -> None:
+        """Register the shared models as the llama_index defaults."""
+        if self._settings_applied:
+            return
+        from llama_index.core import Settings
+        Settings.llm = self.llm
+        Settings.embed_model = self.embed_model
+        Settings.tokenizer = self.tokenizer
+        self._settings_applied = True
+
+    def query_engine(self, sql_database, tables):
+        """A text-to-SQL engine over sql_database. Only the engine is new, the model weights are shared."""
+        from llama_index.core.query_engine import NLSQLTableQueryEngine
+        self.apply_settings()
+        return NLSQLTableQueryEngine(
+            sql_database=sql_database,
+            tables=tables,
+            llm=self.llm,
+            embed_model=self.embed_model)
+
+    def pipeline(self, sql_database, tables, data_version=None, query_cache=None, semantic_cache=None,
+                 column_descriptions=None):
+        """A step-by-step text-to-SQL pipeline over sql_database, for use with the inference scheduler."""
+        from sql_pipeline import SQLChatPipeline
+        self.apply_settings()
+        return SQLChatPipeline(sql_database, tables, self.llm, data_version=data_version, query_cache=query_cache,
+                               embed_model=self.embed_model, semantic_cache=semantic_cache,
+                               column_descriptions=column_descriptions, tokenizer=self.tokenizer,
+                               context_window=CONTEXT_WINDOW, max_new_tokens=MAX_NEW_TOKENS,
+                               prefix_cache=self.prefix_cache, model_name=self.model_path)
+
+    def warm_up(self, background: bool = True) -> Optional[threading.Thread]:
+        """Load every model now, in a daemon thread unless background is False."""
+        def load_all():
+            for slot in (self._tokenizer, self._embed, self._llm):
+                try:
+                    slot.get()
+                except Exception as e:
+                    print(f"Warm-up of {slot.name} failed: {e}")
+
+        if not background:
+            load_all()
+            return None
+        if self._warm_up_thread is None or not self._warm_up_thread.is_alive():
+            self._warm_up_thread = threading.Thread(target=load_all, name="model-warm-up", daemon=True)
+            self._warm_up_thread.start()
+        return self._warm_up_thread
+
+    @property
+    def ready(self) -> bool:
+        return all(slot.state == READY for slot in (self._tokenizer, self._llm, self._embed))
+
+    def health(self) -> Dict[str, Dict[str, Any]]:
+        return {slot.name: slot.health() for slot in (self._tokenizer, self._llm, self._embed)}
+
+
+model_registry = ModelRegistry()
@@ -0,0 +1,209 @@
+import math
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# Relative standard error of the distinct counts (HyperLogLog registers = (1.04 / error) ** 2)
+DEFAULT_ERROR = 0.01
+DEFAULT_TOP_K = 5
+# Heavy-hitter candidates kept per top-k slot; more candidates means more exact top-k counts
+TOP_K_CANDIDATES = 10
+MAX_DISTINCT_RATIO_FOR_TOP_K = 0.5
+
+
+def widen_dtype(current, new):
+    """Smallest dtype able to hold values of both dtypes, falling back to object."""
+    if current is None or current == new:
+        return new
+    if pd.api.types.is_numeric_dtype(current) and pd.api.types.is_numeric_dtype(new):
+        if pd.api.types.is_bool_dtype(current) or pd.api.types.is_bool_dtype(new):
+            return np.dtype(object)
+        if isinstance(current, np.dtype) and isinstance(new, np.dtype):
+            return np.result_type(current, new)
+        return np.dtype(np.float64)
+    return np.dtype(object)
+
+
+def _precision_for_error(error: float) -> int:
+    return min(18, max(4, math.ceil(math.log2((1.04 / error) ** 2))))
+
+
+def _bit_length(values: np.ndarray) -> np.ndarray:
+    # frexp is exact on 32-bit halves, which avoids float rounding on the full 64-bit value
+    hi = (values >> np.uint64(32)).astype(np.float64)
+    lo = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    return np.where(hi > 0, 32 + np.frexp(hi)[1], np.frexp(lo)[1])
+
+
+class HyperLogLog:
+    def __init__(self, error: float = DEFAULT_ERROR, precision: Optional[int] = None):
+        self.precision = precision or _precision_for_error(error)
+        self.registers = np.zeros(1 << self.precision, dtype=np.uint8)
+
+    def add_hashes(self, hashes: np.ndarray) -> None:
+        if len(hashes) == 0:
+            return
+        p = self.precision
+        index = (hashes >> np.uint64(64 - p)).astype(np.intp)
+        rest = hashes & np.uint64((1 << (64 - p)) - 1)
+        rank = ((64 - p) - _bit_length(rest) + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other: "HyperLogLog") -> None:
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches with different precision.")
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            # Linear counting is far more accurate while most registers are still empty
+            return int(round(m * math.log(m / zeros)))
+        return int(round(raw))
+
+
+def _comparable(a, b, pick):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    try:
+        return pick(a, b)
+    except TypeError:
+        # Mixed types in one object column; compare their text instead
+        return a if pick(str(a), str(b)) == str(a) else b
+
+
+class _ColumnProfile:
+    def __init__(self, error: float, top_k: int):
+        self.dtype = None
+        self.non_null = 0
+        self.hll = HyperLogLog(error)
+        self.min = None
+        self.max = None
+        self.top_k = top_k
+        self.counts: Dict = {}
+
+    def update(self, series: pd.Series) -> None:
+        self.dtype = widen_dtype(self.dtype, series.dtype)
+        values = series.dropna()
+        self.non_null += len(values)
+        if len(values) == 0:
+            return
+
+        sketch = HyperLogLog(precision=self.hll.precision)
+        sketch.add_hashes(pd.util.hash_array(values.to_numpy()))
+        chunk_distinct = sketch.estimate()
+        self.hll.merge(sketch)
+
+        try:
+            self.min = _comparable(self.min, values.min(), min)
+            self.max = _comparable(self.max, values.max(), max)
+        except TypeError:
+            as_text = values.astype(str)
+            self.min = _comparable(self.min, as_text.min(), min)
+            self.max = _comparable(self.max, as_text.max(), max)
+
+        # A chunk of (nearly) all distinct values has no heavy hitters worth a value_counts pass;
+        # small chunks (e.g. rows of an upsert) are always counted
+        capacity = self.top_k * TOP_K_CANDIDATES
+        if len(values) <= capacity or chunk_distinct < len(values) * MAX_DISTINCT_RATIO_FOR_TOP_K:
+            self._merge_counts(values.value_counts(sort=True).head(capacity).items())
+
+    def _merge_counts(self, items) -> None:
+        counts = self.counts
+        for value, count in items:
+            counts[value] = counts.get(value, 0) + int(count)
+        capacity = self.top_k * TOP_K_CANDIDATES
+        if len(counts) > capacity:
+            self.counts = dict(sorted(counts.items(), key=lambda kv: kv[1], reverse=True)[:capacity])
+
+    def subtract(self, series: pd.Series) -> None:
+        # Counts can be taken back; distinct count and min/max stay as they were (upper bounds)
+        values = series.dropna()
+        self.non_null = max(0, self.non_null - len(values))
+        for value, count in values.value_counts().items():
+            if value in self.counts:
+                left = self.counts[value] - int(count)
+                if left > 0:
+                    self.counts[value] = left
+                else:
+                    del self.counts[value]
+
+    def merge(self, other: "_ColumnProfile") -> None:
+        self.dtype = widen_dtype(self.dtype, other.dtype)
+        self.non_null += other.non_null
+        self.hll.merge(other.hll)
+        self.min = _comparable(self.min, other.min, min)
+        self.max = _comparable(self.max, other.max, max)
+        self._merge_counts(other.counts.items())
+
+    def top(self) -> List:
+        # Values seen once are not "top" values, whatever chunk size counted them
+        repeated = [(v, c) for v, c in self.counts.items() if c > 1]
+        return sorted(repeated, key=lambda kv: kv[1], reverse=True)[:self.top_k]
+
+
+class ColumnProfiler:
+    """
+    Single-pass column statistics for the "Column Insights" table: non-null counts,
+    approximate distinct counts, min/max and top-k values. Feed it chunks with update();
+    profiles of different chunks or workers combine with merge().
+    """
+
+    def __init__(self, error: float = DEFAULT_ERROR, top_k: int = DEFAULT_TOP_K):
+        self.error = error
+        self.top_k = top_k
+        self.rows = 0
+        self.columns: Dict[str, _ColumnProfile] = {}
+
+    def update(self, chunk: pd.DataFrame) -> "ColumnProfiler":
+        self.rows += len(chunk)
+        for name in chunk.columns:
+            profile = self.columns.get(name)
+            if profile is None:
+                profile = self.columns[name] = _ColumnProfile(self.error, self.top_k)
+            profile.update(chunk[name])
+        return self
+
+    def subtract(self, chunk: pd.DataFrame) -> "ColumnProfiler":
+        """Take rows that were replaced or removed back out of the counts."""
+        self.rows = max(0, self.rows - len(chunk))
+        for name in chunk.columns:
+            if name in self.columns:
+                self.columns[name].subtract(chunk[name])
+        return self
+
+    def merge(self, other: "ColumnProfiler") -> "ColumnProfiler":
+        self.rows += other.rows
+        for name, profile in other.columns.items():
+            if name in self.columns:
+                self.columns[name].merge(profile)
+            else:
+                self.columns[name] = profile
+        return self
+
+    def rename(self, new_columns) -> None:
+        """Rename the profiled columns, by position."""
+        self.columns = dict(zip(new_columns, self.columns.values()))
+
+    def to_frame(self) -> pd.DataFrame:
+        names = list(self.columns)
+        profiles = list(self.columns.values())
+        return pd.DataFrame({
+            'Column Name': names,
+            'Data Type': [p.dtype for p in profiles],
+            'Non-Null Count': [p.non_null for p in profiles],
+            'Unique Count': [min(p.hll.estimate(), p.non_null) for p in profiles],
+            'Min': [str(p.min) if p.min is not None else '' for p in profiles],
+            'Max': [str(p.max) if p.max is not None else '' for p in profiles],
+            'Top Values': [", ".join(f"{v} ({c})" for v, c in p.top()) for p in profiles],
+        })
+
+
+def profile_frame(df: pd.DataFrame, error: float = DEFAULT_ERROR, top_k: int = DEFAULT_TOP_K) -> pd.DataFrame:
+    return ColumnProfiler(error, top_k).update(df).to_frame()
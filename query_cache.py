@@ -0,0 +1,141 @@
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+DEFAULT_SQL_ENTRIES = 2048
+DEFAULT_RESULT_ENTRIES = 512
+DEFAULT_TTL_SECONDS = 60 * 60
+
+# Words that change how a question is phrased but not what it asks for
+FILLER_WORDS = {
+    "please", "kindly", "can", "could", "would", "you", "tell", "show", "give", "me", "us",
+    "the", "a", "an", "i", "want", "to", "know", "list",
+}
+
+_MISSING = object()
+
+
+def normalize_question(question: str) -> str:
+    words = re.findall(r"[\w.]+", question.lower())
+    return " ".join(w for w in words if w not in FILLER_WORDS)
+
+
+def fingerprint(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=12).hexdigest()
+
+
+class TTLCache:
+    """Thread-safe LRU mapping whose entries also expire ttl seconds after being stored."""
+
+    def __init__(self, max_entries: int, ttl: Optional[float] = DEFAULT_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            stored, value = item
+            if self.ttl is not None and time.time() - stored > self.ttl:
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.time(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def discard_if(self, predicate) -> int:
+        with self._lock:
+            keys = [k for k in self._data if predicate(k)]
+            for k in keys:
+                del self._data[k]
+            return len(keys)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class CachedResult:
+    def __init__(self, result_text: str, rows, columns, truncated: bool = False):
+        self.result_text = result_text
+        self.rows = rows
+        self.columns = columns
+        self.truncated = truncated
+        # Synthesized answers for this result, by normalized question
+        self.answers: Dict[str, str] = {}
+
+
+class QueryCache:
+    """
+    Two-level cache in front of the text-to-SQL pipeline:
+
+    - (normalized question, schema fingerprint) -> generated SQL
+    - (SQL, data version) -> result rows and the synthesized answers
+
+    Renaming columns changes the schema fingerprint and reloading the table changes the
+    data version, so stale entries are never hit; invalidate() also drops them eagerly.
+    """
+
+    def __init__(self, sql_entries: int = DEFAULT_SQL_ENTRIES, result_entries: int = DEFAULT_RESULT_ENTRIES,
+                 ttl: Optional[float] = DEFAULT_TTL_SECONDS):
+        self.sql = TTLCache(sql_entries, ttl)
+        self.results = TTLCache(result_entries, ttl)
+        self.hits = {"sql": 0, "result": 0, "answer": 0}
+        self.misses = {"sql": 0, "result": 0, "answer": 0}
+
+    def _count(self, level: str, value):
+        if value is None:
+            self.misses[level] += 1
+        else:
+            self.hits[level] += 1
+        return value
+
+    def get_sql(self, question: str, schema_fingerprint: str) -> Optional[str]:
+        return self._count("sql", self.sql.get((normalize_question(question), schema_fingerprint)))
+
+    def put_sql(self, question: str, schema_fingerprint: str, sql: str) -> None:
+        self.sql.put((normalize_question(question), schema_fingerprint), sql)
+
+    def get_result(self, sql: str, data_version: str) -> Optional[CachedResult]:
+        return self._count("result", self.results.get((sql.strip(), data_version)))
+
+    def put_result(self, sql: str, data_version: str, result_text: str, rows, columns,
+                   truncated: bool = False) -> CachedResult:
+        cached = CachedResult(result_text, rows, columns, truncated)
+        self.results.put((sql.strip(), data_version), cached)
+        return cached
+
+    def get_answer(self, cached: Optional[CachedResult], question: str) -> Optional[str]:
+        if cached is None:
+            return None
+        return self._count("answer", cached.answers.get(normalize_question(question)))
+
+    def put_answer(self, cached: Optional[CachedResult], question: str, answer: str) -> None:
+        if cached is not None:
+            cached.answers[normalize_question(question)] = answer
+
+    def invalidate(self, schema_fingerprint: Optional[str] = None, data_version: Optional[str] = None) -> int:
+        dropped = 0
+        if schema_fingerprint is not None:
+            dropped += self.sql.discard_if(lambda key: key[1] == schema_fingerprint)
+        if data_version is not None:
+            dropped += self.results.discard_if(lambda key: key[1] == data_version)
+        return dropped
+
+    def stats(self) -> Dict[str, Any]:
+        return {"sql_entries": len(self.sql), "result_entries": len(self.results),
+                "hits": dict(self.hits), "misses": dict(self.misses)}
+
+
+query_cache = QueryCache()
@@ -0,0 +1,203 @@
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from schema_prompt import content_words
+
+MAX_INDEXED_VALUES = 20000
+MAX_VALUE_WORDS = 4
+LOOKUP_ROWS = 20
+
+# Aggregate keywords, after schema_prompt.content_words() normalization
+AGGREGATE_WORDS = {
+    "unique": "count_distinct", "distinct": "count_distinct", "different": "count_distinct",
+    "total": "sum", "sum": "sum",
+    "average": "avg", "avg": "avg", "mean": "avg",
+    "minimum": "min", "min": "min", "lowest": "min", "smallest": "min", "earliest": "min",
+    "maximum": "max", "max": "max", "highest": "max", "largest": "max", "latest": "max",
+}
+# Words that only say "count the rows"
+ROW_WORDS = {"row", "record", "entry", "entrie", "count", "number", "value"}
+# Words that refer to the dataset itself or only glue the filter on
+NOISE_WORDS = {"database", "table", "data", "dataset", "file", "where", "whose", "equal", "equals"}
+_COUNT = re.compile(r"\bhow many\b|\bcount\b|\bnumber of\b")
+# Questions asking for the row or entity behind a value ("who has the highest salary",
+# "which plant", "top 5 products"); content_words() drops these words as stop words, so
+# they are checked on the raw question. The SQL for them needs the LLM
+_ENTITY = re.compile(r"\b(?:who|whom|which|top|most|least)\b")
+SQL_FUNCTIONS = {"count_distinct": "COUNT(DISTINCT {})", "sum": "SUM({})", "avg": "AVG({})",
+                 "min": "MIN({})", "max": "MAX({})"}
+LABELS = {"sum": "total", "avg": "average", "min": "minimum", "max": "maximum"}
+NUMERIC_TYPES = ("INT", "REAL", "FLOA", "DOUB", "NUMERIC", "DECIMAL", "BIGINT")
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+class Route:
+    """SQL for a question the router understood, and how to phrase its result."""
+
+    def __init__(self, kind: str, sql: str, column: Optional[str] = None, where: Optional[Tuple[str, str]] = None):
+        self.kind = kind
+        self.sql = sql
+        self.column = column
+        self.where = where
+
+    def describe(self, rows: List) -> str:
+        where = f" where {self.where[0]} is {self.where[1]}" if self.where else ""
+        if self.kind == "lookup":
+            values = [str(row[0]) for row in rows or []]
+            if not values:
+                return f"No {self.column} found{where}."
+            return f"{self.column}{where}: " + ", ".join(values)
+        value = rows[0][0] if rows else None
+        if self.kind == "count":
+            return f"There are {value} rows{where}."
+        if self.kind == "count_distinct":
+            return f"There are {value} unique values of {self.column}{where}."
+        return f"The {LABELS[self.kind]} of {self.column}{where} is {value}."
+
+
+class RouterStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit: bool) -> None:
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+
+router_stats = RouterStats()
+
+
+class QueryRouter:
+    """
+    Answers simple questions without the LLM: row counts, distinct counts, sum/avg/min/max
+    of a column and lookups of a column by a key value, optionally filtered by one value.
+    Column names and the values of text columns are indexed in the background when the
+    pipeline is bound to the data (see start_indexing); a question is only routed when
+    every content word in it is accounted for by a column, a value or an aggregate keyword. Questions for the entity behind a value ("who has the highest ...")
+    are never routed. Anything else returns None and goes to the LLM.
+    """
+
+    def __init__(self, sql_database, schema_builder, stats: RouterStats = router_stats):
+        self.sql_database = sql_database
+        self.table = schema_builder.table
+        self.schema_builder = schema_builder
+        self.stats = stats
+        self._values: Optional[Dict[str, List[Tuple[str, str]]]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def columns(self):
+        return self.schema_builder.columns
+
+    def _build_value_index(self) -> Dict[str, List[Tuple[str, str]]]:
+        index: Dict[str, List[Tuple[str, str]]] = {}
+        with self.sql_database.engine.connect() as connection:
+            for column in self.columns:
+                if any(t in column.sql_type.upper() for t in NUMERIC_TYPES):
+                    continue
+                values = connection.exec_driver_sql(
+                    f"SELECT DISTINCT {_quote(column.name)} FROM {_quote(self.table)} "
+                    f"WHERE {_quote(column.name)} IS NOT NULL LIMIT {MAX_INDEXED_VALUES + 1}"
+                ).fetchall()
+                if len(values) > MAX_INDEXED_VALUES:
+                    continue
+                for (value,) in values:
+                    key = " ".join(re.findall(r"[\w.]+", str(value).lower()))
+                    if key and len(key.split()) <= MAX_VALUE_WORDS:
+                        index.setdefault(key, []).append((column.name, str(value)))
+        return index
+
+    @property
+    def values(self) -> Dict[str, List[Tuple[str, str]]]:
+        with self._lock:
+            if self._values is None:
+                self._values = self._build_value_index()
+            return self._values
+
+    def start_indexing(self) -> None:
+        """Build the value index in a background thread; a question asked before it is done waits for it."""
+        threading.Thread(target=lambda: self.values, daemon=True).start()
+
+    def _find_value(self, tokens: List[str]):
+        # Longest run of question words that is a value of exactly one column
+        for n in range(min(MAX_VALUE_WORDS, len(tokens)), 0, -1):
+            for i in range(len(tokens) - n + 1):
+                matches = self.values.get(" ".join(tokens[i:i + n]))
+                if matches and len({c for c, _ in matches}) == 1:
+                    return matches[0], tokens[:i] + tokens[i + n:]
+        return None, tokens
+
+    def _find_column(self, words: List[str], exclude: Optional[str]):
+        best = None
+        for column in self.columns:
+            name = content_words(column.name)
+            if not name or column.name == exclude:
+                continue
+            for i in range(len(words) - len(name) + 1):
+                if words[i:i + len(name)] == name and (best is None or len(name) > len(best[1])):
+                    best = (column, name, i)
+        if best is None:
+            return None, words
+        column, name, i = best
+        return column, words[:i] + words[i + len(name):]
+
+    def _route(self, question: str) -> Optional[Route]:
+        lower = question.lower()
+        if _ENTITY.search(lower):
+            return None
+        tokens = re.findall(r"[\w.]+", lower)
+        value, tokens = self._find_value(tokens)
+        words = content_words(" ".join(tokens))
+        column, words = self._find_column(words, value[0] if value else None)
+
+        kinds = {AGGREGATE_WORDS[w] for w in words if w in AGGREGATE_WORDS}
+        counting = bool(_COUNT.search(lower))
+        leftover = [w for w in words if w not in AGGREGATE_WORDS and w not in ROW_WORDS and w not in NOISE_WORDS]
+        if value is not None:
+            # "the capacity of the Koman plant" when the value's column is called plant
+            leftover = [w for w in leftover if w not in content_words(value[0])]
+        if leftover or len(kinds) > 1:
+            return None
+
+        where_sql = f" WHERE {_quote(value[0])} = {_literal(value[1])}" if value else ""
+        table = _quote(self.table)
+        if not kinds:
+            if column is None and counting:
+                return Route("count", f"SELECT COUNT(*) FROM {table}{where_sql}", where=value)
+            if column is not None and value is not None and not counting:
+                return Route("lookup", f"SELECT {_quote(column.name)} FROM {table}{where_sql} LIMIT {LOOKUP_ROWS}",
+                             column.name, value)
+            return None
+
+        kind = kinds.pop()
+        if column is None or (kind == "count_distinct") != counting:
+            return None
+        if kind in ("sum", "avg") and not any(t in column.sql_type.upper() for t in NUMERIC_TYPES):
+            return None
+        sql = f"SELECT {SQL_FUNCTIONS[kind].format(_quote(column.name))} FROM {table}{where_sql}"
+        return Route(kind, sql, column.name, value)
+
+    def route(self, question: str) -> Optional[Route]:
+        """The Route for question, or None when it needs the LLM."""
+        try:
+            route = self._route(question)
+        except Exception as e:
+            print(f"Query router failed, using the LLM: {e}")
+            route = None
+        self.stats.record(route is not None)
+        return route
@@ -0,0 +1,235 @@
+import asyncio
+import contextvars
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterator, Optional, Tuple
+
+from sql_pipeline import ChatAnswer
+from tracing import tracer
+
+# llama.cpp keeps one context per model, so by default only one generation runs at a time
+DEFAULT_MAX_CONCURRENCY = 1
+DEFAULT_SQL_WORKERS = 4
+DEFAULT_MAX_QUEUE = 64
+WAIT_SAMPLES = 1000
+
+
+class SchedulerBusyError(RuntimeError):
+    pass
+
+
+class _Job:
+    def __init__(self, session_id: str, fn: Callable, args: tuple, future: asyncio.Future):
+        self.session_id = session_id
+        self.fn = fn
+        self.args = args
+        self.future = future
+        self.enqueued = time.perf_counter()
+        # The question's open trace span, so spans inside fn nest under it on the LLM thread
+        self.context = contextvars.copy_context()
+
+
+class InferenceScheduler:
+    """
+    Serves chat questions from many sessions against a single LLM.
+
+    Every LLM call is queued per session and the queues are served round robin, so one
+    busy session cannot starve the others. At most max_concurrency calls run on the LLM at
+    once; the SQL between the two LLM calls of a question runs in a separate thread pool,
+    leaving the LLM free for the next queued prompt. The scheduler runs its own asyncio
+    loop in a daemon thread, so it can be used from sync (Streamlit) and async (Gradio) code.
+    """
+
+    def __init__(self, max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 sql_workers: int = DEFAULT_SQL_WORKERS, max_queue: int = DEFAULT_MAX_QUEUE):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+
+        self._queues: "OrderedDict[str, Deque[_Job]]" = OrderedDict()
+        self._pending = 0
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+        self._waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+
+        self._llm_pool = ThreadPoolExecutor(max_concurrency, thread_name_prefix="llm")
+        self._sql_pool = ThreadPoolExecutor(sql_workers, thread_name_prefix="sql")
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="inference-scheduler", daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+
+    async def _start(self) -> None:
+        self._cond = asyncio.Condition()
+        for _ in range(self.max_concurrency):
+            self._loop.create_task(self._dispatch())
+
+    def _next_job(self) -> _Job:
+        session_id, queue = next(iter(self._queues.items()))
+        job = queue.popleft()
+        if queue:
+            self._queues.move_to_end(session_id)
+        else:
+            del self._queues[session_id]
+        self._pending -= 1
+        return job
+
+    async def _dispatch(self) -> None:
+        while True:
+            async with self._cond:
+                await self._cond.wait_for(lambda: self._pending > 0)
+                job = self._next_job()
+            if job.future.cancelled():
+                continue
+
+            wait = time.perf_counter() - job.enqueued
+            self._waits.append(wait)
+            job.context.run(tracer.record, "queue_wait", wait)
+            self._running += 1
+            try:
+                result = await self._loop.run_in_executor(self._llm_pool, job.context.run, job.fn, *job.args)
+            except Exception as e:
+                if not job.future.cancelled():
+                    job.future.set_exception(e)
+            else:
+                if not job.future.cancelled():
+                    job.future.set_result(result)
+            finally:
+                self._running -= 1
+                self._completed += 1
+
+    async def llm_call(self, session_id: str, fn: Callable, *args, follow_up: bool = False) -> Any:
+        """
+        Queue fn(*args) for the LLM on behalf of session_id and wait for its result.
+        Follow-up calls of a question already in progress go ahead of the session's new questions.
+        """
+        async with self._cond:
+            if self._pending >= self.max_queue and not follow_up:
+                self._rejected += 1
+                raise SchedulerBusyError("The model is busy, please try again in a moment.")
+            future = self._loop.create_future()
+            job = _Job(session_id, fn, args, future)
+            queue = self._queues.setdefault(session_id, deque())
+            if follow_up:
+                queue.appendleft(job)
+            else:
+                queue.append(job)
+            self._pending += 1
+            self._cond.notify()
+        return await future
+
+    async def run_sql(self, fn: Callable, *args) -> Any:
+        """Run fn(*args) in the SQL thread pool, without holding an LLM slot."""
+        return await self._loop.run_in_executor(self._sql_pool, contextvars.copy_context().run, fn, *args)
+
+    def _session_llm_call(self, session_id: str) -> Callable[..., Any]:
+        async def llm_call(fn, *args, follow_up=False):
+            return await self.llm_call(session_id, fn, *args, follow_up=follow_up)
+        return llm_call
+
+    async def _answer(self, session_id: str, pipeline, question: str, on_event=None,
+                      mode: Optional[str] = None) -> ChatAnswer:
+        return await pipeline.answer(question, self._session_llm_call(session_id), self.run_sql,
+                                     on_event=on_event, mode=mode)
+
+    def submit(self, session_id: str, pipeline, question: str, on_event=None, mode: Optional[str] = None) -> Future:
+        return asyncio.run_coroutine_threadsafe(
+            self._answer(session_id, pipeline, question, on_event, mode), self._loop)
+
+    def ask(self, session_id: str, pipeline, question: str, timeout: Optional[float] = None,
+            mode: Optional[str] = None) -> ChatAnswer:
+        return self.submit(session_id, pipeline, question, mode=mode).result(timeout)
+
+    async def ask_async(self, session_id: str, pipeline, question: str, mode: Optional[str] = None) -> ChatAnswer:
+        return await asyncio.wrap_future(self.submit(session_id, pipeline, question, mode=mode))
+
+    def explain(self, session_id: str, pipeline, answer: ChatAnswer, on_token=None) -> Future:
+        """
+        Synthesize the prose of a table-mode answer in the background, queued for the LLM like
+        any other call of the session. The Future resolves to the text; tokens go to on_token.
+        """
+        return asyncio.run_coroutine_threadsafe(
+            pipeline.explain(answer, self._session_llm_call(session_id), on_token), self._loop)
+
+    def explain_stream(self, session_id: str, pipeline, answer: ChatAnswer) -> Iterator[str]:
+        """Tokens of explain() as they are generated."""
+        tokens: "queue.Queue[Optional[str]]" = queue.Queue()
+        future = self.explain(session_id, pipeline, answer, on_token=tokens.put)
+        future.add_done_callback(lambda f: tokens.put(None))
+        while True:
+            token = tokens.get()
+            if token is None:
+                break
+            yield token
+        future.result()
+
+    async def explain_stream_async(self, session_id: str, pipeline, answer: ChatAnswer) -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        tokens: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+
+        def put(token):
+            loop.call_soon_threadsafe(tokens.put_nowait, token)
+
+        future = self.explain(session_id, pipeline, answer, on_token=put)
+        future.add_done_callback(lambda f: put(None))
+        while True:
+            token = await tokens.get()
+            if token is None:
+                break
+            yield token
+        future.result()
+
+    def stream(self, session_id: str, pipeline, question: str, mode: Optional[str] = None) -> Iterator[Tuple[str, Any]]:
+        """(kind, payload) progress events of one question, ending with ("done", answer)."""
+        events: "queue.Queue[Tuple[str, Any]]" = queue.Queue()
+        self.submit(session_id, pipeline, question, on_event=lambda kind, payload: events.put((kind, payload)),
+                    mode=mode)
+        while True:
+            kind, payload = events.get()
+            yield kind, payload
+            if kind == "done":
+                return
+
+    async def stream_async(self, session_id: str, pipeline, question: str,
+                           mode: Optional[str] = None) -> AsyncIterator[Tuple[str, Any]]:
+        loop = asyncio.get_running_loop()
+        events: "asyncio.Queue[Tuple[str, Any]]" = asyncio.Queue()
+
+        def on_event(kind, payload):
+            loop.call_soon_threadsafe(events.put_nowait, (kind, payload))
+
+        self.submit(session_id, pipeline, question, on_event=on_event, mode=mode)
+        while True:
+            kind, payload = await events.get()
+            yield kind, payload
+            if kind == "done":
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._waits)
+        return {
+            "queue_depth": self._pending,
+            "sessions_waiting": len(self._queues),
+            "running": self._running,
+            "completed": self._completed,
+            "rejected": self._rejected,
+            "wait_ms_avg": 1000 * sum(waits) / len(waits) if waits else 0.0,
+            "wait_ms_p95": 1000 * waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+            "wait_ms_max": 1000 * waits[-1] if waits else 0.0,
+        }
+
+
+_scheduler: Optional[InferenceScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> InferenceScheduler:
+    """The process-wide scheduler in front of the shared LLM."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = InferenceScheduler()
+    return _scheduler
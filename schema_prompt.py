@@ -0,0 +1,158 @@
+import re
+from typing import Dict, List, Optional
+
+from query_cache import FILLER_WORDS
+
+DEFAULT_SCHEMA_TOKENS = 2048
+SAMPLE_VALUES = 3
+SAMPLE_ROWS = 1000
+MAX_VALUE_CHARS = 30
+
+# Words too common in questions to say anything about which columns they need
+STOP_WORDS = FILLER_WORDS | {
+    "what", "which", "who", "how", "many", "much", "is", "are", "was", "were", "of", "in", "for",
+    "by", "with", "and", "or", "on", "at", "per", "each", "all", "there", "their", "do", "does",
+    "have", "has", "from", "than", "that", "this", "it", "be", "top", "most", "least",
+}
+
+
+def content_words(text: str) -> List[str]:
+    # Split snake_case, camelCase and spaces alike, and drop a plural "s"
+    text = re.sub(r"([a-z])([A-Z])", r"\1 \2", str(text))
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    return [w[:-1] if len(w) > 3 and w.endswith("s") else w for w in words if w not in STOP_WORDS]
+
+
+def count_tokens(text: str, tokenizer=None) -> int:
+    """Prompt tokens of text for tokenizer, or a chars/4 estimate without one."""
+    if tokenizer is None:
+        return len(text) // 4 + 1
+    return len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, tokenizer=None) -> str:
+    """text cut to at most max_tokens, on a line boundary where possible."""
+    if count_tokens(text, tokenizer) <= max_tokens:
+        return text
+    lines = text.splitlines()
+    low, high = 0, len(lines)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens("\n".join(lines[:mid]), tokenizer) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    if low == 0:
+        return text[:max_tokens * 4]
+    return "\n".join(lines[:low]) + "\n... (truncated)"
+
+
+class ColumnSummary:
+    def __init__(self, name: str, sql_type: str, samples: List[str], description: str = ""):
+        self.name = name
+        self.sql_type = sql_type
+        self.samples = samples
+        self.description = description
+        self.words = set(content_words(name))
+        self.description_words = set(content_words(description))
+        self.sample_words = {v.lower() for v in samples}
+
+    def line(self) -> str:
+        line = f"- {self.name} ({self.sql_type})"
+        if self.description:
+            line += f": {self.description}"
+        if self.samples:
+            line += "; e.g. " + ", ".join(self.samples)
+        return line
+
+    def score(self, question_words: set, question_lower: str) -> float:
+        score = 3 * len(self.words & question_words) + len(self.description_words & question_words)
+        # A value of this column quoted in the question ("in Berlin") points at it as well
+        score += 2 * sum(1 for v in self.sample_words if len(v) > 2 and v in question_lower)
+        return score
+
+
+def describe_table(sql_database, table: str, descriptions: Optional[Dict[str, str]] = None,
+                   sample_values: int = SAMPLE_VALUES) -> List[ColumnSummary]:
+    """Name, type and a few values from the first rows of every column of table."""
+    from sqlalchemy import inspect
+
+    descriptions = descriptions or {}
+    engine = sql_database.engine
+    quote = engine.dialect.identifier_preparer.quote
+    columns = []
+    with engine.connect() as connection:
+        for column in inspect(engine).get_columns(table):
+            name = column["name"]
+            values = connection.exec_driver_sql(
+                f"SELECT DISTINCT {quote(name)} FROM (SELECT {quote(name)} FROM {quote(table)} LIMIT {SAMPLE_ROWS}) "
+                f"WHERE {quote(name)} IS NOT NULL LIMIT {sample_values}"
+            ).fetchall()
+            samples = [str(v[0])[:MAX_VALUE_CHARS] for v in values]
+            columns.append(ColumnSummary(name, str(column["type"]), samples, (descriptions.get(name) or "").strip()))
+    return columns
+
+
+class SchemaPromptBuilder:
+    """
+    Compact table description for the text-to-SQL prompt: one line per column with its
+    type, the user's description and a few sample values. When the whole table does not
+    fit max_tokens, columns are ranked by how well they match the question and the least
+    relevant ones are left out.
+    """
+
+    def __init__(self, sql_database, table: str, descriptions: Optional[Dict[str, str]] = None,
+                 tokenizer=None, max_tokens: int = DEFAULT_SCHEMA_TOKENS):
+        self.sql_database = sql_database
+        self.table = table
+        self.descriptions = descriptions or {}
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self._columns: Optional[List[ColumnSummary]] = None
+        self._full: Optional[str] = None
+        self._fits: Optional[bool] = None
+
+    @property
+    def columns(self) -> List[ColumnSummary]:
+        if self._columns is None:
+            self._columns = describe_table(self.sql_database, self.table, self.descriptions)
+        return self._columns
+
+    def _render(self, columns: List[ColumnSummary], omitted: int = 0) -> str:
+        lines = [f"Table {self.table} columns:"] + [c.line() for c in columns]
+        if omitted:
+            lines.append(f"({omitted} less relevant columns not shown)")
+        return "\n".join(lines)
+
+    @property
+    def full_schema(self) -> str:
+        """Every column, in table order. Used whenever it fits the budget, so it stays the same across questions."""
+        if self._full is None:
+            self._full = self._render(self.columns)
+        return self._full
+
+    def fits(self) -> bool:
+        if self._fits is None:
+            self._fits = count_tokens(self.full_schema, self.tokenizer) <= self.max_tokens
+        return self._fits
+
+    def build(self, question: str) -> str:
+        if self.fits():
+            return self.full_schema
+
+        question_words = set(content_words(question))
+        question_lower = question.lower()
+        order = {c.name: i for i, c in enumerate(self.columns)}
+        ranked = sorted(self.columns, key=lambda c: (-c.score(question_words, question_lower), order[c.name]))
+
+        header_tokens = count_tokens(self._render([], len(self.columns)), self.tokenizer)
+        budget = self.max_tokens - header_tokens
+        chosen = []
+        for column in ranked:
+            tokens = count_tokens(column.line(), self.tokenizer) + 1
+            if tokens > budget:
+                continue
+            chosen.append(column)
+            budget -= tokens
+        chosen.sort(key=lambda c: order[c.name])
+        return self._render(chosen, len(self.columns) - len(chosen))
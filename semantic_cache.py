@@ -0,0 +1,107 @@
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_THRESHOLD = 0.92
+DEFAULT_MAX_QUESTIONS = 1000
+
+_STRING_LITERAL = re.compile(r"'((?:[^']|'')*)'")
+_NUMBER = re.compile(r"(?<![\w.])\d+(?:\.\d+)?(?![\w.])")
+
+
+def literals_consistent(sql: str, question: str) -> bool:
+    """
+    Cheap check that SQL written for a similar question also fits this one: every string
+    literal in the SQL must occur in the question, and every number in the question in the SQL.
+    Near-identical questions about different values ("building A" vs "building B") fail it.
+    """
+    question_lower = question.lower()
+    for literal in _STRING_LITERAL.findall(sql):
+        value = literal.replace("''", "'").strip("%").lower()
+        if value and value not in question_lower:
+            return False
+    sql_numbers = set(_NUMBER.findall(sql))
+    return all(number in sql_numbers for number in _NUMBER.findall(question))
+
+
+class _QuestionIndex:
+    def __init__(self, dim: int, capacity: int):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.entries: List[Optional[Tuple[str, str]]] = [None] * capacity
+        self.size = 0
+        self.next = 0
+
+    def add(self, vector: np.ndarray, question: str, sql: str) -> None:
+        # Ring buffer: once full, the oldest question is overwritten
+        self.vectors[self.next] = vector
+        self.entries[self.next] = (question, sql)
+        self.next = (self.next + 1) % len(self.entries)
+        self.size = min(self.size + 1, len(self.entries))
+
+    def best(self, vector: np.ndarray):
+        if self.size == 0:
+            return None, 0.0
+        scores = self.vectors[:self.size] @ vector
+        i = int(np.argmax(scores))
+        return self.entries[i], float(scores[i])
+
+
+class SemanticQuestionCache:
+    """
+    Embeddings of past questions per dataset, searched by cosine similarity, so a
+    paraphrase of an earlier question can reuse that question's SQL instead of asking
+    the LLM to write it again.
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, max_questions: int = DEFAULT_MAX_QUESTIONS):
+        self.threshold = threshold
+        self.max_questions = max_questions
+        self._indexes: Dict[str, _QuestionIndex] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, dataset_key: str, embedding) -> Optional[Tuple[str, str, float]]:
+        """(question, sql, score) of the closest cached question above the threshold, or None."""
+        vector = self._normalize(embedding)
+        with self._lock:
+            index = self._indexes.get(dataset_key)
+            if index is None or index.vectors.shape[1] != len(vector):
+                return None
+            entry, score = index.best(vector)
+        if entry is None or score < self.threshold:
+            return None
+        return entry[0], entry[1], score
+
+    def add(self, dataset_key: str, embedding, question: str, sql: str) -> None:
+        vector = self._normalize(embedding)
+        with self._lock:
+            index = self._indexes.get(dataset_key)
+            if index is None or index.vectors.shape[1] != len(vector):
+                index = self._indexes[dataset_key] = _QuestionIndex(len(vector), self.max_questions)
+            index.add(vector, question, sql)
+
+    def record(self, hit: bool) -> None:
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def invalidate(self, dataset_key: str) -> None:
+        with self._lock:
+            self._indexes.pop(dataset_key, None)
+
+    def stats(self):
+        return {"datasets": len(self._indexes), "hits": self.hits, "misses": self.misses,
+                "questions": sum(index.size for index in self._indexes.values())}
+
+
+semantic_cache = SemanticQuestionCache()
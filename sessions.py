@@ -0,0 +1,76 @@
+import time
+import threading
+from typing import Any, Dict, Optional
+
+from frame_memory import frame_bytes, shared_frames
+
+DEFAULT_IDLE_TIMEOUT = 4 * 60 * 60
+
+
+class ChatSession:
+    """Dataset and query state belonging to one browser session."""
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.df = None
+        self.file_digest: Optional[str] = None
+        self.db_path: Optional[str] = None
+        # Database holding the full table when the upload was combined from several files
+        self.source_db_path: Optional[str] = None
+        # Column name -> description entered in the column editor
+        self.column_descriptions: Dict[str, str] = {}
+        # (view, DataPager) of the data browser, kept while the sort and filter stay the same
+        self.pager = None
+        self.pipeline = None
+        # SQL of the latest answer whose result was cut for the chat, downloadable in full
+        self.last_result_sql: Optional[str] = None
+        self.last_used = time.time()
+
+
+class SessionStore:
+    def __init__(self, idle_timeout: float = DEFAULT_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._sessions: Dict[str, ChatSession] = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> ChatSession:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                self._evict_idle()
+                session = self._sessions[session_id] = ChatSession(session_id)
+            session.last_used = time.time()
+            return session
+
+    def find(self, session_id: str) -> Optional[ChatSession]:
+        """The session if it exists, without creating it."""
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def drop(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _evict_idle(self) -> None:
+        cutoff = time.time() - self.idle_timeout
+        for session_id in [s for s, session in self._sessions.items() if session.last_used < cutoff]:
+            del self._sessions[session_id]
+
+    def memory_report(self) -> Dict[str, Any]:
+        """
+        Bytes of dataset held per session. Sessions on the same upload share one copy,
+        so the process total counts every dataset once.
+        """
+        with self._lock:
+            sessions = list(self._sessions.values())
+        per_session, per_dataset = {}, {}
+        for session in sessions:
+            size = frame_bytes(session.df)
+            per_session[session.session_id] = {"dataset": session.file_digest, "bytes": size,
+                                               "rows": 0 if session.df is None else len(session.df)}
+            per_dataset[session.file_digest] = size
+        return {"sessions": per_session, "total_bytes": sum(per_dataset.values()),
+                "shared": shared_frames.stats()}
+
+    def __len__(self) -> int:
+        return len(self._sessions)
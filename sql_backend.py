@@ -0,0 +1,246 @@
+import os
+import sys
+import math
+import uuid
+import sqlite3
+from typing import Iterable, List, Optional, Tuple
+
+from sqlite_loader import quote_identifier
+
+SQLITE = "sqlite"
+DUCKDB = "duckdb"
+BACKENDS = (SQLITE, DUCKDB)
+EXPORT_BATCH_ROWS = 100_000
+
+
+def _arrow_type(declared: str, stored: Tuple[int, int, int]):
+    """
+    Arrow type and converter of a column, from the types its values are actually stored as
+    (has text or blobs, has reals, has integers): the declared affinity comes from a sample
+    of the first rows and does not stop later rows from holding 3.5 or 'N/A'.
+    """
+    import pyarrow as pa
+    has_text, has_real, has_int = stored
+    if not (has_text or has_real or has_int):
+        # Only NULLs, the declaration is all there is to go by
+        declared = declared.upper()
+        has_int = "INT" in declared
+        has_real = any(t in declared for t in ("REAL", "FLOA", "DOUB"))
+    if has_text:
+        return pa.string(), lambda v: v if v is None or isinstance(v, str) else (
+            v.decode("utf-8", "replace") if isinstance(v, bytes) else str(v))
+    if has_real:
+        return pa.float64(), lambda v: v if v is None else float(v)
+    return pa.int64(), lambda v: v
+
+
+def _stored_types(conn: sqlite3.Connection, table: str, names: List[str]) -> List[Tuple[int, int, int]]:
+    # One scan for every column; typeof() is the storage class of each value
+    checks = []
+    for name in names:
+        c = quote_identifier(name)
+        checks += [f"MAX(typeof({c}) IN ('text', 'blob'))", f"MAX(typeof({c}) = 'real')",
+                   f"MAX(typeof({c}) = 'integer')"]
+    row = conn.execute(f"SELECT {', '.join(checks)} FROM {quote_identifier(table)}").fetchone()
+    row = [value or 0 for value in row]
+    return [tuple(row[i:i + 3]) for i in range(0, len(row), 3)]
+
+
+def export_parquet(sqlite_path: str, table: str, parquet_path: str, batch_rows: int = EXPORT_BATCH_ROWS) -> int:
+    """
+    Write table to a Parquet file, batch by batch. Each column is typed by the values stored
+    in it: integers stay int64, a column with any reals becomes float64 and one with any text
+    a string column, so no value is truncated or rejected.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    conn = sqlite3.connect(f"file:{sqlite_path}?mode=ro", uri=True)
+    try:
+        info = conn.execute(f"PRAGMA table_info({quote_identifier(table)})").fetchall()
+        names = [row[1] for row in info]
+        types = [_arrow_type(row[2] or "", stored)
+                 for row, stored in zip(info, _stored_types(conn, table, names))]
+        schema = pa.schema([(name, arrow_type) for name, (arrow_type, _) in zip(names, types)])
+
+        rows = 0
+        cursor = conn.execute(f"SELECT * FROM {quote_identifier(table)}")
+        with pq.ParquetWriter(parquet_path, schema) as writer:
+            while True:
+                batch = cursor.fetchmany(batch_rows)
+                if not batch:
+                    break
+                arrays = [pa.array([convert(v) for v in column], type=arrow_type)
+                          for column, (arrow_type, convert) in zip(zip(*batch), types)]
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+                rows += len(batch)
+        return rows
+    finally:
+        conn.close()
+
+
+def _fresh(path: str, source: str) -> bool:
+    return os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(source)
+
+
+def _build_atomically(path: str, build) -> str:
+    tmp = os.path.join(os.path.dirname(path) or ".", f".{uuid.uuid4().hex}{os.path.splitext(path)[1]}")
+    try:
+        build(tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return path
+
+
+def duckdb_database(sqlite_path: str, table: str) -> str:
+    """
+    DuckDB file next to the SQLite database whose table is a view over a Parquet copy of
+    the data. Both are rebuilt when the SQLite file is newer than them.
+    """
+    import duckdb
+
+    base = os.path.splitext(sqlite_path)[0]
+    parquet_path = base + ".parquet"
+    duckdb_path = base + ".duckdb"
+    if not _fresh(parquet_path, sqlite_path):
+        _build_atomically(parquet_path, lambda tmp: export_parquet(sqlite_path, table, tmp))
+    if not _fresh(duckdb_path, parquet_path):
+        def build(tmp):
+            conn = duckdb.connect(tmp)
+            try:
+                source = os.path.abspath(parquet_path).replace("'", "''")
+                conn.execute(f"CREATE VIEW {quote_identifier(table)} AS SELECT * FROM read_parquet('{source}')")
+            finally:
+                conn.close()
+        _build_atomically(duckdb_path, build)
+    return duckdb_path
+
+
+def backend_engine(sqlite_path: str, table: str, backend: str = SQLITE):
+    """
+    SQLAlchemy engine over the chat database in the chosen backend: the SQLite file
+    itself, or DuckDB running vectorized over a Parquet copy of it.
+    """
+    from sqlalchemy import create_engine
+
+    if backend == SQLITE:
+        return create_engine(f"sqlite:///{sqlite_path}")
+    if backend == DUCKDB:
+        # NULLs sort first ascending and last descending, as in SQLite
+        return create_engine(f"duckdb:///{duckdb_database(sqlite_path, table)}",
+                             connect_args={"read_only": True,
+                                           "config": {"default_null_order": "nulls_first_on_asc_last_on_desc"}})
+    raise ValueError(f"Unknown SQL backend {backend!r}, expected one of {BACKENDS}")
+
+
+def default_queries(sqlite_path: str, table: str) -> List[str]:
+    """Aggregates over every column, the kind of SQL the chat generates most."""
+    conn = sqlite3.connect(f"file:{sqlite_path}?mode=ro", uri=True)
+    try:
+        info = conn.execute(f"PRAGMA table_info({quote_identifier(table)})").fetchall()
+    finally:
+        conn.close()
+    t = quote_identifier(table)
+    queries = [f"SELECT COUNT(*) FROM {t}"]
+    group_column = None
+    for _, name, declared, *_ in info:
+        c = quote_identifier(name)
+        queries.append(f"SELECT COUNT(DISTINCT {c}), COUNT({c}) FROM {t}")
+        if any(k in (declared or "").upper() for k in ("INT", "REAL", "FLOA", "DOUB")):
+            queries.append(f"SELECT MIN({c}), MAX({c}), SUM({c}), AVG({c}) FROM {t}")
+        elif group_column is None:
+            group_column = c
+    if group_column is not None:
+        queries.append(f"SELECT {group_column}, COUNT(*) FROM {t} GROUP BY {group_column} "
+                       f"ORDER BY COUNT(*) DESC, {group_column} LIMIT 20")
+    return queries
+
+
+def _same(a, b) -> bool:
+    if isinstance(a, float) or isinstance(b, float):
+        if a is None or b is None:
+            return a is b
+        return math.isclose(float(a), float(b), rel_tol=1e-9, abs_tol=1e-9)
+    return a == b
+
+
+def _same_rows(left, right, ordered: bool) -> bool:
+    if len(left) != len(right):
+        return False
+    if not ordered:
+        left, right = sorted(left, key=repr), sorted(right, key=repr)
+    return all(len(x) == len(y) and all(_same(a, b) for a, b in zip(x, y)) for x, y in zip(left, right))
+
+
+def compare_backends(sqlite_path: str, table: str, queries: Optional[Iterable[str]] = None) -> List[Tuple[str, str]]:
+    """
+    Run every query on the SQLite and DuckDB backends and return (query, problem) for
+    each one whose results differ. Row order only matters for queries with ORDER BY.
+    """
+    queries = list(queries) if queries is not None else default_queries(sqlite_path, table)
+    engines = {backend: backend_engine(sqlite_path, table, backend) for backend in BACKENDS}
+    mismatches = []
+    for query in queries:
+        results = {}
+        for backend, engine in engines.items():
+            try:
+                with engine.connect() as connection:
+                    results[backend] = [tuple(row) for row in connection.exec_driver_sql(query).fetchall()]
+            except Exception as e:
+                results[backend] = e
+        sqlite_rows, duckdb_rows = results[SQLITE], results[DUCKDB]
+        if isinstance(sqlite_rows, Exception) or isinstance(duckdb_rows, Exception):
+            mismatches.append((query, f"sqlite: {sqlite_rows!r:.200} duckdb: {duckdb_rows!r:.200}"))
+        elif not _same_rows(sqlite_rows, duckdb_rows, "ORDER BY" in query.upper()):
+            mismatches.append((query, f"sqlite: {sqlite_rows[:5]!r:.200} duckdb: {duckdb_rows[:5]!r:.200}"))
+    for engine in engines.values():
+        engine.dispose()
+    return mismatches
+
+
+def self_check() -> List[Tuple[str, str]]:
+    """
+    compare_backends on a small table mixing types the way uploads do: floats among the
+    ints of an INTEGER column, codes that look like numbers in a TEXT column, NULLs and
+    non-ASCII text. Text in a numeric column is left out: it becomes a string column in
+    DuckDB, which refuses SUM/AVG over it where SQLite counts the text as 0. Run as
+    python sql_backend.py --self-check.
+    """
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "mixed.db")
+        conn = sqlite3.connect(path)
+        try:
+            conn.execute("CREATE TABLE data (id INTEGER, amount REAL, city TEXT, code TEXT, score INTEGER)")
+            conn.executemany("INSERT INTO data VALUES (?, ?, ?, ?, ?)", [
+                (1, 10.5, "Berlin", "007", 3), (2, 3, "Paris", "A1", 2.5), (3, None, "Zürich", "7", None),
+                (4, 7, None, None, 4), (5, 0.25, "Berlin", "007", -1), (6, 12, "Paris", "B-2", 7),
+            ])
+            conn.commit()
+        finally:
+            conn.close()
+        return compare_backends(path, "data")
+
+
+if __name__ == "__main__":
+    # Parity check: python sql_backend.py DATABASE.db [table] [queries.sql, one statement per line]
+    #           or: python sql_backend.py --self-check, on a built-in mixed-type table
+    if sys.argv[1:] == ["--self-check"]:
+        problems = self_check()
+        for sql, problem in problems:
+            print(f"MISMATCH {sql}\n    {problem}")
+        print(f"self-check: {len(problems)} mismatches")
+        sys.exit(1 if problems else 0)
+    db_path = sys.argv[1] if len(sys.argv) > 1 else "DATABASE.db"
+    table_name = sys.argv[2] if len(sys.argv) > 2 else "data"
+    sql_lines = None
+    if len(sys.argv) > 3:
+        with open(sys.argv[3], encoding="utf-8") as f:
+            sql_lines = [line.strip().rstrip(";") for line in f if line.strip()]
+    problems = compare_backends(db_path, table_name, sql_lines)
+    for sql, problem in problems:
+        print(f"MISMATCH {sql}\n    {problem}")
+    print(f"{len(problems)} mismatches")
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,320 @@
+import io
+import csv
+import random
+import re
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Generated SQL gets this long before it is cancelled; full result exports get longer
+MAX_SQL_SECONDS = 20
+EXPORT_SECONDS = 300
+# Rows handed to the answer synthesis and the preview; larger results are cut or sampled
+MAX_RESULT_ROWS = 1000
+# Plans whose nested loops would examine more rows than this (Cartesian joins, nested scans)
+# are refused; a single scan of a table is never refused, however large the table
+MAX_ESTIMATED_ROWS = 50_000_000
+STREAM_BATCH_ROWS = 5000
+# SQLite VM instructions between two checks of the time budget
+PROGRESS_STEPS = 10_000
+# Rows one index lookup is assumed to return when the plan shows SEARCH
+SEARCH_ROWS = 10
+# Same as llama_index's SQLDatabase: long strings are cut before they reach the prompt
+MAX_STRING_LENGTH = 300
+
+TRUNCATE = "truncate"
+SAMPLE = "sample"
+
+_LOOP = re.compile(r"^(SCAN|SEARCH) (?:TABLE )?(\S+)")
+# A VALUES list or a SELECT without FROM: "SCAN CONSTANT ROW", "SCAN 3 CONSTANT ROWS"
+_CONSTANT = re.compile(r"^SCAN (?:(\d+) )?CONSTANT ROW")
+# Subqueries whose rows a later "SCAN (subquery-N)" reads
+_SUBQUERY = re.compile(r"^(?:CO-ROUTINE|MATERIALIZE) (\S+)")
+
+
+class SQLGuardError(RuntimeError):
+    pass
+
+
+class GuardedResult:
+    """Rows of one guarded query, capped for the prompt, with what was left out."""
+
+    def __init__(self, rows: List[tuple], columns: List[str], truncated: bool = False,
+                 total_rows: Optional[int] = None, sampled: bool = False):
+        self.rows = rows
+        self.columns = columns
+        self.truncated = truncated
+        # Rows of the full result, unknown when it was truncated
+        self.total_rows = total_rows
+        self.sampled = sampled
+        self.seconds = 0.0
+
+    def text(self) -> str:
+        text = str(self.rows)
+        if self.sampled:
+            text += f"\n(random sample of {len(self.rows):,} out of {self.total_rows:,} rows)"
+        elif self.truncated:
+            text += f"\n(first {len(self.rows):,} rows only, the result has more)"
+        return text
+
+
+def _shorten(value):
+    if isinstance(value, str) and len(value) > MAX_STRING_LENGTH:
+        return value[:MAX_STRING_LENGTH] + "..."
+    return value
+
+
+class SQLGuard:
+    """
+    Runs generated SQL with limits, in place of SQLDatabase.run_sql:
+
+    - the plan from EXPLAIN QUERY PLAN is costed and queries whose nested loops would examine
+      more than max_estimated_rows are refused before they start
+    - queries are read-only and cancelled after max_seconds, through SQLite's progress
+      handler (or the driver's interrupt() on other backends)
+    - at most max_rows rows are fetched for the answer; with overflow="sample" the rest of
+      the result is read to keep a uniform random sample instead of the first rows
+
+    Full results are streamed from the cursor batch by batch with stream() and export_csv().
+    """
+
+    def __init__(self, engine, max_seconds: float = MAX_SQL_SECONDS, max_rows: int = MAX_RESULT_ROWS,
+                 max_estimated_rows: int = MAX_ESTIMATED_ROWS, overflow: str = TRUNCATE):
+        if overflow not in (TRUNCATE, SAMPLE):
+            raise ValueError(f"overflow must be {TRUNCATE!r} or {SAMPLE!r}, not {overflow!r}")
+        self.engine = engine
+        self.max_seconds = max_seconds
+        self.max_rows = max_rows
+        self.max_estimated_rows = max_estimated_rows
+        self.overflow = overflow
+        self.sqlite = engine.dialect.name == "sqlite"
+        self._table_rows: Optional[Dict[str, int]] = None
+        self.stats = {"queries": 0, "refused": 0, "cancelled": 0, "truncated": 0}
+
+    def _raw_connection(self):
+        raw = self.engine.raw_connection()
+        return raw, raw.driver_connection
+
+    def table_rows(self, conn) -> Dict[str, int]:
+        # Highest rowid instead of COUNT(*): an index lookup instead of a scan, close enough for costing
+        if self._table_rows is None:
+            tables = [name for (name,) in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+            counts = {}
+            for name in tables:
+                quoted = '"' + name.replace('"', '""') + '"'
+                try:
+                    counts[name] = conn.execute(f"SELECT MAX(_rowid_) FROM {quoted}").fetchone()[0] or 0
+                except Exception:
+                    counts[name] = conn.execute(f"SELECT COUNT(*) FROM {quoted}").fetchone()[0]
+            self._table_rows = counts
+        return self._table_rows
+
+    def estimate_rows(self, sql: str, conn=None) -> int:
+        """Rows SQLite would examine for sql, from its query plan: nested loops multiply."""
+        return self._plan_cost(sql, conn)[0]
+
+    def _plan_cost(self, sql: str, conn=None) -> Tuple[int, int]:
+        """
+        (rows examined, rows examined inside another loop) for sql. The second part is what
+        grows with a join or correlated subquery; a lone scan contributes to the first only.
+        """
+        if not self.sqlite:
+            return 0, 0
+        raw = None
+        if conn is None:
+            raw, conn = self._raw_connection()
+        try:
+            plan = conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+            table_rows = self.table_rows(conn)
+        finally:
+            if raw is not None:
+                raw.close()
+
+        # Aliases are all the plan names in newer SQLite; an unknown name counts as the largest table
+        largest = max(table_rows.values(), default=0)
+        children: Dict[int, List[Tuple[int, str]]] = {}
+        for node_id, parent, _, detail in plan:
+            children.setdefault(parent, []).append((node_id, detail))
+
+        # Rows each subquery produces at most, by its name in the plan
+        produced: Dict[str, int] = {}
+
+        def cost(parent: int, loops: int, loop_rows: int) -> Tuple[int, int, int]:
+            total = nested = 0
+            for node_id, detail in children.get(parent, []):
+                constant = _CONSTANT.match(detail)
+                match = _LOOP.match(detail)
+                if constant:
+                    # No table behind it, only the rows it produces count
+                    loop_rows *= int(constant.group(1) or 1)
+                elif match:
+                    name = match.group(2)
+                    rows = produced.get(name, table_rows.get(name, largest))
+                    rows = min(rows, SEARCH_ROWS) if match.group(1) == "SEARCH" else rows
+                    loops += 1
+                    loop_rows *= max(rows, 1)
+                    total += loop_rows
+                    if loops > 1:
+                        nested += loop_rows
+                elif detail.startswith("CORRELATED"):
+                    # Runs once per row of the loops around it
+                    inner = cost(node_id, loops, loop_rows)
+                    total, nested = total + inner[0], nested + inner[1]
+                else:
+                    # Other subqueries run once
+                    inner = cost(node_id, 0, 1)
+                    total, nested = total + inner[0], nested + inner[1]
+                    subquery = _SUBQUERY.match(detail)
+                    if subquery:
+                        produced[subquery.group(1)] = inner[2]
+            return total, nested, loop_rows
+
+        return cost(0, 0, 1)[:2]
+
+    def _limit(self, conn, deadline: float) -> Optional[threading.Timer]:
+        if self.sqlite:
+            conn.set_progress_handler(lambda: 1 if time.perf_counter() > deadline else 0, PROGRESS_STEPS)
+            conn.execute("PRAGMA query_only = ON")
+            return None
+        timer = None
+        if hasattr(conn, "interrupt"):
+            timer = threading.Timer(max(deadline - time.perf_counter(), 0), conn.interrupt)
+            timer.daemon = True
+            timer.start()
+        return timer
+
+    def _unlimit(self, conn, timer) -> None:
+        if self.sqlite:
+            conn.set_progress_handler(None, PROGRESS_STEPS)
+            conn.execute("PRAGMA query_only = OFF")
+        elif timer is not None:
+            timer.cancel()
+
+    def _execute(self, sql: str, max_seconds: float, check_cost: bool = True):
+        """(raw connection, driver connection, cursor, timer), with the limits in place."""
+        raw, conn = self._raw_connection()
+        timer = None
+        try:
+            if check_cost and self.sqlite and self.max_estimated_rows:
+                _, estimated = self._plan_cost(sql, conn)
+                if estimated > self.max_estimated_rows:
+                    self.stats["refused"] += 1
+                    raise SQLGuardError(f"Query refused: it would examine about {estimated:,} rows, "
+                                        f"more than the limit of {self.max_estimated_rows:,}. "
+                                        f"Ask for fewer rows or add a filter.")
+            timer = self._limit(conn, time.perf_counter() + max_seconds)
+            cursor = conn.cursor()
+            cursor.execute(sql)
+            return raw, conn, cursor, timer
+        except Exception as e:
+            self._close(raw, conn, timer)
+            raise self._translate(e, max_seconds) from e
+
+    def _close(self, raw, conn, timer) -> None:
+        try:
+            self._unlimit(conn, timer)
+        finally:
+            raw.close()
+
+    def _translate(self, error: Exception, max_seconds: float) -> Exception:
+        if isinstance(error, SQLGuardError):
+            return error
+        if "interrupt" in str(error).lower():
+            self.stats["cancelled"] += 1
+            return SQLGuardError(f"Query cancelled after {max_seconds:.0f}s, it took too long.")
+        if "readonly" in str(error).lower().replace("-", "").replace(" ", ""):
+            return SQLGuardError("Only read-only queries are allowed.")
+        return error
+
+    def run(self, sql: str) -> GuardedResult:
+        started = time.perf_counter()
+        self.stats["queries"] += 1
+        raw, conn, cursor, timer = self._execute(sql, self.max_seconds)
+        try:
+            columns = [d[0] for d in cursor.description or []]
+            rows = cursor.fetchmany(self.max_rows + 1) if columns else []
+            result = GuardedResult(rows, columns, total_rows=len(rows))
+            if len(rows) > self.max_rows:
+                self.stats["truncated"] += 1
+                result.truncated = True
+                result.total_rows = None
+                if self.overflow == SAMPLE:
+                    self._sample(cursor, result)
+                else:
+                    del rows[self.max_rows:]
+        except Exception as e:
+            raise self._translate(e, self.max_seconds) from e
+        finally:
+            self._close(raw, conn, timer)
+        result.rows = [tuple(_shorten(v) for v in row) for row in result.rows]
+        result.seconds = time.perf_counter() - started
+        return result
+
+    def _sample(self, cursor, result: GuardedResult) -> None:
+        # Reservoir sampling over the rest of the cursor, kept in result order
+        rng = random.Random(0)
+        reservoir = list(enumerate(result.rows[:self.max_rows]))
+        seen = self.max_rows
+        extra = result.rows[self.max_rows:]
+        while True:
+            for row in extra:
+                j = rng.randrange(seen + 1)
+                if j < self.max_rows:
+                    reservoir[j] = (seen, row)
+                seen += 1
+            extra = cursor.fetchmany(STREAM_BATCH_ROWS)
+            if not extra:
+                break
+        result.rows = [row for _, row in sorted(reservoir, key=lambda t: t[0])]
+        result.total_rows = seen
+        result.sampled = True
+
+    def stream(self, sql: str, batch_rows: int = STREAM_BATCH_ROWS,
+               max_seconds: float = EXPORT_SECONDS) -> Tuple[List[str], Iterator[List[tuple]]]:
+        """
+        (columns, batches) of the complete result, fetched from the cursor batch by batch as
+        the batches are consumed. Runs read-only and under max_seconds like run().
+        """
+        raw, conn, cursor, timer = self._execute(sql, max_seconds, check_cost=False)
+        columns = [d[0] for d in cursor.description or []]
+
+        def batches():
+            try:
+                while True:
+                    batch = cursor.fetchmany(batch_rows)
+                    if not batch:
+                        break
+                    yield batch
+            except Exception as e:
+                raise self._translate(e, max_seconds) from e
+            finally:
+                self._close(raw, conn, timer)
+
+        return columns, batches()
+
+    def iter_csv(self, sql: str, batch_rows: int = STREAM_BATCH_ROWS) -> Iterator[str]:
+        """The complete result as CSV text, one chunk per batch, e.g. for a streaming HTTP response."""
+        columns, batches = self.stream(sql, batch_rows)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for batch in batches:
+            writer.writerows(batch)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    def export_csv(self, sql: str, path: str, batch_rows: int = STREAM_BATCH_ROWS) -> int:
+        """Write the complete result to a CSV file without holding it in memory; returns the row count."""
+        columns, batches = self.stream(sql, batch_rows)
+        rows = 0
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for batch in batches:
+                writer.writerows(batch)
+                rows += len(batch)
+        return rows
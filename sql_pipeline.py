@@ -0,0 +1,507 @@
+import os
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from indexer import get_indexer
+from kv_cache import PrefixStateCache
+from query_cache import QueryCache, fingerprint
+from query_router import QueryRouter
+from schema_prompt import DEFAULT_SCHEMA_TOKENS, SchemaPromptBuilder, count_tokens, truncate_to_tokens
+from semantic_cache import SemanticQuestionCache, literals_consistent
+from sql_guard import SQLGuard
+from tracing import tracer
+
+# Share of the context window the query result may take up in the synthesis prompt
+RESULT_CONTEXT_SHARE = 0.5
+DEFAULT_RESULT_TOKENS = 4096
+
+# Answer modes: prose from a second LLM call, or the result table with a templated summary
+SYNTHESIZE = "synthesize"
+TABLE = "table"
+ANSWER_MODES = (SYNTHESIZE, TABLE)
+# Rows of the result shown when the table is the answer
+TABLE_PREVIEW_ROWS = 50
+
+# Stands in for the question while rendering the part of the prompt that comes before it
+_QUESTION_MARK = "\u2063QUESTION\u2063"
+
+
+def parse_sql(response: str) -> str:
+    """Pull the SQL statement out of a text-to-SQL completion."""
+    sql_query_start = response.find("SQLQuery:")
+    if sql_query_start != -1:
+        response = response[sql_query_start + len("SQLQuery:"):]
+    sql_result_start = response.find("SQLResult:")
+    if sql_result_start != -1:
+        response = response[:sql_result_start]
+    return response.strip().strip("```").strip()
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float):
+        return f"{value:,.2f}" if abs(value) >= 0.01 or value == 0 else f"{value:.4g}"
+    if isinstance(value, int) and not isinstance(value, bool):
+        return f"{value:,}"
+    return str(value)
+
+
+def summarize_result(rows: Optional[List], columns: Optional[List[str]], truncated: bool = False) -> str:
+    """One line about a query result, from templates instead of the LLM."""
+    if not rows:
+        return "The query returned no rows."
+    columns = columns or [f"column {i + 1}" for i in range(len(rows[0]))]
+    if len(rows) == 1:
+        # A single value (a count, a sum, ...) or a single record
+        return ", ".join(f"{c}: {_format_value(v)}" for c, v in zip(columns, rows[0])) + "."
+    count = f"More than {len(rows):,}" if truncated else f"{len(rows):,}"
+    if len(columns) == 1:
+        return f"{count} values of {columns[0]}."
+    return f"{count} rows of {', '.join(columns)}."
+
+
+class ChatAnswer:
+    """Everything one question produced: the SQL, its result and the synthesized answer."""
+
+    def __init__(self, question: str):
+        self.question = question
+        self.sql: Optional[str] = None
+        self.rows: Optional[List] = None
+        self.columns: Optional[List[str]] = None
+        self.result_text: Optional[str] = None
+        self.response: Optional[str] = None
+        self.error: Optional[str] = None
+        # The result had more rows than were kept for the answer (see SQLGuard)
+        self.truncated = False
+        # (earlier question, similarity) when its SQL was reused for this one
+        self.reused_from: Optional[tuple] = None
+        # Answered by the query router, without the LLM
+        self.routed = False
+        # TABLE when response is a templated summary of the result instead of synthesized prose
+        self.mode = SYNTHESIZE
+        self.timings: Dict[str, float] = {}
+        # Answer tokens streamed so far
+        self.tokens = 0
+
+    @property
+    def time_to_first_token(self) -> Optional[float]:
+        return self.timings.get("first_token")
+
+    @property
+    def tokens_per_sec(self) -> Optional[float]:
+        decode = self.timings.get("decode")
+        return self.tokens / decode if decode else None
+
+    def speed_summary(self) -> str:
+        if self.time_to_first_token is None:
+            return ""
+        summary = f"first token after {self.time_to_first_token:.2f}s"
+        if self.tokens_per_sec:
+            summary += f", {self.tokens_per_sec:.1f} tokens/s"
+        return summary
+
+    def result_preview(self, max_rows: int = 10) -> str:
+        """The first rows of the result as a markdown table."""
+        if not self.rows:
+            return self.result_text or ""
+        columns = self.columns or [f"column {i + 1}" for i in range(len(self.rows[0]))]
+        lines = ["| " + " | ".join(map(str, columns)) + " |", "|" + " --- |" * len(columns)]
+        for row in self.rows[:max_rows]:
+            lines.append("| " + " | ".join(str(value) for value in row) + " |")
+        if len(self.rows) > max_rows:
+            more = "more than " if self.truncated else ""
+            lines.append(f"\n_{more}{len(self.rows) - max_rows} more rows_")
+        return "\n".join(lines)
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        return {"sql_query": self.sql, "result": self.rows, "col_keys": self.columns}
+
+    def __str__(self) -> str:
+        if self.error is not None:
+            return f"Error during query execution: {self.error}"
+        return self.response or ""
+
+
+async def _call_directly(fn: Callable, *args, follow_up: bool = False):
+    return fn(*args)
+
+
+class SQLChatPipeline:
+    """
+    The two LLM calls NLSQLTableQueryEngine makes (question -> SQL, rows -> answer) with
+    the SQL execution in between, as separate steps, so a scheduler can hand the LLM to
+    another session while this one's SQL runs.
+
+    data_version identifies the contents of the database; with a query_cache, generated
+    SQL is reused per schema and results per data version. With an embed_model and a
+    semantic_cache, paraphrases of earlier questions reuse their SQL as well, after
+    revalidate_sql() accepts it for the new question.
+
+    The schema in the text-to-SQL prompt is the compact one from SchemaPromptBuilder,
+    including the user's column_descriptions, pruned to schema_tokens for wide tables.
+    With a prefix_cache, the llama.cpp state after the instruction and schema is saved per
+    model, dataset and schema, so each question only pays prefill for its own tokens.
+    With fast_path, simple aggregates and lookups are answered by a QueryRouter without the LLM.
+    With auto_index, the columns the SQL filters and groups on get indexes once they are used often.
+    With sql_guard, the SQL runs read-only, after a cost check and under a time budget, and only
+    the first rows of a large result reach the synthesis prompt; guard.stream() has all of them.
+    With answer_mode="table", questions are answered with the result and a templated summary and
+    the synthesis call is skipped, unless a question asks for another mode; explain() synthesizes
+    the prose for such an answer later.
+    """
+
+    def __init__(self, sql_database, tables: List[str], llm, data_version: Optional[str] = None,
+                 query_cache: Optional[QueryCache] = None, embed_model=None,
+                 semantic_cache: Optional[SemanticQuestionCache] = None, revalidate: bool = True,
+                 column_descriptions: Optional[Dict[str, str]] = None, tokenizer=None,
+                 schema_tokens: int = DEFAULT_SCHEMA_TOKENS, context_window: Optional[int] = None,
+                 max_new_tokens: int = 0, prefix_cache: Optional[PrefixStateCache] = None,
+                 model_name: str = "", fast_path: bool = True, auto_index: bool = True,
+                 sql_guard: bool = True, answer_mode: str = SYNTHESIZE):
+        if answer_mode not in ANSWER_MODES:
+            raise ValueError(f"answer_mode must be one of {ANSWER_MODES}, not {answer_mode!r}")
+        from llama_index.core.prompts.default_prompts import DEFAULT_TEXT_TO_SQL_PROMPT
+        from llama_index.core.indices.struct_store.sql_query import DEFAULT_RESPONSE_SYNTHESIS_PROMPT_V2
+
+        self.sql_database = sql_database
+        self.tables = tables
+        self.llm = llm
+        self.data_version = data_version or str(sql_database.engine.url)
+        self.query_cache = query_cache
+        self.embed_model = embed_model
+        self.semantic_cache = semantic_cache
+        self.revalidate = revalidate
+        self.text_to_sql_prompt = DEFAULT_TEXT_TO_SQL_PROMPT
+        self.synthesis_prompt = DEFAULT_RESPONSE_SYNTHESIS_PROMPT_V2
+        self.tokenizer = tokenizer
+        self.schema_builders = [
+            SchemaPromptBuilder(sql_database, t, column_descriptions, tokenizer, schema_tokens // len(tables))
+            for t in tables
+        ]
+        self.result_tokens = DEFAULT_RESULT_TOKENS
+        if context_window:
+            self.result_tokens = int((context_window - max_new_tokens) * RESULT_CONTEXT_SHARE)
+        # Prompt tokens of the latest call per step
+        self.prompt_tokens: Dict[str, int] = {}
+        self.prefix_cache = prefix_cache
+        self.router = None
+        if fast_path and len(tables) == 1:
+            self.router = QueryRouter(sql_database, self.schema_builders[0])
+            # Indexed while the dataset is being loaded, not on the first question
+            self.router.start_indexing()
+        self.indexer = None
+        db_path = sql_database.engine.url.database
+        if (auto_index and len(tables) == 1 and sql_database.engine.dialect.name == "sqlite"
+                and db_path and os.path.exists(db_path)):
+            self.indexer = get_indexer(db_path, tables[0])
+        self.guard = SQLGuard(sql_database.engine) if sql_guard else None
+        self.model_name = model_name
+        self.answer_mode = answer_mode
+        self._fingerprint: Optional[str] = None
+        self._prefix: Optional[str] = None
+
+    @property
+    def schema(self) -> str:
+        """Every column of every table, as the prompt shows them when nothing has to be pruned."""
+        return "\n\n".join(b.full_schema for b in self.schema_builders)
+
+    def schema_for(self, question: str) -> str:
+        return "\n\n".join(b.build(question) for b in self.schema_builders)
+
+    @property
+    def schema_fingerprint(self) -> str:
+        # Names, types and descriptions only: sample values change with the data, the SQL does not
+        if self._fingerprint is None:
+            self._fingerprint = fingerprint("\n".join(
+                f"{b.table}.{c.name} {c.sql_type} {c.description}" for b in self.schema_builders for c in b.columns))
+        return self._fingerprint
+
+    def _log_prompt(self, step: str, prompt, **kwargs) -> None:
+        tokens = count_tokens(prompt.format(llm=self.llm, **kwargs), self.tokenizer)
+        self.prompt_tokens[step] = tokens
+        print(f"Prompt tokens for {step}: {tokens}")
+
+    def _prompt_text(self, prompt, **kwargs) -> str:
+        # The text llama.cpp gets from llm.predict(prompt, **kwargs)
+        get_prompt = getattr(self.llm, "_get_prompt", None)
+        text = get_prompt(prompt, **kwargs) if get_prompt else prompt.format(llm=self.llm, **kwargs)
+        to_prompt = getattr(self.llm, "completion_to_prompt", None)
+        return to_prompt(text) if to_prompt else text
+
+    @property
+    def static_prefix(self) -> str:
+        """
+        Start of the text-to-SQL prompt that is the same for every question: the instruction
+        and, unless it has to be pruned per question, the schema.
+        """
+        if self._prefix is None:
+            fits = all(b.fits() for b in self.schema_builders)
+            text = self._prompt_text(self.text_to_sql_prompt, query_str=_QUESTION_MARK,
+                                     schema=self.schema if fits else _QUESTION_MARK,
+                                     dialect=self.sql_database.dialect)
+            self._prefix = text[:text.index(_QUESTION_MARK)]
+        return self._prefix
+
+    def generate_sql(self, question: str) -> str:
+        with tracer.span("prompt_build", step="generate_sql") as span:
+            kwargs = dict(query_str=question, schema=self.schema_for(question), dialect=self.sql_database.dialect)
+            self._log_prompt("generate_sql", self.text_to_sql_prompt, **kwargs)
+            span.set(prompt_tokens=self.prompt_tokens["generate_sql"])
+        if self.prefix_cache is not None:
+            key = self.prefix_cache.key(self.model_name, self.data_version, self.schema_fingerprint)
+            self.prefix_cache.prepare(self.llm, key, self.static_prefix)
+        completion = self._complete("generate_sql", self.text_to_sql_prompt, **kwargs)
+        return parse_sql(completion)
+
+    def _complete(self, step: str, prompt, on_token: Optional[Callable[[str], Any]] = None, **kwargs) -> str:
+        """
+        The LLM's completion of prompt, streamed so its prefill (up to the first token) and
+        decode are traced apart; each token also goes to on_token.
+        """
+        parts = []
+        started = time.perf_counter()
+        first_token = None
+        for delta in self.llm.stream(prompt, **kwargs):
+            if first_token is None:
+                first_token = time.perf_counter()
+                tracer.record("prefill", first_token - started, step=step,
+                              prompt_tokens=self.prompt_tokens.get(step, 0))
+            parts.append(delta)
+            if on_token is not None:
+                on_token(delta)
+        text = "".join(parts)
+        if first_token is not None:
+            tracer.record("decode", time.perf_counter() - first_token, step=step,
+                          completion_tokens=count_tokens(text, self.tokenizer))
+        return text
+
+    def run_sql(self, sql: str):
+        """(result_text, rows, columns, truncated) for sql."""
+        with tracer.span("sql", sql=sql) as span:
+            if self.guard is not None:
+                result = self.guard.run(sql)
+                span.set(rows=len(result.rows), truncated=result.truncated)
+                return result.text(), result.rows, result.columns, result.truncated
+            result_text, metadata = self.sql_database.run_sql(sql)
+            span.set(rows=len(metadata.get("result") or []))
+            return result_text, metadata.get("result"), metadata.get("col_keys"), False
+
+    def _synthesis_kwargs(self, question: str, sql: str, result_text: str) -> Dict[str, str]:
+        with tracer.span("prompt_build", step="synthesize") as span:
+            # Large results are cut down so the prompt stays inside the context window
+            kwargs = dict(query_str=question, sql_query=sql,
+                          context_str=truncate_to_tokens(result_text, self.result_tokens, self.tokenizer))
+            self._log_prompt("synthesize", self.synthesis_prompt, **kwargs)
+            span.set(prompt_tokens=self.prompt_tokens["synthesize"])
+        return kwargs
+
+    def synthesize(self, question: str, sql: str, result_text: str) -> str:
+        kwargs = self._synthesis_kwargs(question, sql, result_text)
+        return self._complete("synthesize", self.synthesis_prompt, **kwargs).strip()
+
+    def stream_synthesis(self, question: str, sql: str, result_text: str,
+                         on_token: Callable[[str], Any]) -> str:
+        """synthesize(), handing each generated token to on_token as soon as it is decoded."""
+        kwargs = self._synthesis_kwargs(question, sql, result_text)
+        return self._complete("synthesize", self.synthesis_prompt, on_token, **kwargs).strip()
+
+    def revalidate_sql(self, sql: str, question: str) -> bool:
+        """Whether SQL written for a similar question can answer this one."""
+        if not literals_consistent(sql, question):
+            return False
+        try:
+            with self.sql_database.engine.connect() as connection:
+                connection.exec_driver_sql("EXPLAIN " + sql)
+        except Exception:
+            return False
+        return True
+
+    def similar_sql(self, question: str, embedding):
+        """(sql, earlier question, score) reused from a near-duplicate question, or None."""
+        match = self.semantic_cache.lookup(self.schema_fingerprint, embedding)
+        if match is not None:
+            earlier, sql, score = match
+            if not self.revalidate or self.revalidate_sql(sql, question):
+                self.semantic_cache.record(True)
+                return sql, earlier, score
+        self.semantic_cache.record(False)
+        return None
+
+    def invalidate_cache(self) -> None:
+        if self.query_cache is not None:
+            self.query_cache.invalidate(self.schema_fingerprint, self.data_version)
+        if self.semantic_cache is not None:
+            self.semantic_cache.invalidate(self.schema_fingerprint)
+
+    def observe_sql(self, sql: str) -> None:
+        if self.indexer is not None:
+            try:
+                self.indexer.observe(sql)
+            except Exception as e:
+                print(f"Could not track columns of {sql!r}: {e}")
+
+    async def answer(self, question: str,
+                     llm_call: Callable[..., Awaitable] = _call_directly,
+                     sql_call: Callable[..., Awaitable] = _call_directly,
+                     on_event: Optional[Callable[[str, Any], Any]] = None,
+                     mode: Optional[str] = None) -> ChatAnswer:
+        """
+        Answer question, running the LLM steps through llm_call(fn, *args, follow_up=...) and
+        the SQL through sql_call(fn, *args). Steps whose output is cached are skipped.
+        mode overrides the pipeline's answer_mode for this question.
+
+        With on_event, progress is reported as it happens: ("sql", sql) once the SQL exists,
+        ("result", answer) once it has run, ("token", text) for every answer token and
+        finally ("done", answer). Token events come from the thread running the LLM.
+
+        Every question is traced as a "chat" span, with the stages it ran as child spans.
+        """
+        mode = mode or self.answer_mode
+        if mode not in ANSWER_MODES:
+            raise ValueError(f"mode must be one of {ANSWER_MODES}, not {mode!r}")
+        with tracer.span("chat", question=question, mode=mode) as span:
+            answer = await self._answer(question, llm_call, sql_call, on_event, mode)
+            span.set(sql=answer.sql, result_rows=len(answer.rows or []), routed=answer.routed,
+                     reused_sql=answer.reused_from is not None)
+            if answer.error is not None:
+                span.set(error=answer.error)
+        return answer
+
+    async def _answer(self, question: str, llm_call: Callable[..., Awaitable], sql_call: Callable[..., Awaitable],
+                      on_event: Optional[Callable[[str, Any], Any]], mode: str) -> ChatAnswer:
+        answer = ChatAnswer(question)
+        cache = self.query_cache
+        question_started = time.perf_counter()
+
+        def emit(kind, payload):
+            if on_event is not None:
+                on_event(kind, payload)
+
+        def on_token(delta):
+            now = time.perf_counter()
+            if answer.tokens == 0:
+                answer.timings["first_token"] = now - question_started
+                answer.timings["decode_started"] = now
+            answer.tokens += 1
+            answer.timings["decode"] = now - answer.timings["decode_started"]
+            emit("token", delta)
+
+        try:
+            if self.router is not None:
+                started = time.perf_counter()
+                route = await sql_call(self.router.route, question)
+                if route is not None:
+                    # Simple aggregate or lookup: the SQL and the answer need no LLM
+                    answer.routed = True
+                    answer.sql = route.sql
+                    emit("sql", answer.sql)
+                    answer.result_text, answer.rows, answer.columns, answer.truncated = await sql_call(
+                        self.run_sql, answer.sql)
+                    self.observe_sql(answer.sql)
+                    emit("result", answer)
+                    answer.response = route.describe(answer.rows)
+                    on_token(answer.response)
+                    answer.timings["route"] = time.perf_counter() - started
+                    return answer
+
+            started = time.perf_counter()
+            answer.sql = cache.get_sql(question, self.schema_fingerprint) if cache else None
+            if answer.sql is None:
+                embedding = None
+                if self.semantic_cache is not None and self.embed_model is not None:
+                    # Embedding the question takes milliseconds, writing SQL on the LLM takes seconds
+                    embedding = await sql_call(self.embed_model.get_query_embedding, question)
+                    similar = await sql_call(self.similar_sql, question, embedding)
+                    if similar is not None:
+                        answer.sql, earlier, score = similar
+                        answer.reused_from = (earlier, score)
+                if answer.sql is None:
+                    with tracer.span("generate_sql"):
+                        answer.sql = await llm_call(self.generate_sql, question)
+                    if embedding is not None:
+                        self.semantic_cache.add(self.schema_fingerprint, embedding, question, answer.sql)
+                if cache:
+                    cache.put_sql(question, self.schema_fingerprint, answer.sql)
+            answer.timings["generate_sql"] = time.perf_counter() - started
+            emit("sql", answer.sql)
+
+            started = time.perf_counter()
+            cached = cache.get_result(answer.sql, self.data_version) if cache else None
+            if cached is None:
+                answer.result_text, answer.rows, answer.columns, answer.truncated = await sql_call(
+                    self.run_sql, answer.sql)
+                self.observe_sql(answer.sql)
+                if cache:
+                    cached = cache.put_result(answer.sql, self.data_version, answer.result_text,
+                                              answer.rows, answer.columns, answer.truncated)
+            else:
+                answer.result_text, answer.rows, answer.columns = cached.result_text, cached.rows, cached.columns
+                answer.truncated = cached.truncated
+            answer.timings["run_sql"] = time.perf_counter() - started
+            emit("result", answer)
+
+            if mode == TABLE:
+                # The table is the answer; the prose costs a second LLM call, explain() makes it on request
+                answer.mode = TABLE
+                answer.response = summarize_result(answer.rows, answer.columns, answer.truncated)
+                on_token(answer.response)
+                return answer
+
+            started = time.perf_counter()
+            answer.response = cache.get_answer(cached, question) if cache else None
+            if answer.response is not None:
+                on_token(answer.response)
+            elif on_event is not None:
+                with tracer.span("synthesize"):
+                    answer.response = await llm_call(
+                        self.stream_synthesis, question, answer.sql, answer.result_text, on_token, follow_up=True)
+            else:
+                with tracer.span("synthesize"):
+                    answer.response = await llm_call(
+                        self.synthesize, question, answer.sql, answer.result_text, follow_up=True)
+            if cache:
+                cache.put_answer(cached, question, answer.response)
+            answer.timings["synthesize"] = time.perf_counter() - started
+        except Exception as e:
+            answer.error = str(e)
+        finally:
+            answer.timings.pop("decode_started", None)
+            emit("done", answer)
+        return answer
+
+    async def explain(self, answer: ChatAnswer, llm_call: Callable[..., Awaitable] = _call_directly,
+                      on_token: Optional[Callable[[str], Any]] = None) -> str:
+        """
+        The synthesized answer for an answer given in table mode, e.g. started once its table
+        is shown. Replaces answer.response, which held the templated summary.
+        """
+        if answer.error is not None or answer.sql is None or answer.mode != TABLE:
+            return str(answer)
+        with tracer.span("explain", question=answer.question) as span:
+            started = time.perf_counter()
+            cache = self.query_cache
+            cached = cache.get_result(answer.sql, self.data_version) if cache else None
+            response = cache.get_answer(cached, answer.question) if cache else None
+            span.set(cached=response is not None)
+            if response is not None:
+                if on_token is not None:
+                    on_token(response)
+            else:
+                with tracer.span("synthesize"):
+                    if on_token is not None:
+                        response = await llm_call(self.stream_synthesis, answer.question, answer.sql,
+                                                  answer.result_text, on_token, follow_up=True)
+                    else:
+                        response = await llm_call(self.synthesize, answer.question, answer.sql,
+                                                  answer.result_text, follow_up=True)
+                if cache:
+                    cache.put_answer(cached, answer.question, response)
+            answer.response = response
+            answer.mode = SYNTHESIZE
+            answer.timings["synthesize"] = time.perf_counter() - started
+        return response
+
+    def query(self, question: str, mode: Optional[str] = None) -> ChatAnswer:
+        """Answer question with every step run in the calling thread."""
+        return asyncio.run(self.answer(question, mode=mode))
@@ -0,0 +1,137 @@
+import sqlite3
+from typing import Iterable, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_BATCH_ROWS = 50_000
+
+# Applied for the duration of a load; the file is put back into a plain rollback-journal
+# database afterwards so read-only connections (mode=ro) can still open it.
+LOAD_PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=OFF",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-200000",
+]
+RESTORE_PRAGMAS = [
+    "PRAGMA wal_checkpoint(TRUNCATE)",
+    "PRAGMA journal_mode=DELETE",
+    "PRAGMA synchronous=FULL",
+]
+
+_NATIVE_OBJECT_TYPES = {"string", "integer", "floating", "mixed-integer-float", "empty", "bytes"}
+
+
+def quote_identifier(name) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def sqlite_affinity(dtype) -> str:
+    """SQLite column affinity for a pandas dtype."""
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+    return "TEXT"
+
+
+def _column_values(series: pd.Series) -> List:
+    """Python values for one column slice, with missing values as None."""
+    dtype = series.dtype
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        text = series.dt.strftime("%Y-%m-%d %H:%M:%S")
+        return text.where(series.notna(), None).tolist()
+
+    if isinstance(dtype, np.dtype) and dtype.kind in "iub":
+        # No missing values possible, tolist already yields Python ints
+        return series.tolist()
+
+    mask = series.isna()
+    if isinstance(dtype, np.dtype) and dtype.kind == "f":
+        if not mask.any():
+            return series.tolist()
+        return series.astype(object).where(~mask, None).tolist()
+
+    values = series.astype(object).where(~mask, None).tolist()
+    if pd.api.types.infer_dtype(series, skipna=True) not in _NATIVE_OBJECT_TYPES:
+        # Excel cells can hold datetime/time/Decimal objects sqlite3 cannot bind
+        values = [v if v is None or isinstance(v, (str, int, float, bytes)) else str(v) for v in values]
+    return values
+
+
+class BulkLoader:
+    """
+    Loads DataFrames (or a stream of DataFrame chunks) into one SQLite table with
+    dtype-derived column affinities, one transaction per batch and indexes built last.
+    """
+
+    def __init__(self, db: Union[str, sqlite3.Connection], table: str,
+                 batch_rows: int = DEFAULT_BATCH_ROWS, replace: bool = True):
+        self._owns_connection = not isinstance(db, sqlite3.Connection)
+        self.conn = sqlite3.connect(db) if self._owns_connection else db
+        self.table = table
+        self.batch_rows = batch_rows
+        self.replace = replace
+        self.columns: Optional[List[str]] = None
+        self.rows = 0
+        self._insert_sql = None
+        self._saved_isolation = self.conn.isolation_level
+
+        # Manage transactions explicitly so each batch is exactly one BEGIN/COMMIT
+        self.conn.commit()
+        self.conn.isolation_level = None
+        for pragma in LOAD_PRAGMAS:
+            self.conn.execute(pragma)
+
+    def _create(self, df: pd.DataFrame) -> None:
+        self.columns = [str(c) for c in df.columns]
+        table = quote_identifier(self.table)
+        if self.replace:
+            self.conn.execute(f"DROP TABLE IF EXISTS {table}")
+        column_defs = ", ".join(f"{quote_identifier(c)} {sqlite_affinity(df[c].dtype)}" for c in df.columns)
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({column_defs})")
+        self._insert_sql = (f"INSERT INTO {table} ({', '.join(quote_identifier(c) for c in self.columns)}) "
+                            f"VALUES ({', '.join(['?'] * len(self.columns))})")
+
+    def append(self, df: pd.DataFrame) -> int:
+        if self._insert_sql is None:
+            self._create(df)
+        for start in range(0, len(df), self.batch_rows):
+            batch = df.iloc[start:start + self.batch_rows]
+            # zip over per-column buffers hands executemany one tuple at a time,
+            # no row list or 2-D object array is ever built
+            rows = zip(*(_column_values(batch[c]) for c in batch.columns))
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany(self._insert_sql, rows)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.rows += len(batch)
+        return self.rows
+
+    def finish(self, index_columns: Iterable[str] = ()) -> int:
+        table = quote_identifier(self.table)
+        index_columns = list(index_columns) if self._insert_sql is not None else []
+        for column in index_columns:
+            index = quote_identifier(f"ix_{self.table}_{column}")
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS {index} ON {table} ({quote_identifier(column)})")
+        if index_columns:
+            # Planner statistics, so the new indexes are used only where they help
+            self.conn.execute("ANALYZE")
+        for pragma in RESTORE_PRAGMAS:
+            self.conn.execute(pragma)
+        self.conn.isolation_level = self._saved_isolation
+        if self._owns_connection:
+            self.conn.close()
+        return self.rows
+
+
+def bulk_load(df: pd.DataFrame, db: Union[str, sqlite3.Connection], table: str,
+              index_columns: Iterable[str] = (), batch_rows: int = DEFAULT_BATCH_ROWS) -> int:
+    """Replace table with the contents of df. Returns the number of rows loaded."""
+    loader = BulkLoader(db, table, batch_rows=batch_rows)
+    loader.append(df)
+    return loader.finish(index_columns)
@@ -2,7 +2,18 @@ import streamlit as st
 import pandas as pd
 import os
 import sqlite3
-from sqlalchemy import create_engine
+
+from dataset_cache import DatasetCache
+from ingest import save_upload, load_dataset, chat_database, export_csv
+from data_pager import streamlit_pager
+
+# Uploads at or above this size are streamed into the database instead of loaded whole
+STREAMING_THRESHOLD_MB = 100
+# Upper bound on the memory one ingest chunk may use
+MAX_INGEST_MEMORY_MB = 256
+
+# Parsed uploads and their databases are cached by file content
+dataset_cache = DatasetCache('../.dataset_cache')
 
 # Custom CSS to modify the layout and add the vertical separator
 custom_css = """
@@ -121,33 +132,24 @@ def load_file(file):
         file_path = os.path.join("../uploads", file.name)
         os.makedirs("../uploads", exist_ok=True)  # Create the uploads directory if it doesn't exist
 
-        with open(file_path, "wb") as f:
-            f.write(file.getbuffer())  # Save file to local storage
+        save_upload(file, file_path)  # Save file to local storage in blocks
 
-        # Check the file type and handle accordingly
-        if file.name.endswith('.csv'):
-            df = pd.read_csv(file_path)
-        elif file.name.endswith(('.xls', '.xlsx')):  # Support Excel files
-            df = pd.read_excel(file_path)  # Read Excel file
-        else:
+        if not file.name.endswith(('.csv', '.xls', '.xlsx')):
             st.error("Unsupported file format. Please upload a CSV or Excel file.")
             return None, None, None, None
 
-        # Calculate insights
-        file_size = os.path.getsize(file_path)
-        column_info = df.dtypes.to_frame().reset_index()
-        column_info.columns = ['Column Name', 'Data Type']
-        column_info['Non-Null Count'] = df.notnull().sum().values
-        column_info['Unique Count'] = df.nunique().values
-
-        # Create a summary of the file
-        insights = {
-            "File Size (in bytes)": file_size,
-            "Total Rows": len(df),
-            "Total Columns": len(df.columns)
-        }
+        # Parse (or fetch from the cache) and calculate insights; large files are
+        # streamed chunk by chunk into a database and df is only a preview
+        status = st.empty()
+        dataset = load_dataset(
+            file_path, dataset_cache,
+            streaming_threshold_mb=STREAMING_THRESHOLD_MB, max_memory_mb=MAX_INGEST_MEMORY_MB,
+            on_progress=lambda p: status.text(f"Ingested {p.rows:,} rows ({p.rows_per_sec:,.0f} rows/sec)"))
+        st.session_state.file_digest = dataset.digest
+        st.session_state.streamed = dataset.streamed
+        st.session_state.db_path = dataset.db_path
 
-        return insights, column_info, df, file_path
+        return dataset.insights, dataset.column_info, dataset.df, file_path
 
     except Exception as e:
         st.error(f"Error: {str(e)}")
@@ -158,23 +160,19 @@ def load_file(file):
 def save_csv(df, file_name):
     # Save updated CSV to the uploads folder
     file_path = os.path.join("../uploads", file_name)
-    df.to_csv(file_path, index=False)
-    return file_path
+    # Written chunk by chunk from the cached Parquet copy (or, when streamed, the database)
+    # under the new names, instead of formatting the whole frame at once
+    return export_csv(dataset_cache, st.session_state.get("file_digest"), df, file_path, 'data',
+                      st.session_state.db_path if st.session_state.get("streamed") else None)
 
 
 # Function to convert DataFrame to SQLite database
 def df_to_sql(df):
-    # Create an in-memory SQLite database
-    conn = sqlite3.connect(':memory:')
-    # Save the dataframe to SQL
-    df.to_sql('data', conn, index=False, if_exists='replace')
-    # Now we back it up to a file
-    file_db = sqlite3.connect('../DATABASE.db')
+    # Reuse the cached database for this file and these column names, building it on a miss
+    streamed_db_path = st.session_state.db_path if st.session_state.get("streamed") else None
+    db_path = chat_database(dataset_cache, st.session_state.file_digest, df, 'data', streamed_db_path)
     print("DB CREATED")
-    conn.backup(file_db)
-    file_db.close()
-    conn.close()
-    return 'DATABASE.db'
+    return db_path
 
 
 # Streamlit App Structure
@@ -218,7 +216,6 @@ def main():
         # Check if user clicked "Start Chat"
         if start_chat_button:
             st.session_state.chat_mode = True
-            st.session_state.df_for_sql = st.session_state.df  # Store the current df to convert to SQL
             df_to_sql(st.session_state.df)  # Convert current df to SQL
             st.rerun()  # Use st.rerun() if you're using Streamlit >=1.18
 
@@ -328,16 +325,14 @@ def main():
                             mime="text/csv"
                         )
 
-                    # Show the updated dataframe
-                    st.dataframe(df)
-
             # Display Column Information in a table
             st.subheader("Original Column Insights")
             st.dataframe(column_info)
 
-            # Display the original dataframe (truncated to first 10 rows)
+            # Display the data page by page, fetched from the database under the current column names
             st.subheader("Data")
-            st.dataframe(df.head())
+            streamed_db_path = st.session_state.db_path if st.session_state.get("streamed") else None
+            streamlit_pager(chat_database(dataset_cache, st.session_state.get("file_digest"), df, "data", streamed_db_path), "data")
 
 
 # Run the app
@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Latency buckets of the span histograms, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+METRIC_PREFIX = "csv_ui"
+# Set to a file path to get one JSON line per finished request
+TRACE_LOG_ENV = "CSV_UI_TRACE_LOG"
+
+# Span attributes that are added up into counters
+COUNTED_ATTRS = ("prompt_tokens", "completion_tokens", "rows")
+
+_current: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    def __init__(self, name: str, trace_id: str, parent: Optional["Span"], attrs: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.parent = parent
+        self.attrs = attrs
+        self.started = time.time()
+        self._perf_started = time.perf_counter()
+        self.duration: Optional[float] = None
+        # Finished child spans, only kept on the root span of a trace
+        self.children: List["Span"] = []
+
+    @property
+    def root(self) -> "Span":
+        span = self
+        while span.parent is not None:
+            span = span.parent
+        return span
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"name": self.name, "parent": self.parent.name if self.parent is not None else None,
+                "start": round(self.started, 6), "seconds": round(self.duration or 0.0, 6),
+                "attrs": self.attrs}
+
+
+class _Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.sum += seconds
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+
+
+def _label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Tracer:
+    """
+    Timed spans of the upload and chat pipeline. Spans nest through a context variable, so
+    a span opened while another is open becomes its child, also across the scheduler's
+    threads. A span without a parent is a trace: when it ends, it is written with all
+    its child spans as one line of the JSONL trace log, if there is one.
+
+    Every span's duration goes into a latency histogram per span name, and its
+    prompt_tokens, completion_tokens and rows attributes into counters, all of which
+    metrics() renders in the Prometheus text format.
+    """
+
+    def __init__(self, trace_log: Optional[str] = None):
+        self.trace_log = trace_log if trace_log is not None else os.environ.get(TRACE_LOG_ENV)
+        self._histograms: Dict[str, _Histogram] = {}
+        self._counters: Dict[Tuple[str, str], float] = {}
+        self._errors: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **attrs) -> Iterator[Span]:
+        parent = _current.get()
+        trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+        span = Span(name, trace_id, parent, attrs)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.set(error=f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            _current.reset(token)
+            self._finish(span, time.perf_counter() - span._perf_started)
+
+    def record(self, name: str, seconds: float, **attrs) -> Span:
+        """A span that already happened, e.g. the total parse time of a chunked load."""
+        parent = _current.get()
+        span = Span(name, parent.trace_id if parent is not None else uuid.uuid4().hex, parent, attrs)
+        span.started -= seconds
+        self._finish(span, seconds)
+        return span
+
+    def _finish(self, span: Span, seconds: float) -> None:
+        span.duration = seconds
+        with self._lock:
+            self._histograms.setdefault(span.name, _Histogram()).observe(seconds)
+            for attr in COUNTED_ATTRS:
+                value = span.attrs.get(attr)
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    key = (span.name, attr)
+                    self._counters[key] = self._counters.get(key, 0) + value
+            if "error" in span.attrs:
+                self._errors[span.name] = self._errors.get(span.name, 0) + 1
+            if span.parent is not None:
+                span.root.children.append(span)
+                return
+        if self.trace_log:
+            self._write_trace(span)
+
+    def _write_trace(self, root: Span) -> None:
+        line = {"trace_id": root.trace_id, **root.to_dict(),
+                "spans": [child.to_dict() for child in sorted(root.children, key=lambda s: s.started)]}
+        try:
+            with self._lock, open(self.trace_log, "a", encoding="utf-8") as f:
+                f.write(json.dumps(line, default=str) + "\n")
+        except OSError as e:
+            print(f"Could not write trace log {self.trace_log}: {e}")
+
+    def metrics(self) -> str:
+        """Histograms and counters in the Prometheus text exposition format."""
+        seconds = f"{METRIC_PREFIX}_span_seconds"
+        lines = [f"# HELP {seconds} Duration of pipeline stages.", f"# TYPE {seconds} histogram"]
+        with self._lock:
+            for name, histogram in sorted(self._histograms.items()):
+                label = f'span="{_label(name)}"'
+                for bound, count in zip(BUCKETS, histogram.buckets):
+                    lines.append(f'{seconds}_bucket{{{label},le="{bound}"}} {count}')
+                lines.append(f'{seconds}_bucket{{{label},le="+Inf"}} {histogram.count}')
+                lines.append(f"{seconds}_sum{{{label}}} {histogram.sum}")
+                lines.append(f"{seconds}_count{{{label}}} {histogram.count}")
+
+            for attr in COUNTED_ATTRS:
+                metric = f"{METRIC_PREFIX}_{attr}_total"
+                lines += [f"# HELP {metric} {attr.replace('_', ' ').capitalize()} of pipeline stages.",
+                          f"# TYPE {metric} counter"]
+                for (name, counted), value in sorted(self._counters.items()):
+                    if counted == attr:
+                        lines.append(f'{metric}{{span="{_label(name)}"}} {value}')
+
+            errors = f"{METRIC_PREFIX}_span_errors_total"
+            lines += [f"# HELP {errors} Pipeline stages that raised.", f"# TYPE {errors} counter"]
+            for name, count in sorted(self._errors.items()):
+                lines.append(f'{errors}{{span="{_label(name)}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._errors.clear()
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+tracer = Tracer()
@@ -0,0 +1,287 @@
+import os
+import json
+import pickle
+import sqlite3
+import hashlib
+from typing import Any, Callable, Iterable, List, Optional, Sequence
+
+import pandas as pd
+
+from dataset_cache import DatasetCache, file_digest
+from ingest import DEFAULT_CHUNK_ROWS, DEFAULT_MAX_MEMORY_MB, PREVIEW_ROWS, LoadedDataset, iter_file_chunks
+from frame_memory import ORIGINAL_COLUMNS
+from profiler import ColumnProfiler
+from sqlite_loader import _column_values, quote_identifier
+
+# Hidden tables next to the data table: key hash -> (row hash, rowid), and upsert bookkeeping
+ROW_INDEX_TABLE = "__row_index"
+STATE_TABLE = "__upsert_state"
+INCOMING_TABLE = "__incoming"
+UPSERT_MODES = ("append", "upsert")
+
+
+def _row_hash(*values) -> int:
+    # Called by SQLite with values as stored, so a row hashes the same in the table and in a delta
+    return int.from_bytes(hashlib.blake2b(repr(values).encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path)
+    conn.create_function("row_hash", -1, _row_hash, deterministic=True)
+    return conn
+
+
+def _hash_sql(columns: Sequence[str]) -> str:
+    return f"row_hash({', '.join(quote_identifier(c) for c in columns)})"
+
+
+def _get_state(conn: sqlite3.Connection, name: str, default=None):
+    _ensure_state(conn)
+    row = conn.execute(f"SELECT value FROM {STATE_TABLE} WHERE name = ?", (name,)).fetchone()
+    return default if row is None else row[0]
+
+
+def _ensure_state(conn: sqlite3.Connection) -> None:
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {STATE_TABLE} (name TEXT PRIMARY KEY, value BLOB)")
+
+
+def _set_state(conn: sqlite3.Connection, name: str, value) -> None:
+    _ensure_state(conn)
+    conn.execute(f"INSERT OR REPLACE INTO {STATE_TABLE} (name, value) VALUES (?, ?)", (name, value))
+
+
+def data_version(db_path: str) -> str:
+    """db_path plus the number of upserts applied to it in place, for the pipelines' result caches."""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        row = conn.execute(f"SELECT value FROM {STATE_TABLE} WHERE name = 'version'").fetchone()
+    except sqlite3.OperationalError:
+        # Never upserted: no state table
+        row = None
+    finally:
+        conn.close()
+    return f"{db_path}@{row[0]}" if row and row[0] else db_path
+
+
+class UpsertResult:
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        # Changed rows left alone in append mode
+        self.skipped = 0
+        self.rows = 0
+        self.version = 0
+        self.column_info: Optional[pd.DataFrame] = None
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.inserted or self.updated)
+
+    def __str__(self):
+        return (f"{self.inserted:,} rows added, {self.updated:,} updated, {self.unchanged:,} unchanged"
+                + (f", {self.skipped:,} changed rows skipped" if self.skipped else ""))
+
+
+def _build_row_index(conn: sqlite3.Connection, table: str, columns: List[str], key_columns: List[str]) -> None:
+    t = quote_identifier(table)
+    conn.execute(f"DROP TABLE IF EXISTS {ROW_INDEX_TABLE}")
+    conn.execute(f"CREATE TABLE {ROW_INDEX_TABLE} (key_hash INTEGER PRIMARY KEY, row_hash INTEGER NOT NULL, "
+                 f"row_id INTEGER NOT NULL)")
+    # Of rows sharing a key, the last one is the one later deltas update
+    conn.execute(f"INSERT OR REPLACE INTO {ROW_INDEX_TABLE} SELECT {_hash_sql(key_columns)}, {_hash_sql(columns)}, "
+                 f"rowid FROM {t} ORDER BY rowid")
+    if key_columns != columns:
+        index = quote_identifier(f"ix_{table}_upsert_key")
+        conn.execute(f"DROP INDEX IF EXISTS {index}")
+        conn.execute(f"CREATE INDEX {index} ON {t} ({', '.join(quote_identifier(c) for c in key_columns)})")
+    _set_state(conn, "key_columns", json.dumps(key_columns))
+
+
+def _profile_table(conn: sqlite3.Connection, table: str, columns: List[str]) -> ColumnProfiler:
+    profiler = ColumnProfiler()
+    select = ", ".join(quote_identifier(c) for c in columns)
+    for chunk in pd.read_sql_query(f"SELECT {select} FROM {quote_identifier(table)}", conn,
+                                   chunksize=DEFAULT_CHUNK_ROWS):
+        profiler.update(chunk)
+    return profiler
+
+
+def _align(chunk: pd.DataFrame, columns: List[str], original_columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    names = [str(c) for c in chunk.columns]
+    if set(names) <= set(columns):
+        return chunk.set_axis(names, axis=1).reindex(columns=columns)
+    if original_columns is not None and len(original_columns) == len(columns):
+        # The file's original column names, the table's were renamed column by column
+        renamed = dict(zip((str(c) for c in original_columns), columns))
+        if set(names) <= set(renamed):
+            return chunk.set_axis([renamed[n] for n in names], axis=1).reindex(columns=columns)
+    raise ValueError(f"Columns not in the table: {', '.join(n for n in names if n not in columns)}")
+
+
+def _apply_chunk(conn: sqlite3.Connection, table: str, columns: List[str], key_columns: List[str],
+                 chunk: pd.DataFrame, mode: str, profiler: ColumnProfiler, result: UpsertResult) -> None:
+    t = quote_identifier(table)
+    inc = f"temp.{INCOMING_TABLE}"
+    select = ", ".join(quote_identifier(c) for c in columns)
+
+    # Same declared types as the table, so the delta is stored (and hashed) exactly as the table would store it
+    conn.execute(f"DROP TABLE IF EXISTS {inc}")
+    conn.execute(f"CREATE TEMP TABLE {INCOMING_TABLE} AS SELECT {select} FROM {t} LIMIT 0")
+    for extra in ("__key", "__hash", "__target", "__old"):
+        conn.execute(f"ALTER TABLE {inc} ADD COLUMN {extra} INTEGER")
+    conn.executemany(f"INSERT INTO {inc} ({select}) VALUES ({', '.join(['?'] * len(columns))})",
+                     zip(*(_column_values(chunk[c]) for c in columns)))
+    conn.execute(f"UPDATE {inc} SET __key = {_hash_sql(key_columns)}, __hash = {_hash_sql(columns)}")
+    # The last row of a key within the delta wins
+    conn.execute(f"DELETE FROM {inc} WHERE rowid NOT IN (SELECT MAX(rowid) FROM {inc} GROUP BY __key)")
+    # Keys are unique from here on; the row index update below looks rows up by key
+    conn.execute(f"CREATE UNIQUE INDEX temp.ix_incoming_key ON {INCOMING_TABLE} (__key)")
+    conn.execute(f"UPDATE {inc} SET (__target, __old) = "
+                 f"(SELECT row_id, row_hash FROM {ROW_INDEX_TABLE} WHERE key_hash = __key)")
+    conn.execute(f"CREATE INDEX temp.ix_incoming_target ON {INCOMING_TABLE} (__target)")
+
+    new = "__old IS NULL"
+    changed = "__old IS NOT NULL AND __old != __hash"
+    counts = conn.execute(f"SELECT SUM({new}), SUM({changed}), SUM(__old = __hash) FROM {inc}").fetchone()
+    inserted, updated, unchanged = (int(n or 0) for n in counts)
+    result.unchanged += unchanged
+    if mode == "append":
+        result.skipped += updated
+        updated = 0
+
+    if inserted:
+        base = conn.execute(f"SELECT IFNULL(MAX(rowid), 0) FROM {t}").fetchone()[0]
+        new_rows = [row[0] for row in conn.execute(f"SELECT rowid FROM {inc} WHERE {new} ORDER BY rowid")]
+        conn.executemany(f"UPDATE {inc} SET __target = ? WHERE rowid = ?",
+                         ((base + i + 1, rowid) for i, rowid in enumerate(new_rows)))
+        profiler.update(pd.read_sql_query(f"SELECT {select} FROM {inc} WHERE {new}", conn))
+        conn.execute(f"INSERT INTO {t} (rowid, {select}) SELECT __target, {select} FROM {inc} WHERE {new}")
+        conn.execute(f"INSERT INTO {ROW_INDEX_TABLE} SELECT __key, __hash, __target FROM {inc} WHERE {new}")
+        result.inserted += inserted
+
+    if updated:
+        replaced = f"rowid IN (SELECT __target FROM {inc} WHERE {changed})"
+        profiler.subtract(pd.read_sql_query(f"SELECT {select} FROM {t} WHERE {replaced}", conn))
+        profiler.update(pd.read_sql_query(f"SELECT {select} FROM {inc} WHERE {changed}", conn))
+        conn.execute(f"UPDATE {t} SET ({select}) = (SELECT {select} FROM {inc} WHERE __target = {t}.rowid) "
+                     f"WHERE {replaced}")
+        conn.execute(f"UPDATE {ROW_INDEX_TABLE} SET row_hash = (SELECT __hash FROM {inc} WHERE __key = key_hash) "
+                     f"WHERE key_hash IN (SELECT __key FROM {inc} WHERE {changed})")
+        result.updated += updated
+    conn.execute(f"DROP TABLE {inc}")
+
+
+def upsert_rows(db_path: str, table: str, chunks: Iterable[pd.DataFrame],
+                key_columns: Optional[Sequence[str]] = None, mode: str = "upsert",
+                on_progress: Optional[Callable[[UpsertResult], Any]] = None,
+                original_columns: Optional[Sequence[str]] = None) -> UpsertResult:
+    """
+    Apply a delta to a SQLite table in place: rows whose key (key_columns, or the whole
+    row when not given) is new are inserted; rows whose key exists but whose content hash
+    differs replace the stored row in "upsert" mode and are skipped (and counted as
+    skipped) in "append" mode. Unchanged rows cost one hash lookup. The delta is applied in one transaction.
+
+    The key/row hashes live in a hidden table built on the first upsert (or when the key
+    columns change); the column profile is kept up to date incrementally with the added
+    and replaced rows, and the data version (see data_version) goes up when anything changed.
+
+    Delta columns are matched to the table's by name, or to the original_columns the
+    table's columns were renamed from.
+    """
+    if mode not in UPSERT_MODES:
+        raise ValueError(f"Unknown upsert mode {mode!r}, expected one of {UPSERT_MODES}")
+    conn = _connect(db_path)
+    try:
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({quote_identifier(table)})")]
+        if not columns:
+            raise ValueError(f"No table {table} in {db_path}")
+        key_columns = [str(c) for c in key_columns] if key_columns else columns
+        missing = [c for c in key_columns if c not in columns]
+        if missing:
+            raise ValueError(f"Key columns not in the table: {', '.join(missing)}")
+
+        # The whole delta is one transaction: a delta that fails halfway leaves the table as it was
+        conn.isolation_level = None
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            has_index = conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (ROW_INDEX_TABLE,)).fetchone()
+            if not has_index or _get_state(conn, "key_columns") != json.dumps(key_columns):
+                _build_row_index(conn, table, columns, key_columns)
+            profile = _get_state(conn, "profile")
+            profiler = pickle.loads(profile) if profile is not None else _profile_table(conn, table, columns)
+
+            result = UpsertResult()
+            for chunk in chunks:
+                _apply_chunk(conn, table, columns, key_columns, _align(chunk, columns, original_columns), mode, profiler, result)
+                if on_progress is not None:
+                    on_progress(result)
+
+            result.version = int(_get_state(conn, "version", 0)) + (1 if result.changed else 0)
+            _set_state(conn, "version", result.version)
+            _set_state(conn, "profile", pickle.dumps(profiler))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if result.changed:
+            # Refreshes planner statistics only where they went stale
+            conn.execute("PRAGMA optimize")
+        result.rows = conn.execute(f"SELECT COUNT(*) FROM {quote_identifier(table)}").fetchone()[0]
+        result.column_info = profiler.to_frame()
+        return result
+    finally:
+        conn.close()
+
+
+def _keep_original_columns(df: pd.DataFrame, original_columns: Optional[Sequence[str]]) -> None:
+    # The preview comes from the renamed table; later deltas may still use the file's names
+    if original_columns is not None and len(original_columns) == len(df.columns):
+        df.attrs[ORIGINAL_COLUMNS] = list(original_columns)
+
+
+def upsert_dataset(cache: DatasetCache, digest: str, db_path: str, delta_path: str, table: str = "data",
+                   key_columns: Optional[Sequence[str]] = None, mode: str = "upsert",
+                   max_memory_mb: Optional[float] = DEFAULT_MAX_MEMORY_MB,
+                   on_progress: Optional[Callable[[UpsertResult], Any]] = None,
+                   original_columns: Optional[Sequence[str]] = None) -> LoadedDataset:
+    """
+    The dataset in db_path with the delta file applied (see upsert_rows). The delta goes
+    into db_path in place, bumping its data version, and the database is then moved (not
+    copied) to the cache entry for the digest of the data plus the delta: cached databases
+    are content-addressed, so the entry it came from no longer holds it and is rebuilt
+    if that data is loaded again.
+    """
+    state = json.dumps([digest, file_digest(delta_path), list(key_columns or []), mode])
+    new_digest = hashlib.blake2b(state.encode("utf-8"), digest_size=16).hexdigest()
+    key = DatasetCache.key(new_digest)
+    cached = cache.load_frame(key)
+    if cached is not None and os.path.exists(cache.database_path(key)):
+        df, meta = cached
+        _keep_original_columns(df, original_columns)
+        return LoadedDataset(meta["insights"], meta["column_info"], df, new_digest, streamed=True,
+                             db_path=cache.database_path(key), descriptions=cache.load_descriptions(key))
+
+    chunks = iter_file_chunks(delta_path, max_memory_mb=max_memory_mb)
+    upserted = upsert_rows(db_path, table, chunks, key_columns, mode, on_progress, original_columns)
+    new_db_path = cache.database(key, lambda path: os.replace(db_path, path), rebuild=True)
+    conn = sqlite3.connect(new_db_path)
+    try:
+        df = pd.read_sql_query(f"SELECT * FROM {quote_identifier(table)} LIMIT {PREVIEW_ROWS}", conn)
+    finally:
+        conn.close()
+    insights = {
+        "File Size (in bytes)": os.path.getsize(new_db_path),
+        "Total Rows": upserted.rows,
+        "Total Columns": len(df.columns),
+        "Added Rows": upserted.inserted,
+        "Updated Rows": upserted.updated,
+        "Unchanged Rows": upserted.unchanged,
+        "Skipped Rows": upserted.skipped,
+    }
+    cache.store_frame(key, df, {"insights": insights, "column_info": upserted.column_info, "streamed": True})
+    _keep_original_columns(df, original_columns)
+    # The column descriptions carry over to the updated data
+    cache.store_descriptions(key, cache.load_descriptions(DatasetCache.key(digest)))
+    return LoadedDataset(insights, upserted.column_info, df, new_digest, streamed=True, db_path=new_db_path,
+                         descriptions=cache.load_descriptions(key))